@@ -0,0 +1,212 @@
+"""Benchmarks for the stages of the `/cgiserver_import` plot pipeline.
+
+Run from the repository root:
+
+    python -m backend.benchmarks.bench_pipeline --preset small medium --out results.json
+    python -m backend.benchmarks.bench_pipeline --baseline results.json --fail-on-regression
+
+Each corpus case (preset x dialect) times `sanitize_program`, the ncplot7py
+engine, `build_segments_from_engine_output`, `mock_parse_nc_program` and the
+whole request through the ASGI app, and measures the peak traced memory of one
+run of each. Results are written as JSON; comparing against an earlier results
+file reports the change of every median and flags regressions.
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.testclient import TestClient
+
+try:
+    from backend import main_import
+    from backend.benchmarks.corpus import DIALECTS, PRESETS, preset_machinedata
+except ImportError:
+    import main_import
+    from benchmarks.corpus import DIALECTS, PRESETS, preset_machinedata
+
+RESULTS_VERSION = 1
+
+
+def measure(func: Callable[[], Any], repeat: int = 5, warmup: int = 1) -> Dict[str, Any]:
+    """Wall time of `repeat` runs after `warmup` untimed ones, plus peak memory of one traced run."""
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    # Tracing slows everything down, so memory gets a run of its own
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "runs": repeat,
+        "min_s": min(durations),
+        "median_s": statistics.median(durations),
+        "mean_s": statistics.fmean(durations),
+        "peak_memory_bytes": peak,
+    }
+
+
+def describe_error(error: Exception) -> str:
+    first_line = str(error).splitlines()[0] if str(error) else ""
+    return f"{type(error).__name__}: {first_line}"
+
+
+def run_engine(machinedata: List[Dict[str, Any]]) -> List[Any]:
+    """The engine call of cgiserver_import, without the request handling around it."""
+    programs = [main_import.sanitize_program(entry["program"]) for entry in machinedata]
+    control = main_import.UniversalConfigDrivenControl(
+        count_of_canals=len(programs),
+        canal_names=[entry["canalNr"] for entry in machinedata],
+        init_nc_states=None,
+    )
+    return main_import.NCExecutionEngine(control).get_Syncro_plot(programs, False)
+
+
+def synthetic_engine_output(machinedata: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Engine-shaped canal output built from the mock parser, for when ncplot7py is missing."""
+    output = []
+    for entry in machinedata:
+        mock = main_import.mock_parse_nc_program(main_import.sanitize_program(entry["program"]), entry["machineName"])
+        plot = [
+            {
+                "x": [point["x"] for point in segment["points"]],
+                "y": [point["y"] for point in segment["points"]],
+                "z": [point["z"] for point in segment["points"]],
+                "t": 0 if segment["type"] == "RAPID" else 0.1,
+                "lineNumber": segment["lineNumber"],
+            }
+            for segment in mock["segments"]
+        ]
+        output.append({"plot": plot, "programExec": mock["executedLines"], "variables": {}})
+    return output
+
+
+def bench_case(preset: str, dialect: str, client: TestClient, repeat: int, seed: int = 0) -> Dict[str, Dict[str, Any]]:
+    machinedata = preset_machinedata(preset, dialect, seed)
+    programs = [entry["program"] for entry in machinedata]
+    sanitized = [main_import.sanitize_program(program) for program in programs]
+    blocks = sum(program.count("\n") + 1 for program in programs)
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def record(stage: str, func: Callable[[], Any], **extra: Any):
+        try:
+            result = measure(func, repeat)
+        except Exception as e:
+            # One broken stage should not cost the rest of the run
+            results[f"{preset}/{dialect}/{stage}"] = {"error": describe_error(e)}
+            return
+        result["blocks_per_s"] = blocks / result["median_s"] if result["median_s"] else None
+        result.update(extra)
+        results[f"{preset}/{dialect}/{stage}"] = result
+
+    record("sanitize", lambda: [main_import.sanitize_program(program) for program in programs])
+    record("mock_parse", lambda: [main_import.mock_parse_nc_program(program, machinedata[0]["machineName"]) for program in sanitized])
+
+    engine_output: Optional[List[Any]] = None
+    if main_import.load_engine():
+        try:
+            engine_output = run_engine(machinedata)
+        except Exception as e:
+            results[f"{preset}/{dialect}/engine"] = {"error": describe_error(e)}
+        else:
+            record("engine", lambda: run_engine(machinedata))
+    else:
+        results[f"{preset}/{dialect}/engine"] = {"skipped": "ncplot7py is not importable"}
+    canal_outputs = [canal for canal in engine_output or [] if isinstance(canal, dict)] or synthetic_engine_output(machinedata)
+    record("build_segments", lambda: [main_import.build_segments_from_engine_output(canal) for canal in canal_outputs],
+           synthetic_input=engine_output is None)
+
+    def end_to_end():
+        response = client.post("/cgiserver_import", json={"machinedata": machinedata})
+        response.raise_for_status()
+
+    record("end_to_end", end_to_end)
+    return results
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.1) -> List[Dict[str, Any]]:
+    """Median change of every benchmark present in both runs; slower by more than `tolerance` is a regression."""
+    rows = []
+    for name, result in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before or "median_s" not in before or "median_s" not in result:
+            continue
+        change = result["median_s"] / before["median_s"] - 1 if before["median_s"] else 0.0
+        rows.append({
+            "name": name, "baseline_s": before["median_s"], "current_s": result["median_s"],
+            "change": change, "regressed": change > tolerance,
+        })
+    return rows
+
+
+def run(presets: List[str], dialects: List[str], repeat: int, seed: int = 0) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    with TestClient(main_import.app, raise_server_exceptions=False) as client:
+        for preset in presets:
+            for dialect in dialects:
+                results.update(bench_case(preset, dialect, client, repeat, seed))
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "created_at": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "engine_available": main_import.load_engine(),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the cgiserver_import plot pipeline.")
+    parser.add_argument("--preset", nargs="+", choices=sorted(PRESETS), default=["small", "medium"])
+    parser.add_argument("--dialect", nargs="+", choices=DIALECTS, default=list(DIALECTS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown before a benchmark counts as regressed")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    # The pipeline logs every request at INFO; keep that out of the timings and the output
+    logging.getLogger().setLevel(logging.WARNING)
+    report = run(args.preset, args.dialect, args.repeat, args.seed)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+
+    for name, result in report["results"].items():
+        if "skipped" in result or "error" in result:
+            print(f"{name:40} {'skipped' if 'skipped' in result else 'failed'} ({result.get('skipped') or result['error']})")
+        else:
+            print(f"{name:40} {result['median_s'] * 1000:10.2f} ms {result['blocks_per_s'] or 0:12.0f} blocks/s "
+                  f"{result['peak_memory_bytes'] / 1024:10.0f} KiB")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding="utf-8") as handle:
+        rows = compare(report, json.load(handle), args.tolerance)
+    print()
+    for row in rows:
+        flag = "REGRESSED" if row["regressed"] else ""
+        print(f"{row['name']:40} {row['baseline_s'] * 1000:10.2f} -> {row['current_s'] * 1000:10.2f} ms {row['change']:+8.1%} {flag}")
+    return 1 if args.fail_on_regression and any(row["regressed"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
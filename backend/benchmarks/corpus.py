@@ -0,0 +1,115 @@
+"""Synthetic NC programs for the plot pipeline benchmarks.
+
+Programs are generated from a seed, so the same settings always give the same
+corpus and runs stay comparable. Both dialects mix linear moves, arcs, macro
+loops and C-axis (polar) sections in the proportions asked for.
+"""
+import random
+from typing import Any, Dict, List
+
+DIALECTS = ("fanuc", "siemens")
+
+# Machine names sent with each dialect; the Star turn machine is multi-canal
+MACHINE_NAMES = {
+    "fanuc": "FANUC_STAR_x-D_y-D_z_R",
+    "siemens": "SIEMENS_MILL",
+}
+
+# Named corpus sizes used by the benchmark runner
+PRESETS: Dict[str, Dict[str, Any]] = {
+    "small": {"blocks": 200, "arc_density": 0.2, "macro_loops": 1, "c_axis_sections": 1, "canals": 1},
+    "medium": {"blocks": 2000, "arc_density": 0.3, "macro_loops": 4, "c_axis_sections": 2, "canals": 2},
+    "large": {"blocks": 20000, "arc_density": 0.3, "macro_loops": 10, "c_axis_sections": 4, "canals": 3},
+}
+
+
+def _number(value: float) -> str:
+    return f"{value:.3f}".rstrip("0").rstrip(".") or "0"
+
+
+def _macro_loop(dialect: str, index: int, iterations: int) -> List[str]:
+    if dialect == "fanuc":
+        variable = f"#{100 + index}"
+        return [
+            f"{variable}=0",
+            f"WHILE[{variable}LT{iterations}]DO1",
+            "G91 G1 X0.5 Z-0.2",
+            f"{variable}={variable}+1",
+            "END1",
+            "G90",
+        ]
+    variable = f"R{1 + index}"
+    return [
+        f"{variable}=0",
+        f"WHILE {variable}<{iterations}",
+        "G91 G1 X0.5 Z-0.2",
+        f"{variable}={variable}+1",
+        "ENDWHILE",
+        "G90",
+    ]
+
+
+def _c_axis_section(dialect: str, rng: random.Random, moves: int) -> List[str]:
+    start, end = ("G112", "G113") if dialect == "fanuc" else ("TRANSMIT", "TRAFOOF")
+    lines = [start]
+    for _ in range(moves):
+        lines.append(f"G1 X{_number(rng.uniform(0, 20))} C{_number(rng.uniform(-10, 10))} F200")
+    lines.append(end)
+    return lines
+
+
+def generate_program(dialect: str = "fanuc", blocks: int = 200, arc_density: float = 0.2,
+                     macro_loops: int = 0, c_axis_sections: int = 0, seed: int = 0) -> str:
+    """One program of about `blocks` motion blocks.
+
+    `arc_density` is the share of motion blocks that are G2/G3 arcs. Macro loops
+    and C-axis sections are spread evenly through the program; each adds a few
+    blocks of its own on top of `blocks`.
+    """
+    if dialect not in DIALECTS:
+        raise ValueError(f"Unknown dialect: {dialect}")
+    rng = random.Random(seed)
+    lines = ["O1000" if dialect == "fanuc" else "; benchmark program", "G90 G17 G0 X0 Y0 Z5"]
+    inserts: Dict[int, List[str]] = {}
+    for index in range(macro_loops):
+        inserts.setdefault((index + 1) * blocks // (macro_loops + 1), []).extend(_macro_loop(dialect, index, 5))
+    for index in range(c_axis_sections):
+        position = (2 * index + 1) * blocks // (2 * c_axis_sections)
+        inserts.setdefault(position, []).extend(_c_axis_section(dialect, rng, 10))
+
+    x = y = 0.0
+    for block in range(blocks):
+        lines.extend(inserts.get(block, []))
+        new_x, new_y = rng.uniform(-50, 50), rng.uniform(-50, 50)
+        if rng.random() < arc_density:
+            # Radius at least half the chord so the arc exists
+            chord = ((new_x - x) ** 2 + (new_y - y) ** 2) ** 0.5
+            radius = chord / 2 + rng.uniform(0.5, 10)
+            lines.append(f"{rng.choice(('G2', 'G3'))} X{_number(new_x)} Y{_number(new_y)} R{_number(radius)} F300")
+        elif rng.random() < 0.1:
+            lines.append(f"G0 X{_number(new_x)} Y{_number(new_y)}")
+        else:
+            lines.append(f"G1 X{_number(new_x)} Y{_number(new_y)} Z{_number(rng.uniform(-5, 0))} F500")
+        x, y = new_x, new_y
+    lines.append("M30")
+    return "\n".join(lines)
+
+
+def generate_machinedata(dialect: str = "fanuc", canals: int = 1, seed: int = 0, **program_options: Any) -> List[Dict[str, Any]]:
+    """A `/cgiserver_import` request body (`machinedata`) with one program per canal."""
+    if not 1 <= canals <= 3:
+        raise ValueError("canals must be between 1 and 3")
+    return [
+        {
+            "program": generate_program(dialect, seed=seed + canal, **program_options),
+            "machineName": MACHINE_NAMES[dialect],
+            "canalNr": str(canal + 1),
+            "toolValues": [],
+            "customVariables": [],
+        }
+        for canal in range(canals)
+    ]
+
+
+def preset_machinedata(preset: str, dialect: str, seed: int = 0) -> List[Dict[str, Any]]:
+    return generate_machinedata(dialect, seed=seed, **PRESETS[preset])
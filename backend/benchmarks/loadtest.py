@@ -0,0 +1,200 @@
+"""HTTP load test for the plot, machine, syntax and FOCAS endpoints.
+
+Simulated users send a weighted mix of requests as fast as they can, one level
+of concurrency after the other. For each level the report gives throughput,
+error rate and latency percentiles, overall and per endpoint, and names the
+level at which throughput stopped growing (the saturation point).
+
+By default requests go to the app in-process over ASGI, which shows how one
+worker behaves. Pass `--url` to load a running server (uvicorn or gunicorn)
+instead. FOCAS requests go to the `DEMO` controller, with one demo session per
+user. Pass `--controller` with any IP address to use a server started with
+`USE_SIMULATED_FOCAS=1` instead.
+
+    python -m backend.benchmarks.loadtest --concurrency 1 4 16 64 --duration 10
+    python -m backend.benchmarks.loadtest --url http://localhost:8000 --mix plot=1,focas=3 --out load.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+try:
+    from backend.benchmarks.corpus import generate_machinedata
+    from backend.metrics import percentile
+except ImportError:
+    from benchmarks.corpus import generate_machinedata
+    from metrics import percentile
+
+DEFAULT_MIX = {"plot": 4, "machines": 2, "syntax": 2, "focas": 2}
+SYNTAX_CONTROLS = ("FANUC", "SIEMENS")
+# Throughput gain below which the next concurrency level counts as saturated
+SATURATION_GAIN = 0.05
+
+Sample = Tuple[str, float, Optional[int]]
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown scenario: {name}")
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+class LoadUser:
+    """One simulated user; every scenario call appends (endpoint, seconds, status or None) samples."""
+    def __init__(self, client: httpx.AsyncClient, user_id: int, controller: str, machinedata: List[Dict[str, Any]]):
+        self.client = client
+        self.controller = controller
+        self.machinedata = machinedata
+        self.headers = {"X-Demo-Session": f"loadtest-{user_id}"}
+        self.samples: List[Sample] = []
+
+    async def _request(self, name: str, method: str, url: str, **kwargs: Any) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            self.samples.append((name, time.perf_counter() - started, None))
+            return None
+        self.samples.append((name, time.perf_counter() - started, response.status_code))
+        return response
+
+    async def plot(self):
+        await self._request("POST /cgiserver_import", "POST", "/cgiserver_import", json={"machinedata": self.machinedata})
+
+    async def machines(self):
+        await self._request("GET /api/machines", "GET", "/api/machines")
+
+    async def syntax(self):
+        await self._request("GET /api/syntax/{control_type}", "GET", f"/api/syntax/{random.choice(SYNTAX_CONTROLS)}")
+
+    async def focas(self):
+        params = {"ip_address": self.controller}
+        listing = await self._request("GET /api/focas/programs/{path_no}", "GET", "/api/focas/programs/1", params=params)
+        if listing is None or listing.status_code != 200:
+            return
+        programs = listing.json().get("programs", [])
+        if programs:
+            number = random.choice(programs)["number"]
+            await self._request("GET /api/focas/upload/{path_no}/{prog_num}", "GET", f"/api/focas/upload/1/{number}", params=params)
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, duration: float, mix: Dict[str, int],
+                    controller: str, machinedata: List[Dict[str, Any]]) -> Dict[str, Any]:
+    users = [LoadUser(client, user_id, controller, machinedata) for user_id in range(concurrency)]
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.perf_counter() + duration
+
+    async def drive(user: LoadUser):
+        scenarios: Dict[str, Callable[[], Awaitable[None]]] = {name: getattr(user, name) for name in names}
+        while time.perf_counter() < deadline:
+            await scenarios[random.choices(names, weights)[0]]()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(user) for user in users))
+    elapsed = time.perf_counter() - started
+    return summarize([sample for user in users for sample in user.samples], concurrency, elapsed)
+
+
+def _latency_summary(samples: List[Sample], elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(seconds for _, seconds, _ in samples)
+    errors = sum(1 for _, _, status in samples if status is None or status >= 400)
+    return {
+        "requests": len(samples),
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+def summarize(samples: List[Sample], concurrency: int, elapsed: float) -> Dict[str, Any]:
+    endpoints: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        endpoints.setdefault(sample[0], []).append(sample)
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        **_latency_summary(samples, elapsed),
+        "endpoints": {name: _latency_summary(endpoint_samples, elapsed) for name, endpoint_samples in sorted(endpoints.items())},
+    }
+
+
+def saturation_point(levels: List[Dict[str, Any]]) -> Optional[int]:
+    """Concurrency after which more users no longer raised throughput by SATURATION_GAIN."""
+    for previous, current in zip(levels, levels[1:]):
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 + SATURATION_GAIN):
+            return previous["concurrency"]
+    return None
+
+
+def _client(url: Optional[str]) -> httpx.AsyncClient:
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=60)
+    try:
+        from backend import main_import
+    except ImportError:
+        import main_import
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main_import.app, raise_app_exceptions=False), base_url="http://loadtest", timeout=60)
+
+
+async def run(concurrency_levels: List[int], duration: float, mix: Dict[str, int], url: Optional[str] = None,
+              controller: str = "DEMO", plot_blocks: int = 200, seed: int = 0) -> Dict[str, Any]:
+    random.seed(seed)
+    machinedata = generate_machinedata("siemens", blocks=plot_blocks, arc_density=0.2, seed=seed)
+    levels = []
+    async with _client(url) as client:
+        for concurrency in concurrency_levels:
+            levels.append(await run_level(client, concurrency, duration, mix, controller, machinedata))
+    return {
+        "target": url or "in-process",
+        "mix": mix,
+        "duration_s": duration,
+        "controller": controller,
+        "levels": levels,
+        "saturation_concurrency": saturation_point(levels),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the NC-Edit7 backend at rising concurrency.")
+    parser.add_argument("--url", help="Base URL of a running server; default is the app in-process")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per concurrency level")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="Scenario weights, e.g. plot=4,machines=2,syntax=2,focas=2")
+    parser.add_argument("--controller", default="DEMO", help="FOCAS controller address for the focas scenario")
+    parser.add_argument("--plot-blocks", type=int, default=200, help="Motion blocks in the plotted program")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(run(args.concurrency, args.duration, args.mix, args.url, args.controller, args.plot_blocks, args.seed))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+
+    print(f"{'users':>6} {'req/s':>9} {'errors':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for level in report["levels"]:
+        print(f"{level['concurrency']:>6} {level['throughput_rps']:>9.1f} {level['error_rate']:>7.1%} {level['p50_ms']:>9.1f} "
+              f"{level['p90_ms']:>9.1f} {level['p99_ms']:>9.1f} {level['max_ms']:>9.1f}")
+    saturation = report["saturation_concurrency"]
+    print(f"\nThroughput stops growing after {saturation} users." if saturation else "\nNo saturation within the tested levels.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
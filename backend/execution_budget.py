@@ -0,0 +1,306 @@
+import contextvars
+import ctypes
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Server-wide limits of one plot request; a request may ask for less, never for more (0 disables a limit)
+PLOT_MAX_SECONDS = float(os.environ.get("PLOT_MAX_SECONDS", "10"))
+PLOT_MAX_BLOCKS = int(os.environ.get("PLOT_MAX_BLOCKS", "500000"))
+PLOT_MAX_POINTS = int(os.environ.get("PLOT_MAX_POINTS", "2000000"))
+# Seconds a stopped engine thread gets to unwind before it is left behind
+PLOT_STOP_GRACE = float(os.environ.get("PLOT_STOP_GRACE", "2"))
+# Engine threads left behind and still running, from which on plot requests are refused (0 disables)
+PLOT_MAX_ABANDONED_THREADS = int(os.environ.get("PLOT_MAX_ABANDONED_THREADS", "4"))
+
+
+class ExecutionBudget:
+    """Wall-clock seconds, executed blocks and plot points one plot request may use."""
+    __slots__ = ("max_seconds", "max_blocks", "max_points")
+
+    def __init__(self, max_seconds: float = PLOT_MAX_SECONDS, max_blocks: int = PLOT_MAX_BLOCKS, max_points: int = PLOT_MAX_POINTS):
+        self.max_seconds = max_seconds
+        self.max_blocks = max_blocks
+        self.max_points = max_points
+
+    @classmethod
+    def from_request(cls, requested: Any) -> "ExecutionBudget":
+        """The server limits, lowered by a request's `budget` object (maxSeconds, maxBlocks, maxPoints)."""
+        budget = cls()
+        if not isinstance(requested, dict):
+            return budget
+        for key, attribute, kind in (("maxSeconds", "max_seconds", float), ("maxBlocks", "max_blocks", int), ("maxPoints", "max_points", int)):
+            try:
+                value = kind(requested[key])
+            except (KeyError, TypeError, ValueError):
+                continue
+            limit = getattr(budget, attribute)
+            if value > 0 and (limit <= 0 or value < limit):
+                setattr(budget, attribute, value)
+        return budget
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"maxSeconds": self.max_seconds, "maxBlocks": self.max_blocks, "maxPoints": self.max_points}
+
+
+class BudgetExceeded(Exception):
+    """A plot run hit one of its limits: "time", "blocks" or "points"."""
+    def __init__(self, limit: str, allowed: float, used: float):
+        super().__init__(f"Execution budget exceeded: {limit} ({used:g} > {allowed:g})")
+        self.limit = limit
+        self.allowed = allowed
+        self.used = used
+
+    def to_error(self) -> Dict[str, Any]:
+        """Entry for the response's `errors` list, shaped like the engine's NC errors."""
+        messages = {
+            "time": f"Execution stopped after {self.allowed:g} s; the program may loop forever.",
+            "blocks": f"Execution stopped after {self.allowed:g} blocks; later blocks are not plotted.",
+            "points": f"Plot stopped after {self.allowed:g} points; later moves are not plotted.",
+        }
+        return {
+            "type": "BUDGET_EXCEEDED",
+            "code": self.limit,
+            "line": None,
+            "message": messages[self.limit],
+            "value": f"{self.used:g}",
+            "budget": {"limit": self.limit, "allowed": self.allowed, "used": self.used},
+        }
+
+
+class EngineBusy(Exception):
+    """Too many engine threads that missed their budget are still running; another plot would add one more."""
+    def __init__(self, abandoned: int):
+        super().__init__(f"{abandoned} stopped plot engine threads are still running")
+        self.abandoned = abandoned
+
+
+class BudgetMeter:
+    """Counts the blocks and points of a running ncplot7py engine and ends the run at its budget.
+
+    attach() puts a meter in front of the handler chain of each canal, which
+    handles one executed block at a time. Before a block is handed on the
+    meter checks the counts and the expired flag set by the watchdog. On a hit
+    it ends the canal's node chain, as M30 does, so the engine returns the
+    plot up to that block; later canals stop at their first block.
+
+    These are private ncplot7py internals (checked against ncplot7py 0.2.0):
+    the control's `_canals` dict, and each canal's `_chain` and `_tool_path`.
+    When an engine lacks them, attach() logs a warning naming what is missing,
+    and runs are only stopped by the watchdog's exception and cut afterwards.
+    """
+    def __init__(self, budget: ExecutionBudget):
+        self.budget = budget
+        self.blocks = 0
+        self.points = 0
+        self.exceeded: Optional[BudgetExceeded] = None
+        self._started = time.perf_counter()
+        self._expired_after: Optional[float] = None
+
+    def attach(self, control: Any) -> bool:
+        """Meter every canal of `control`; False, with a warning, when it lacks the internals the meter needs."""
+        canals = getattr(control, "_canals", None)
+        if not isinstance(canals, dict) or not canals:
+            _warn_unmetered(f"{type(control).__name__}._canals")
+            return False
+        missing = sorted(
+            {f"{type(canal).__name__}._chain" for canal in canals.values() if getattr(canal, "_chain", None) is None}
+            | {f"{type(canal).__name__}._tool_path" for canal in canals.values() if not hasattr(canal, "_tool_path")}
+        )
+        if missing:
+            _warn_unmetered(", ".join(missing))
+            return False
+        for canal in canals.values():
+            canal._chain = _MeteredChain(canal._chain, canal, self)
+        return True
+
+    def expire(self, seconds: float):
+        """Called by the watchdog at the deadline; the next block ends the run."""
+        self._expired_after = seconds
+
+    def _check(self, new_points: int) -> Optional[BudgetExceeded]:
+        if self.exceeded is None:
+            self.blocks += 1
+            self.points += new_points
+            budget = self.budget
+            if self._expired_after is not None:
+                self.exceeded = BudgetExceeded("time", self._expired_after, round(time.perf_counter() - self._started, 3))
+            elif 0 < budget.max_blocks < self.blocks:
+                self.exceeded = BudgetExceeded("blocks", budget.max_blocks, self.blocks)
+            elif 0 < budget.max_points < self.points:
+                self.exceeded = BudgetExceeded("points", budget.max_points, self.points)
+        return self.exceeded
+
+
+_unmetered_warned = False
+
+
+def _warn_unmetered(missing: str):
+    # Once per process: every plot would repeat it, and the cause is the installed engine version
+    global _unmetered_warned
+    if not _unmetered_warned:
+        _unmetered_warned = True
+        logger.warning("The ncplot7py engine cannot be metered, it lacks %s; block and point budgets only cut "
+                       "its finished output, and time budgets stop it with an exception", missing)
+
+
+class _MeteredChain:
+    """Stands in for a canal's handler chain; everything but handle() goes to the real chain."""
+    def __init__(self, chain: Any, canal: Any, meter: BudgetMeter):
+        self._chain = chain
+        self._canal = canal
+        self._meter = meter
+        self._tool_path: Optional[list] = None
+        self._counted = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._chain, name)
+
+    def handle(self, node: Any, state: Any) -> Any:
+        # The canal appends the previous block's points after handle() returned, and starts a new list per run
+        tool_path = self._canal._tool_path
+        if tool_path is not self._tool_path:
+            self._tool_path, self._counted = tool_path, 0
+        new_points = sum(len(entry[0]) for entry in tool_path[self._counted:])
+        self._counted = len(tool_path)
+        if self._meter._check(new_points) is not None:
+            node._next_ncCode = None
+            return None, 0.0
+        return self._chain.handle(node, state)
+
+
+class _EngineStopped(BaseException):
+    """Raised inside a runaway engine thread; a BaseException, so the engine's `except Exception` cannot swallow it."""
+
+
+def _raise_in_thread(thread: threading.Thread, exc_type: type) -> bool:
+    # Delivered the next time the thread runs Python code; C code in progress is not interrupted
+    return ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread.ident), ctypes.py_object(exc_type)) == 1
+
+
+_abandoned_lock = threading.Lock()
+_abandoned_threads = 0
+
+
+def abandoned_engine_threads() -> int:
+    """Engine threads left behind after their budget that are still running."""
+    return _abandoned_threads
+
+
+def run_with_time_budget(func: Callable[[], Any], seconds: float, meter: Optional[BudgetMeter] = None) -> Any:
+    """Run `func` in a watched thread and return its result, or raise BudgetExceeded after `seconds`.
+
+    At the deadline an attached `meter` ends the run at the next block, and
+    `func` returns what it has. Otherwise, or if that takes longer than
+    PLOT_STOP_GRACE seconds, the thread is stopped with an exception, so its
+    finally blocks run. A thread that does not stop within another
+    PLOT_STOP_GRACE seconds is left behind as a daemon. While
+    PLOT_MAX_ABANDONED_THREADS of those still run, EngineBusy is raised
+    instead. `seconds <= 0` runs `func` directly.
+    """
+    global _abandoned_threads
+    if seconds <= 0:
+        return func()
+    if 0 < PLOT_MAX_ABANDONED_THREADS <= _abandoned_threads:
+        raise EngineBusy(_abandoned_threads)
+    outcome: Dict[str, Any] = {}
+    done = threading.Event()
+    # The thread keeps the request's span, log correlation id and stage timer
+    context = contextvars.copy_context()
+
+    def target():
+        global _abandoned_threads
+        try:
+            outcome["result"] = context.run(func)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            with _abandoned_lock:
+                done.set()
+                if outcome.get("abandoned"):
+                    _abandoned_threads -= 1
+
+    thread = threading.Thread(target=target, name="plot-engine", daemon=True)
+    started = time.perf_counter()
+    thread.start()
+    stopped = False
+    if not done.wait(seconds):
+        if meter is not None:
+            meter.expire(seconds)
+            done.wait(PLOT_STOP_GRACE)
+        if not done.is_set():
+            stopped = True
+            _raise_in_thread(thread, _EngineStopped)
+            if not done.wait(PLOT_STOP_GRACE):
+                with _abandoned_lock:
+                    if not done.is_set():
+                        outcome["abandoned"] = True
+                        _abandoned_threads += 1
+                logger.error("Engine thread did not stop within %s s after its budget; leaving it behind (%s running)",
+                             PLOT_STOP_GRACE, _abandoned_threads)
+    if "result" in outcome:
+        return outcome["result"]
+    if stopped:
+        raise BudgetExceeded("time", seconds, round(time.perf_counter() - started, 3))
+    raise outcome["error"]
+
+
+def _entry_points(entry: Any) -> int:
+    if not isinstance(entry, dict):
+        return 0
+    return max(len(entry.get("x", [])), len(entry.get("y", [])), len(entry.get("z", [])))
+
+
+def apply_output_budget(engine_output: List[Any], budget: ExecutionBudget) -> Tuple[List[Any], Optional[BudgetExceeded]]:
+    """Cut engine output after `max_blocks` executed blocks or `max_points` plot points.
+
+    Canals are counted in order and together, so a runaway first canal can
+    use up the budget of the later ones. Returns the (possibly shortened)
+    output, which shares unchanged canals with the input, and the budget hit.
+    """
+    blocks_left = budget.max_blocks if budget.max_blocks > 0 else None
+    points_left = budget.max_points if budget.max_points > 0 else None
+    total_blocks = total_points = 0
+    exceeded: Optional[str] = None
+    limited: List[Any] = []
+    for canal in engine_output:
+        if isinstance(canal, list):
+            canal = {"plot": canal, "programExec": []}
+        if not isinstance(canal, dict):
+            limited.append(canal)
+            continue
+        executed = canal.get("programExec", []) or []
+        plot = canal.get("plot", []) or []
+        total_blocks += len(executed)
+        total_points += sum(_entry_points(entry) for entry in plot)
+
+        cut = False
+        if blocks_left is not None and len(executed) > blocks_left:
+            exceeded, cut = exceeded or "blocks", True
+            # A plot entry comes from one executed block, so later entries belong to cut blocks
+            executed, plot = executed[:blocks_left], plot[:blocks_left]
+        if points_left is not None:
+            points = 0
+            for index, entry in enumerate(plot):
+                count = _entry_points(entry)
+                if points + count > points_left:
+                    exceeded, cut = exceeded or "points", True
+                    remaining = points_left - points
+                    partial = [{**entry, **{axis: entry.get(axis, [])[:remaining] for axis in ("x", "y", "z")}}] if remaining > 0 else []
+                    plot, points = plot[:index] + partial, points_left
+                    break
+                points += count
+            points_left -= points
+        if blocks_left is not None:
+            blocks_left -= len(executed)
+        limited.append({**canal, "programExec": executed, "plot": plot} if cut else canal)
+
+    if exceeded is None:
+        return engine_output, None
+    if exceeded == "blocks":
+        return limited, BudgetExceeded("blocks", budget.max_blocks, total_blocks)
+    return limited, BudgetExceeded("points", budget.max_points, total_points)
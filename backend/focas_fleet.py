@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    from backend.focas_probe import FOCAS_PROBE_MAX_TARGETS, get_probe_cache, probe_port_allowed
+    from backend.focas_service import get_session_registry
+except ImportError:
+    from focas_probe import FOCAS_PROBE_MAX_TARGETS, get_probe_cache, probe_port_allowed
+    from focas_service import get_session_registry
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two polls of the whole fleet
+FOCAS_FLEET_POLL_INTERVAL = float(os.environ.get("FOCAS_FLEET_POLL_INTERVAL", "5"))
+# Snapshots queued per subscriber before older ones are dropped
+FOCAS_FLEET_SUBSCRIBER_QUEUE = 4
+# Seconds a controller stays watched after it was last added (0 keeps it until removed)
+FOCAS_FLEET_WATCH_TTL = float(os.environ.get("FOCAS_FLEET_WATCH_TTL", "3600"))
+
+
+class FleetMonitor:
+    """Shared availability status for every watched controller.
+
+    One background task probes the whole fleet per interval and fans the snapshot
+    out to all subscribers, so the probe traffic a controller sees does not grow
+    with the number of open editor tabs. The task runs while somebody subscribes.
+
+    Anybody may add controllers, so the fleet holds at most `max_controllers`,
+    only on allowed FOCAS ports, and drops a controller `watch_ttl` seconds
+    after it was last added; clients re-add the controllers they still show.
+    """
+    def __init__(self, interval: float = FOCAS_FLEET_POLL_INTERVAL, max_controllers: Optional[int] = None,
+                 watch_ttl: float = FOCAS_FLEET_WATCH_TTL):
+        self.interval = interval
+        # Read at call time by default, like the ping routes' limit
+        self.max_controllers = max_controllers
+        self.watch_ttl = watch_ttl
+        self._controllers: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self._watched_at: Dict[Tuple[str, int], float] = {}
+        self._subscribers: Set["asyncio.Queue[List[Dict[str, Any]]]"] = set()
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._last_poll = 0.0
+
+    def watch(self, ip_address: str, port: int = 8193):
+        """Add a controller, or keep watching it for another `watch_ttl` seconds.
+
+        Raises ValueError for a port that may not be probed, or when the fleet is full.
+        """
+        key = (ip_address.strip(), int(port))
+        if not probe_port_allowed(key[1]):
+            raise ValueError(f"Port {key[1]} is not an allowed FOCAS port.")
+        self._expire()
+        if key not in self._controllers:
+            limit = self.max_controllers if self.max_controllers is not None else FOCAS_PROBE_MAX_TARGETS
+            if len(self._controllers) >= limit:
+                raise ValueError(f"The fleet already watches {limit} controllers.")
+            self._controllers[key] = {
+                "ip_address": key[0], "port": key[1], "available": None,
+                "latency_ms": None, "error": None, "checked_at": None, "changed_at": None,
+            }
+        self._watched_at[key] = time.monotonic()
+
+    def unwatch(self, ip_address: str, port: int = 8193):
+        key = (ip_address.strip(), int(port))
+        self._controllers.pop(key, None)
+        self._watched_at.pop(key, None)
+
+    def _expire(self):
+        if self.watch_ttl <= 0:
+            return
+        deadline = time.monotonic() - self.watch_ttl
+        for key in [key for key, watched_at in self._watched_at.items() if watched_at < deadline]:
+            logger.info("Fleet stops watching %s:%s, not re-added within %s s", key[0], key[1], self.watch_ttl)
+            self.unwatch(*key)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        self._expire()
+        sessions = get_session_registry()
+        result = []
+        for (ip_address, port), status in sorted(self._controllers.items()):
+            session = sessions.get(ip_address, port)
+            result.append({
+                **status,
+                "open_handles": session["open_handles"],
+                "last_connect_ms": session["last_connect_ms"],
+            })
+        return result
+
+    async def poll_once(self) -> List[Dict[str, Any]]:
+        """Probe every watched controller once and publish the new snapshot."""
+        self._last_poll = time.monotonic()
+        self._expire()
+        keys = list(self._controllers)
+        results = await get_probe_cache().probe_many(keys, refresh=True)
+        now = time.time()
+        for key, result in zip(keys, results):
+            status = self._controllers.get(key)
+            if status is None:
+                continue
+            if status["available"] != result["available"]:
+                status["changed_at"] = now
+            status.update(available=result["available"], latency_ms=result["latency_ms"],
+                          error=result.get("error"), checked_at=now)
+        snapshot = self.snapshot()
+        self._publish(snapshot)
+        return snapshot
+
+    async def current(self) -> List[Dict[str, Any]]:
+        """Snapshot that is at most one interval old, polling inline if nobody else did."""
+        if time.monotonic() - self._last_poll > self.interval:
+            return await self.poll_once()
+        return self.snapshot()
+
+    def subscribe(self) -> "asyncio.Queue[List[Dict[str, Any]]]":
+        queue: "asyncio.Queue[List[Dict[str, Any]]]" = asyncio.Queue(maxsize=FOCAS_FLEET_SUBSCRIBER_QUEUE)
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._poll_loop())
+        return queue
+
+    def unsubscribe(self, queue: "asyncio.Queue[List[Dict[str, Any]]]"):
+        self._subscribers.discard(queue)
+
+    def _publish(self, snapshot: List[Dict[str, Any]]):
+        for queue in list(self._subscribers):
+            if queue.full():
+                # A slow client only ever needs the newest state
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+    async def _poll_loop(self):
+        while self._subscribers:
+            try:
+                await self.poll_once()
+            except Exception:
+                logger.exception("Fleet poll failed")
+            await asyncio.sleep(self.interval)
+
+
+_fleet_monitor = FleetMonitor()
+
+
+def get_fleet_monitor() -> FleetMonitor:
+    return _fleet_monitor
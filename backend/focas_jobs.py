@@ -0,0 +1,368 @@
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from threading import Lock, Semaphore
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from backend.focas_service import EW_SOCKET, FocasClientBase, FocasError, FocasTransferCancelled, TransferMonitor, create_focas_client, get_directory_cache, get_program_cache
+except ImportError:
+    from focas_service import EW_SOCKET, FocasClientBase, FocasError, FocasTransferCancelled, TransferMonitor, create_focas_client, get_directory_cache, get_program_cache
+
+logger = logging.getLogger(__name__)
+
+# Background threads running FOCAS jobs (each job may fan out to its own workers)
+FOCAS_JOB_WORKERS = int(os.environ.get("FOCAS_JOB_WORKERS", "4"))
+# Finished jobs kept for status queries before the oldest are forgotten
+FOCAS_JOB_HISTORY = int(os.environ.get("FOCAS_JOB_HISTORY", "100"))
+# Directory receiving backup archives
+FOCAS_BACKUP_DIR = os.environ.get("FOCAS_BACKUP_DIR", os.path.join(tempfile.gettempdir(), "nc-edit7-backups"))
+
+ClientFactory = Callable[[str], FocasClientBase]
+
+
+class FocasJob:
+    """State of one background FOCAS job, shared between its worker and the API.
+
+    `monitor` is handed to every transfer the job runs, so its byte and EW_BUFFER
+    counters show up in the progress and cancel() stops the running transfer.
+    """
+    def __init__(self, kind: str, params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.state = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.error_code: Optional[int] = None
+        self.monitor = TransferMonitor()
+        # Files the job produced (e.g. a backup archive); deleted when the registry forgets the job
+        self.files: List[str] = []
+        self._lock = Lock()
+
+    def set_progress(self, **values):
+        with self._lock:
+            self.progress.update(values)
+
+    def add_progress(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.progress[key] = self.progress.get(key, 0) + value
+
+    def cancel(self):
+        self.monitor.cancel()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("completed", "failed", "cancelled")
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "state": self.state,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "progress": {
+                    **self.progress,
+                    "bytes_transferred": self.monitor.bytes_transferred,
+                    "buffer_retries": self.monitor.buffer_retries,
+                },
+                "cancel_requested": self.monitor.cancelled,
+                "result": self.result,
+                "error": self.error,
+                "error_code": self.error_code,
+            }
+
+
+class FocasJobRegistry:
+    """Runs FOCAS jobs on a small thread pool and keeps their state for polling."""
+    def __init__(self, max_workers: int = FOCAS_JOB_WORKERS, max_history: int = FOCAS_JOB_HISTORY):
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="focas-job")
+        self._jobs: "OrderedDict[str, FocasJob]" = OrderedDict()
+        self._lock = Lock()
+
+    def submit(self, kind: str, params: Dict[str, Any], func: Callable[..., Any], *args) -> FocasJob:
+        """Queue `func(job, *args)`; its return value becomes the job result."""
+        job = FocasJob(kind, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            forgotten = self._forget_finished()
+        for old_job in forgotten:
+            self._delete_files(old_job)
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id: str) -> Optional[FocasJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_count(self) -> int:
+        """Jobs queued or running, which a worker restart would cut off."""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _forget_finished(self) -> List[FocasJob]:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        return [self._jobs.pop(job_id) for job_id in finished[:max(0, len(finished) - self.max_history)]]
+
+    @staticmethod
+    def _delete_files(job: FocasJob):
+        for path in job.files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Could not delete %s of forgotten FOCAS job %s: %s", path, job.id, e)
+
+    @staticmethod
+    def _run(job: FocasJob, func: Callable[..., Any], args: tuple):
+        job.started_at = time.time()
+        try:
+            job.monitor.check()
+            job.state = "running"
+            job.result = func(job, *args)
+            job.state = "completed"
+        except FocasTransferCancelled:
+            logger.info("FOCAS job %s (%s) cancelled", job.id, job.kind)
+            job.state = "cancelled"
+        except Exception as e:
+            logger.exception("FOCAS job %s (%s) failed", job.id, job.kind)
+            job.error = str(e)
+            job.error_code = getattr(e, "code", None)
+            job.state = "failed"
+        finally:
+            job.finished_at = time.time()
+
+
+_job_registry = FocasJobRegistry()
+
+
+def get_job_registry() -> FocasJobRegistry:
+    return _job_registry
+
+
+def backup_archive_path(job_id: str) -> str:
+    return os.path.join(FOCAS_BACKUP_DIR, f"focas-backup-{job_id}.zip")
+
+
+def _controller_slots(targets: List[Dict[str, Any]], sessions_per_controller: int) -> Dict[Tuple[str, int], Semaphore]:
+    """One semaphore per (ip, port), so work on the same controller shares its few FOCAS handles."""
+    return {
+        (target["ip_address"], target.get("port", 8193)): Semaphore(max(1, sessions_per_controller))
+        for target in targets
+    }
+
+
+def run_backup(job: FocasJob, controllers: List[Dict[str, Any]], max_parallel_controllers: int = 4,
+               sessions_per_controller: int = 1, client_factory: ClientFactory = create_focas_client) -> Dict[str, Any]:
+    """Upload every program of the given controllers and paths into one zip archive.
+
+    `controllers` holds dicts with `ip_address`, `port` and `paths`. Each
+    (controller, path) pair is one unit of work on its own FOCAS session; at most
+    `sessions_per_controller` of them run against the same controller at once and
+    at most `max_parallel_controllers` run in total. Programs whose directory entry
+    is unchanged since the last upload come from the program text cache.
+    """
+    os.makedirs(FOCAS_BACKUP_DIR, exist_ok=True)
+    archive_path = backup_archive_path(job.id)
+    partial_path = f"{archive_path}.partial"
+
+    # Interleave controllers so busy workers do not all wait on the same controller
+    per_controller = [[(controller, path_no) for path_no in (controller.get("paths") or [0])] for controller in controllers]
+    units = [unit for batch in zip_longest(*per_controller) for unit in batch if unit is not None]
+    controller_slots = _controller_slots(controllers, sessions_per_controller)
+    job.set_progress(units_total=len(units), units_done=0, programs_total=0, programs_done=0,
+                     programs_failed=0, programs_cached=0)
+
+    results: List[Dict[str, Any]] = []
+    results_lock = Lock()
+    archive_lock = Lock()
+
+    def record(entry: Dict[str, Any]):
+        with results_lock:
+            results.append(entry)
+
+    def backup_path(archive: zipfile.ZipFile, controller: Dict[str, Any], path_no: int):
+        ip_address = controller["ip_address"]
+        port = controller.get("port", 8193)
+        folder = f"{ip_address}_{port}/path{path_no}"
+        client = client_factory(ip_address)
+        with controller_slots[(ip_address, port)]:
+            job.monitor.check()
+            try:
+                if not client.connect(ip_address, port):
+                    raise FocasError(EW_SOCKET, f"Failed to connect to CNC {ip_address}:{port}")
+                programs = client.list_programs(path_no)
+                get_directory_cache().put(ip_address, port, path_no, programs)
+                job.add_progress(programs_total=len(programs))
+
+                program_cache = get_program_cache()
+                for entry in programs:
+                    result = {"ip_address": ip_address, "port": port, "path_no": path_no, "number": entry["number"]}
+                    try:
+                        program_text = program_cache.get(ip_address, port, path_no, entry)
+                        result["cached"] = program_text is not None
+                        if program_text is None:
+                            program_text = client.upload_program(entry["number"], path_no, monitor=job.monitor)
+                            program_cache.put(ip_address, port, path_no, entry, program_text)
+                        with archive_lock:
+                            archive.writestr(f"{folder}/O{entry['number']:04d}.nc", program_text)
+                        result.update(status="success", bytes=len(program_text))
+                        job.add_progress(programs_done=1, programs_cached=int(result["cached"]))
+                    except FocasError as e:
+                        result.update(status="error", code=e.code, error=str(e))
+                        job.add_progress(programs_done=1, programs_failed=1)
+                    record(result)
+            except (FocasError, RuntimeError) as e:
+                # The whole path failed (connect or listing); report it as one entry
+                record({
+                    "ip_address": ip_address, "port": port, "path_no": path_no, "number": None,
+                    "status": "error", "code": getattr(e, "code", None), "error": str(e),
+                })
+            finally:
+                client.disconnect()
+                job.add_progress(units_done=1)
+
+    try:
+        with zipfile.ZipFile(partial_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            with ThreadPoolExecutor(max_workers=max(1, max_parallel_controllers), thread_name_prefix="focas-backup") as pool:
+                futures = [pool.submit(backup_path, archive, controller, path_no) for controller, path_no in units]
+                for future in futures:
+                    future.result()
+
+            results.sort(key=lambda item: (item["ip_address"], item["port"], item["path_no"], item["number"] or 0))
+            summary = {
+                "archive": archive_path,
+                "succeeded": sum(1 for item in results if item["status"] == "success"),
+                "failed": sum(1 for item in results if item["status"] != "success"),
+                "programs": results,
+            }
+            archive.writestr("manifest.json", json.dumps(summary, indent=2))
+        os.replace(partial_path, archive_path)
+        job.files.append(archive_path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return summary
+
+
+def run_upload(job: FocasJob, ip_address: str, port: int, path_no: int, prog_num: int,
+               client_factory: ClientFactory = create_focas_client) -> Dict[str, Any]:
+    """Upload one program as a background job; the text becomes the job result."""
+    client = client_factory(ip_address)
+    try:
+        if not client.connect(ip_address, port):
+            raise FocasError(EW_SOCKET, f"Failed to connect to CNC {ip_address}:{port}")
+        entry = client.find_program(prog_num, path_no)
+        if entry is not None:
+            job.set_progress(bytes_total=entry["length"])
+        program_text = client.upload_program(prog_num, path_no, monitor=job.monitor)
+        if entry is not None:
+            get_program_cache().put(ip_address, port, path_no, entry, program_text)
+        return {"number": prog_num, "program_text": program_text}
+    finally:
+        client.disconnect()
+
+
+def run_download(job: FocasJob, ip_address: str, port: int, path_no: int, program_text: str,
+                 only_if_changed: bool = False, client_factory: ClientFactory = create_focas_client) -> Dict[str, Any]:
+    """Download one program as a background job."""
+    job.set_progress(bytes_total=len(program_text))
+    client = client_factory(ip_address)
+    try:
+        if not client.connect(ip_address, port):
+            raise FocasError(EW_SOCKET, f"Failed to connect to CNC {ip_address}:{port}")
+        if only_if_changed:
+            written = client.download_program_if_changed(program_text, path_no, monitor=job.monitor)
+        else:
+            client.download_program(program_text, path_no, monitor=job.monitor)
+            written = True
+        return {"written": written}
+    finally:
+        client.disconnect()
+
+
+def run_deploy(programs: List[str], targets: List[Dict[str, Any]], max_workers: int = 8,
+               only_if_changed: bool = False, client_factory: ClientFactory = create_focas_client,
+               sessions_per_controller: int = 1) -> Dict[str, Any]:
+    """Download the same program set to many (ip, port, path) targets concurrently.
+
+    Every target gets its own session and transfers its programs in order; the first
+    failing program stops that target and the rest are reported as skipped. As in
+    run_backup, at most `sessions_per_controller` targets on the same controller run
+    at once. The wall time is that of the slowest controller, not the sum over all targets.
+    """
+    controller_slots = _controller_slots(targets, sessions_per_controller)
+
+    def deploy_target(target: Dict[str, Any]) -> Dict[str, Any]:
+        # Targets on the same controller (e.g. its paths) take turns for its handles
+        with controller_slots[(target["ip_address"], target.get("port", 8193))]:
+            return deploy_to(target)
+
+    def deploy_to(target: Dict[str, Any]) -> Dict[str, Any]:
+        ip_address = target["ip_address"]
+        port = target.get("port", 8193)
+        path_no = target.get("path_no", 0)
+        result: Dict[str, Any] = {
+            "ip_address": ip_address, "port": port, "path_no": path_no,
+            "status": "success", "code": None, "error": None, "programs": [],
+        }
+        started = time.perf_counter()
+        client = client_factory(ip_address)
+        try:
+            if not client.connect(ip_address, port):
+                raise FocasError(EW_SOCKET, f"Failed to connect to CNC {ip_address}:{port}")
+            result["connect_seconds"] = round(time.perf_counter() - started, 4)
+            for index, program_text in enumerate(programs):
+                program_started = time.perf_counter()
+                entry: Dict[str, Any] = {"index": index}
+                result["programs"].append(entry)
+                try:
+                    if only_if_changed:
+                        entry["written"] = client.download_program_if_changed(program_text, path_no)
+                    else:
+                        client.download_program(program_text, path_no)
+                        entry["written"] = True
+                    entry["status"] = "success"
+                except FocasError as e:
+                    entry.update(status="error", code=e.code, error=str(e))
+                    result.update(status="error", code=e.code, error=str(e))
+                    result["programs"].extend({"index": skipped, "status": "skipped"} for skipped in range(index + 1, len(programs)))
+                    break
+                finally:
+                    entry["seconds"] = round(time.perf_counter() - program_started, 4)
+        except (FocasError, RuntimeError) as e:
+            result.update(status="error", code=getattr(e, "code", None), error=str(e))
+        finally:
+            client.disconnect()
+            result["seconds"] = round(time.perf_counter() - started, 4)
+        return result
+
+    started = time.perf_counter()
+    if not targets:
+        return {"seconds": 0.0, "succeeded": 0, "failed": 0, "targets": []}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets))), thread_name_prefix="focas-deploy") as pool:
+        results = list(pool.map(deploy_target, targets))
+    return {
+        "seconds": round(time.perf_counter() - started, 4),
+        "succeeded": sum(1 for item in results if item["status"] == "success"),
+        "failed": sum(1 for item in results if item["status"] != "success"),
+        "targets": results,
+    }
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from backend.focas_service import is_demo_ip
+except ImportError:
+    from focas_service import is_demo_ip
+
+# Seconds to wait for the FOCAS port to accept a TCP connection
+FOCAS_PROBE_TIMEOUT = float(os.environ.get("FOCAS_PROBE_TIMEOUT", "1.0"))
+# Seconds a probe result is reused for further pings of the same controller
+FOCAS_PROBE_CACHE_TTL = float(os.environ.get("FOCAS_PROBE_CACHE_TTL", "3"))
+# Probes in flight at once for a batch ping
+FOCAS_PROBE_CONCURRENCY = int(os.environ.get("FOCAS_PROBE_CONCURRENCY", "64"))
+# Probe results kept at most; older ones are also dropped once they expire
+FOCAS_PROBE_CACHE_SIZE = int(os.environ.get("FOCAS_PROBE_CACHE_SIZE", "1024"))
+# Controllers one batch ping may probe, and the fleet may watch
+FOCAS_PROBE_MAX_TARGETS = int(os.environ.get("FOCAS_PROBE_MAX_TARGETS", "256"))
+# Ports the ping routes may connect to, so they cannot be used to scan other services from the server
+FOCAS_PROBE_PORTS = frozenset(int(port) for port in os.environ.get("FOCAS_PROBE_PORTS", "8193").split(",") if port.strip())
+
+
+def probe_port_allowed(port: int) -> bool:
+    return port in FOCAS_PROBE_PORTS
+
+
+async def probe_controller(ip_address: str, port: int = 8193, timeout: float = FOCAS_PROBE_TIMEOUT) -> Dict[str, Any]:
+    """Check that the FOCAS port accepts TCP connections and measure the connect latency.
+
+    Unlike ICMP ping this needs no privileges and proves the FOCAS service itself
+    is listening. The connection is closed right after the handshake.
+    """
+    result: Dict[str, Any] = {"ip_address": ip_address, "port": port, "available": False, "latency_ms": None}
+    if is_demo_ip(ip_address):
+        result.update(available=True, latency_ms=0.0)
+        return result
+
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, port), timeout=timeout)
+    except asyncio.TimeoutError:
+        result["error"] = f"No answer within {timeout:g} s"
+        return result
+    except OSError as e:
+        result["error"] = e.strerror or str(e)
+        return result
+
+    result.update(available=True, latency_ms=round((time.perf_counter() - started) * 1000, 2))
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return result
+
+
+class ProbeCache:
+    """Recent probe results per (ip, port); concurrent callers share one probe in flight.
+
+    Results are kept in the order they were stored, so expired ones are swept
+    from the front, and at most `max_size` are kept.
+    """
+    def __init__(self, ttl: float = FOCAS_PROBE_CACHE_TTL, max_size: int = FOCAS_PROBE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._results: "OrderedDict[Tuple[str, int], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._pending: Dict[Tuple[str, int], "asyncio.Future[Dict[str, Any]]"] = {}
+
+    async def probe(self, ip_address: str, port: int = 8193, refresh: bool = False) -> Dict[str, Any]:
+        key = (ip_address.strip(), int(port))
+        cached = self._results.get(key)
+        if cached is not None and not refresh and time.monotonic() - cached[0] <= self.ttl:
+            return {**cached[1], "cached": True}
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(probe_controller(key[0], key[1]))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda done: self._store(key, done))
+        # Shielded so one cancelled caller does not cancel the probe others wait on
+        result = await asyncio.shield(pending)
+        return {**result, "cached": False}
+
+    def _store(self, key: Tuple[str, int], done: "asyncio.Future[Dict[str, Any]]"):
+        self._pending.pop(key, None)
+        if not done.cancelled() and done.exception() is None:
+            now = time.monotonic()
+            self._results.pop(key, None)
+            self._results[key] = (now, done.result())
+            while self._results and (len(self._results) > self.max_size or now - next(iter(self._results.values()))[0] > self.ttl):
+                self._results.popitem(last=False)
+
+    async def probe_many(self, targets: Iterable[Tuple[str, int]], refresh: bool = False,
+                         concurrency: int = FOCAS_PROBE_CONCURRENCY) -> List[Dict[str, Any]]:
+        limit = asyncio.Semaphore(max(1, concurrency))
+
+        async def limited(ip_address: str, port: int) -> Dict[str, Any]:
+            async with limit:
+                return await self.probe(ip_address, port, refresh)
+
+        return list(await asyncio.gather(*(limited(ip_address, port) for ip_address, port in targets)))
+
+    def latest(self, ip_address: str, port: int = 8193) -> Optional[Dict[str, Any]]:
+        cached = self._results.get((ip_address.strip(), int(port)))
+        return cached[1] if cached else None
+
+
+_probe_cache = ProbeCache()
+
+
+def get_probe_cache() -> ProbeCache:
+    return _probe_cache
@@ -1,11 +1,25 @@
 import ctypes
+import hashlib
+import math
 import os
 import re
 import time
 import logging
+from collections import OrderedDict, deque
 from copy import deepcopy
-from threading import Lock
-from typing import Optional, Tuple, Dict, Any
+from datetime import datetime
+from threading import Event, Lock
+from typing import Optional, Tuple, Dict, Any, Iterable, Iterator
+
+try:
+    from backend.metrics import FOCAS_BUFFER_RETRIES, FOCAS_CALL_RETURN_CODES, FOCAS_CALL_SECONDS, FOCAS_TRANSFER_BYTES, FOCAS_TRANSFER_SECONDS, percentile
+except ImportError:
+    from metrics import FOCAS_BUFFER_RETRIES, FOCAS_CALL_RETURN_CODES, FOCAS_CALL_SECONDS, FOCAS_TRANSFER_BYTES, FOCAS_TRANSFER_SECONDS, percentile
+
+try:
+    from backend.tracing import traced
+except ImportError:
+    from tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +32,19 @@ EW_OVRFLOW = 8
 EW_PROT = 7
 EW_REJECT = 13
 EW_ALARM = 15
+EW_SOCKET = -16
+EW_HANDLE = -8
+
+# Programs requested per cnc_rdprogdir3 round trip
+FOCAS_DIR_BATCH_SIZE = int(os.environ.get("FOCAS_DIR_BATCH_SIZE", "50"))
+# Seconds a program directory listing is served from cache (0 disables the cache)
+FOCAS_DIR_CACHE_TTL = float(os.environ.get("FOCAS_DIR_CACHE_TTL", "30"))
+# Bytes of uploaded program text kept for unchanged programs (0 disables the cache)
+FOCAS_PROGRAM_CACHE_BYTES = int(os.environ.get("FOCAS_PROGRAM_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Latest call durations kept per controller and call for the diagnostics percentiles
+FOCAS_STATS_SAMPLES = int(os.environ.get("FOCAS_STATS_SAMPLES", "256"))
+# Controllers with call statistics and metric series; the least recently used beyond this are dropped
+FOCAS_STATS_MAX_CONTROLLERS = int(os.environ.get("FOCAS_STATS_MAX_CONTROLLERS", "64"))
 
 class FocasError(Exception):
     def __init__(self, code: int, message: str):
@@ -25,6 +52,39 @@ class FocasError(Exception):
         self.message = f"{message} (Error Code: {code})"
         super().__init__(self.message)
 
+class FocasTransferCancelled(Exception):
+    """Raised inside a transfer loop after its TransferMonitor was cancelled."""
+
+
+class TransferMonitor:
+    """Progress counters and a cancellation flag shared with a running transfer.
+
+    Transfer loops call check() between FOCAS calls, so a cancelled transfer
+    leaves through the same finally block that calls cnc_dwnend3 / cnc_upend3.
+    """
+    def __init__(self):
+        self.bytes_transferred = 0
+        self.buffer_retries = 0
+        self._cancelled = Event()
+
+    def add_bytes(self, count: int):
+        self.bytes_transferred += count
+
+    def add_retry(self):
+        self.buffer_retries += 1
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise FocasTransferCancelled("Transfer cancelled")
+
+
 class FOCAS_DATE(ctypes.Structure):
     """Date structure for FOCAS directory listings"""
     _fields_ = [
@@ -47,28 +107,561 @@ class PRGDIR3(ctypes.Structure):
         ("cdate", FOCAS_DATE)
     ]
 
+class ODBST(ctypes.Structure):
+    """C-Structure for cnc_statinfo (Series 30i/31i/32i/0i-D layout)"""
+    _fields_ = [
+        ("hdck", ctypes.c_short),
+        ("tmmode", ctypes.c_short),
+        ("aut", ctypes.c_short),
+        ("run", ctypes.c_short),
+        ("motion", ctypes.c_short),
+        ("mstb", ctypes.c_short),
+        ("emergency", ctypes.c_short),
+        ("alarm", ctypes.c_short),
+        ("edit", ctypes.c_short)
+    ]
+
+class POSELM(ctypes.Structure):
+    """One position value of cnc_rdposition; the value is data * 10^-dec"""
+    _fields_ = [
+        ("data", ctypes.c_long),
+        ("dec", ctypes.c_short),
+        ("unit", ctypes.c_short),
+        ("disp", ctypes.c_short),
+        ("name", ctypes.c_char),
+        ("suff", ctypes.c_char)
+    ]
+
+class ODBPOS(ctypes.Structure):
+    """C-Structure for cnc_rdposition (one axis)"""
+    _fields_ = [
+        ("abs", POSELM),
+        ("mach", POSELM),
+        ("rel", POSELM),
+        ("dist", POSELM)
+    ]
+
+class ODBALMMSG2(ctypes.Structure):
+    """C-Structure for cnc_rdalmmsg2"""
+    _fields_ = [
+        ("alm_no", ctypes.c_long),
+        ("type", ctypes.c_short),
+        ("axis", ctypes.c_short),
+        ("dummy", ctypes.c_short),
+        ("msg_len", ctypes.c_short),
+        ("alm_msg", ctypes.c_char * 64)
+    ]
+
+class ODBPRO(ctypes.Structure):
+    """C-Structure for cnc_rdprgnum"""
+    _fields_ = [
+        ("dummy", ctypes.c_short * 2),
+        ("data", ctypes.c_long),
+        ("mdata", ctypes.c_long)
+    ]
+
+class ODBSEQ(ctypes.Structure):
+    """C-Structure for cnc_rdseqnum"""
+    _fields_ = [
+        ("dummy", ctypes.c_short * 2),
+        ("data", ctypes.c_long)
+    ]
+
+# Axes and alarms read per telemetry pass
+FOCAS_MAX_AXES = 32
+FOCAS_MAX_ALARMS = 10
+
+# Text for the ODBST fields, as shown on the CNC status line
+STATUS_MODES = {0: "MDI", 1: "MEM", 3: "EDIT", 4: "HND", 5: "JOG", 6: "TJOG", 7: "THND", 8: "INC", 9: "REF", 10: "RMT"}
+STATUS_RUN = {0: "RESET", 1: "STOP", 2: "HOLD", 3: "START", 4: "MSTR"}
+STATUS_MOTION = {0: None, 1: "MTN", 2: "DWL"}
+STATUS_EMERGENCY = {0: None, 1: "EMG", 2: "RESET"}
+STATUS_ALARM = {0: None, 1: "ALM", 2: "BAT"}
+
+class ProgramDirectoryCache:
+    """Program directory listings per (ip, port, path) that expire after `ttl` seconds."""
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries: Dict[Tuple[str, int, int], Tuple[float, list]] = {}
+
+    @staticmethod
+    def _key(ip: str, port: int, path_no: int) -> Tuple[str, int, int]:
+        return (ip.strip().upper(), int(port), int(path_no))
+
+    def get(self, ip: str, port: int, path_no: int) -> Optional[list]:
+        if self.ttl <= 0:
+            return None
+        key = self._key(ip, port, path_no)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, programs = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+        return [dict(program) for program in programs]
+
+    def put(self, ip: str, port: int, path_no: int, programs: list):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[self._key(ip, port, path_no)] = (time.monotonic(), [dict(program) for program in programs])
+
+    def invalidate(self, ip: str, port: Optional[int] = None, path_no: Optional[int] = None):
+        """Drop cached listings of a controller.
+
+        Path 0 is the controller's current path and may alias any numbered path, so
+        writes to it (or a missing path) drop every path of the controller.
+        """
+        ip_key = ip.strip().upper()
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] != ip_key or (port is not None and key[1] != int(port)):
+                    continue
+                if path_no and key[2] not in (0, path_no):
+                    continue
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _mdate_settled(mdate: str) -> bool:
+    """Whether a directory mdate lies in a past minute of the local clock.
+
+    FOCAS dates only go down to the minute, so a program rewritten again within
+    its mdate's minute keeps the same date. Texts are only cached once that
+    minute is over. An unreadable date never counts as settled.
+    """
+    try:
+        written = datetime.strptime(mdate[:16], "%Y-%m-%dT%H:%M")
+    except (TypeError, ValueError):
+        return False
+    return written < datetime.now().replace(second=0, microsecond=0)
+
+
+class ProgramTextCache:
+    """Uploaded program texts keyed by (ip, port, path, number, mdate, length).
+
+    A program whose directory entry still carries the same modification date and
+    length is served from here without an upload session. Entries whose mdate
+    falls in the current minute are neither stored nor served, and writes through
+    this service drop the written programs. Least recently used texts are evicted
+    once `max_bytes` is exceeded.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._entries: "OrderedDict[tuple, str]" = OrderedDict()
+        self._size = 0
+
+    @staticmethod
+    def _key(ip: str, port: int, path_no: int, entry: Dict[str, Any]) -> Optional[tuple]:
+        if not entry.get("mdate"):
+            return None
+        return (ip.strip().upper(), int(port), int(path_no), int(entry["number"]), entry["mdate"], int(entry["length"]))
+
+    def get(self, ip: str, port: int, path_no: int, entry: Dict[str, Any]) -> Optional[str]:
+        key = self._key(ip, port, path_no, entry)
+        if key is None or not _mdate_settled(entry["mdate"]):
+            return None
+        with self._lock:
+            program_text = self._entries.get(key)
+            if program_text is not None:
+                self._entries.move_to_end(key)
+            return program_text
+
+    def put(self, ip: str, port: int, path_no: int, entry: Dict[str, Any], program_text: str):
+        key = self._key(ip, port, path_no, entry)
+        if key is None or len(program_text) > self.max_bytes or not _mdate_settled(entry["mdate"]):
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = program_text
+            self._size += len(program_text)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate(self, ip: str, port: int, numbers: Iterable[int]):
+        """Drop the texts of the given program numbers on every path of a controller.
+
+        Path 0 is the controller's current path and may alias any numbered path,
+        so the numbers are dropped regardless of the path they were cached under.
+        """
+        numbers = set(numbers)
+        controller = (ip.strip().upper(), int(port))
+        with self._lock:
+            for key in [key for key in self._entries if key[:2] == controller and key[3] in numbers]:
+                self._size -= len(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class FocasSessionRegistry:
+    """Open FOCAS handles and the latest connect time per controller (ip, port)."""
+    def __init__(self):
+        self._lock = Lock()
+        self._controllers: Dict[Tuple[str, int], Dict[str, Any]] = {}
+
+    def _entry(self, ip: str, port: int) -> Dict[str, Any]:
+        key = (ip.strip(), int(port))
+        if key not in self._controllers:
+            self._controllers[key] = {"open_handles": 0, "last_connect_ms": None, "last_connect_at": None}
+        return self._controllers[key]
+
+    def opened(self, ip: str, port: int, connect_ms: Optional[float] = None):
+        with self._lock:
+            entry = self._entry(ip, port)
+            entry["open_handles"] += 1
+            if connect_ms is not None:
+                entry["last_connect_ms"] = round(connect_ms, 2)
+                entry["last_connect_at"] = time.time()
+
+    def closed(self, ip: str, port: int):
+        with self._lock:
+            entry = self._entry(ip, port)
+            entry["open_handles"] = max(0, entry["open_handles"] - 1)
+
+    def get(self, ip: str, port: int = 8193) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._entry(ip, port))
+
+
+class FocasCallStats:
+    """Per-controller accounting of FOCAS library calls and program transfers.
+
+    Every call is timed and its return code counted. The aggregates feed the
+    Prometheus metrics and, with latency percentiles over the latest
+    FOCAS_STATS_SAMPLES calls, the /api/focas/diagnostics endpoint. Controller
+    addresses come from clients, so only the `max_controllers` most recently
+    used are kept; older ones lose their statistics and metric series.
+    """
+    def __init__(self, samples: int = FOCAS_STATS_SAMPLES, max_controllers: int = FOCAS_STATS_MAX_CONTROLLERS):
+        self.samples = samples
+        self.max_controllers = max(1, max_controllers)
+        self._lock = Lock()
+        self._controllers: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    @staticmethod
+    def controller_label(ip: str, port: int) -> str:
+        return f"{ip.strip()}:{int(port)}"
+
+    def _entry(self, controller: str) -> Dict[str, Any]:
+        # Callers hold the lock, so a dropped controller cannot get new metric series meanwhile
+        entry = self._controllers.get(controller)
+        if entry is not None:
+            self._controllers.move_to_end(controller)
+            return entry
+        entry = self._controllers[controller] = {"calls": {}, "transfers": {}}
+        while len(self._controllers) > self.max_controllers:
+            evicted, _ = self._controllers.popitem(last=False)
+            for metric in (FOCAS_CALL_SECONDS, FOCAS_CALL_RETURN_CODES, FOCAS_BUFFER_RETRIES, FOCAS_TRANSFER_BYTES, FOCAS_TRANSFER_SECONDS):
+                metric.remove(controller=evicted)
+        return entry
+
+    def record_call(self, controller: str, call: str, seconds: float, ret: int):
+        with self._lock:
+            calls = self._entry(controller)["calls"]
+            FOCAS_CALL_SECONDS.observe(seconds, controller=controller, call=call)
+            if ret != EW_OK:
+                FOCAS_CALL_RETURN_CODES.inc(controller=controller, call=call, code=ret)
+                if ret == EW_BUFFER:
+                    FOCAS_BUFFER_RETRIES.inc(controller=controller, call=call)
+            stats = calls.get(call)
+            if stats is None:
+                stats = calls[call] = {"count": 0, "total_seconds": 0.0, "return_codes": {}, "latencies": deque(maxlen=self.samples)}
+            stats["count"] += 1
+            stats["total_seconds"] += seconds
+            stats["latencies"].append(seconds)
+            if ret != EW_OK:
+                stats["return_codes"][ret] = stats["return_codes"].get(ret, 0) + 1
+
+    def record_transfer(self, controller: str, direction: str, byte_count: int, seconds: float):
+        with self._lock:
+            transfers = self._entry(controller)["transfers"]
+            FOCAS_TRANSFER_BYTES.inc(byte_count, controller=controller, direction=direction)
+            FOCAS_TRANSFER_SECONDS.inc(seconds, controller=controller, direction=direction)
+            stats = transfers.setdefault(direction, {"count": 0, "bytes": 0, "seconds": 0.0})
+            stats["count"] += 1
+            stats["bytes"] += byte_count
+            stats["seconds"] += seconds
+
+    def snapshot(self, controller: Optional[str] = None) -> list:
+        with self._lock:
+            selected = {
+                name: {
+                    "calls": {call: {**stats, "return_codes": dict(stats["return_codes"]), "latencies": sorted(stats["latencies"])}
+                              for call, stats in entry["calls"].items()},
+                    "transfers": {direction: dict(stats) for direction, stats in entry["transfers"].items()},
+                }
+                for name, entry in self._controllers.items() if controller is None or name == controller
+            }
+        result = []
+        for name, entry in sorted(selected.items()):
+            calls = {}
+            for call, stats in sorted(entry["calls"].items()):
+                latencies = stats["latencies"]
+                calls[call] = {
+                    "count": stats["count"],
+                    "total_ms": round(stats["total_seconds"] * 1000, 3),
+                    "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+                    "p90_ms": round(percentile(latencies, 0.90) * 1000, 3),
+                    "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+                    "max_ms": round((latencies[-1] if latencies else 0.0) * 1000, 3),
+                    "return_codes": {str(code): count for code, count in sorted(stats["return_codes"].items())},
+                }
+            transfers = {
+                direction: {**stats, "bytes_per_second": round(stats["bytes"] / stats["seconds"], 1) if stats["seconds"] else None}
+                for direction, stats in sorted(entry["transfers"].items())
+            }
+            result.append({
+                "controller": name,
+                "calls": calls,
+                "buffer_retries": sum(stats["return_codes"].get(EW_BUFFER, 0) for stats in entry["calls"].values()),
+                "transfers": transfers,
+            })
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._controllers.clear()
+
+
+_directory_cache = ProgramDirectoryCache(FOCAS_DIR_CACHE_TTL)
+_program_cache = ProgramTextCache(FOCAS_PROGRAM_CACHE_BYTES)
+_session_registry = FocasSessionRegistry()
+_call_stats = FocasCallStats()
+
+
+def get_directory_cache() -> ProgramDirectoryCache:
+    return _directory_cache
+
+
+def get_program_cache() -> ProgramTextCache:
+    return _program_cache
+
+
+def get_session_registry() -> FocasSessionRegistry:
+    return _session_registry
+
+
+def get_call_stats() -> FocasCallStats:
+    return _call_stats
+
+
+def normalize_program_text(program_text: str) -> str:
+    normalized = (program_text or "").replace("\r\n", "\n").replace("\r", "\n").strip()
+    if not normalized.startswith("%"):
+        normalized = f"%\n{normalized.lstrip()}"
+    if not normalized.rstrip().endswith("%"):
+        normalized = f"{normalized.rstrip()}\n%"
+    return normalized
+
+
+def extract_program_number(program_text: str) -> Optional[int]:
+    match = re.search(r"(?:^|\n)O(\d+)(?:\b|\s)", program_text, flags=re.IGNORECASE)
+    if not match:
+        return None
+    return int(match.group(1))
+
+
+_PROGRAM_HEADER = re.compile(r"^O(\d+)", flags=re.IGNORECASE | re.MULTILINE)
+
+
+def split_program_stream(stream_text: str) -> Dict[int, str]:
+    """Split a multi-program upload (`%`, O1000 ..., O1001 ..., `%`) into programs keyed by number.
+
+    Every program gets its own `%` framing, so it looks like a single upload.
+    """
+    body = (stream_text or "").replace("\r\n", "\n").replace("\r", "\n").strip().strip("%").strip()
+    headers = list(_PROGRAM_HEADER.finditer(body))
+    programs: Dict[int, str] = {}
+    for header, following in zip(headers, headers[1:] + [None]):
+        end = following.start() if following else len(body)
+        programs[int(header.group(1))] = f"%\n{body[header.start():end].rstrip()}\n%"
+    return programs
+
+
+def program_content_hash(program_text: str) -> str:
+    """SHA-256 of the normalized program, as sent over FOCAS (ASCII only)."""
+    normalized = normalize_program_text(program_text)
+    return hashlib.sha256(normalized.encode("ascii", errors="ignore")).hexdigest()
+
+
+def _position_value(element: POSELM) -> float:
+    return element.data / (10 ** element.dec) if element.dec > 0 else float(element.data)
+
+
+def _status_entry(status: ODBST) -> Dict[str, Any]:
+    return {
+        "mode": STATUS_MODES.get(status.aut, str(status.aut)),
+        "run": STATUS_RUN.get(status.run, str(status.run)),
+        "motion": STATUS_MOTION.get(status.motion),
+        "emergency": STATUS_EMERGENCY.get(status.emergency),
+        "alarm": STATUS_ALARM.get(status.alarm),
+    }
+
+
+def _format_focas_date(date: FOCAS_DATE) -> Optional[str]:
+    if date.year <= 0:
+        return None
+    return f"{date.year:04d}-{date.month:02d}-{date.day:02d}T{date.hour:02d}:{date.minute:02d}"
+
+
 class FocasClientBase:
     """Abstract base class for Dependency Injection"""
+    # Controller of the current session, set by connect()
+    ip: Optional[str] = None
+    port: int = 8193
+
+    def _invalidate_directory(self, path_no: int):
+        if self.ip:
+            get_directory_cache().invalidate(self.ip, self.port, path_no)
+
+    def _invalidate_programs(self, numbers: Iterable[int]):
+        if self.ip:
+            get_program_cache().invalidate(self.ip, self.port, numbers)
+
+    def _session_opened(self, ip: str, port: int, connect_ms: Optional[float] = None):
+        self.ip, self.port = ip, port
+        get_session_registry().opened(ip, port, connect_ms)
+
+    def _session_closed(self):
+        if self.ip:
+            get_session_registry().closed(self.ip, self.port)
+
     def connect(self, ip: str, port: int = 8193, timeout: int = 10) -> bool:
         raise NotImplementedError
     def disconnect(self):
         raise NotImplementedError
     def set_path(self, path_no: int):
         raise NotImplementedError
-    def download_program(self, program_text: str, path_no: int = 0):
+    def download_program(self, program_text: str, path_no: int = 0, monitor: Optional[TransferMonitor] = None):
         raise NotImplementedError
-    def upload_program(self, prog_num: int, path_no: int = 0) -> str:
+    def download_program_stream(self, chunks: Iterable[bytes], path_no: int = 0, monitor: Optional[TransferMonitor] = None):
+        """Download a program delivered as byte chunks. Clients that can stream override this."""
+        self.download_program(b"".join(chunks).decode("ascii", errors="ignore"), path_no, monitor=monitor)
+    def upload_program(self, prog_num: int, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> str:
         raise NotImplementedError
+    def iter_upload_program(self, prog_num: int, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> Iterator[str]:
+        """Yield the program text in chunks. Clients that can stream override this."""
+        yield self.upload_program(prog_num, path_no, monitor=monitor)
+    def upload_program_range(self, start: int, end: int, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> Dict[int, str]:
+        """Upload every program numbered start..end, keyed by number. Clients that read a range in one upload session override this."""
+        return {
+            program["number"]: self.upload_program(program["number"], path_no, monitor=monitor)
+            for program in self.list_programs(path_no)
+            if start <= program["number"] <= end
+        }
+    def upload_programs(self, numbers: Iterable[int], path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> Dict[int, str]:
+        """Upload the given programs with as few upload sessions as possible.
+
+        Requested programs that follow each other in the directory share one range
+        upload. Numbers that do not exist on the CNC are left out of the result.
+        """
+        wanted = set(numbers)
+        programs: Dict[int, str] = {}
+        run: list = []
+        for entry in sorted(self.list_programs(path_no), key=lambda item: item["number"]) + [None]:
+            if entry is not None and entry["number"] in wanted:
+                run.append(entry["number"])
+                continue
+            if run:
+                programs.update(self.upload_program_range(run[0], run[-1], path_no, monitor=monitor))
+                run = []
+        return programs
     def list_programs(self, path_no: int = 0) -> list:
         raise NotImplementedError
+    def get_path_count(self) -> int:
+        """Number of paths (channels) of the controller; paths are numbered from 1."""
+        return 1
+    def list_programs_by_path(self, paths: Optional[Iterable[int]] = None) -> Dict[int, list]:
+        """Directory listings of several paths over the current session, keyed by path number.
+
+        Without `paths` every path of the controller is listed. The session is
+        switched between paths with set_path, so no extra handshake is needed.
+        """
+        if paths is None:
+            paths = range(1, self.get_path_count() + 1)
+        return {path_no: self.list_programs(path_no) for path_no in paths}
+    def download_program_if_changed(self, program_text: str, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> bool:
+        """Download only if the CNC copy differs after normalization. Returns True if written.
+
+        The CNC copy comes from the program text cache when its directory entry is
+        unchanged, otherwise it is uploaded first. The cache holds no program whose
+        mdate is in the current minute, as a rewrite within that minute leaves the
+        entry unchanged; such programs are always uploaded and compared.
+        """
+        prog_num = extract_program_number(normalize_program_text(program_text))
+        entry = self.find_program(prog_num, path_no) if prog_num is not None else None
+        if entry is not None:
+            program_cache = get_program_cache()
+            current_text = program_cache.get(self.ip, self.port, path_no, entry) if self.ip else None
+            if current_text is None:
+                current_text = self.upload_program(prog_num, path_no, monitor=monitor)
+                if self.ip:
+                    program_cache.put(self.ip, self.port, path_no, entry, current_text)
+            if program_content_hash(current_text) == program_content_hash(program_text):
+                return False
+        self.download_program(program_text, path_no, monitor=monitor)
+        return True
+    def find_program(self, prog_num: int, path_no: int = 0) -> Optional[Dict[str, Any]]:
+        """Return the directory entry of a single program, or None if it does not exist."""
+        for program in self.list_programs(path_no):
+            if program["number"] == prog_num:
+                return program
+        return None
+    def read_status(self) -> Dict[str, Any]:
+        """Mode, run state, motion, emergency and alarm flags of the current path."""
+        raise NotImplementedError
+    def read_positions(self) -> list:
+        """Absolute, machine, relative and distance-to-go position per axis of the current path."""
+        raise NotImplementedError
+    def read_alarms(self) -> list:
+        raise NotImplementedError
+    def read_program_info(self) -> Dict[str, Any]:
+        """Numbers of the running and main program and the current sequence number."""
+        raise NotImplementedError
+    def read_telemetry(self, path_no: int = 0) -> Dict[str, Any]:
+        """Read status, positions, alarms and the executing program in one pass over one session."""
+        self.set_path(path_no)
+        return {
+            "path": path_no,
+            "timestamp": time.time(),
+            "status": self.read_status(),
+            "positions": self.read_positions(),
+            "alarms": self.read_alarms(),
+            "program": self.read_program_info(),
+        }
 
 class DummyFocasClient(FocasClientBase):
     """Dummy FOCAS client for testing without a CNC or DLLs."""
+    UPLOAD_CHUNK_SIZE = 1280
+    # Simulated transfer time; callers run demo transfers off the event loop
+    TRANSFER_DELAY = float(os.environ.get("FOCAS_DEMO_TRANSFER_DELAY", "0.1"))
+
+    # Seconds of one synthetic machining cycle: running, then stopped for the last quarter
+    DEMO_CYCLE_SECONDS = 60.0
+
     def __init__(self):
         self.connected = False
+        self._open_sessions = 0
+        self._started = time.monotonic()
+        self._demo_alarms: list = []
         self._lock = Lock()
         self._programs_by_path = self._build_seed_programs()
 
+    SEED_DATE = "2024-01-01T08:00:00"
+
     @staticmethod
     def _make_program(number: int, comment: str, body: str) -> Dict[str, Any]:
         program_text = body.strip()
@@ -80,6 +673,8 @@ class DummyFocasClient(FocasClientBase):
             "number": number,
             "comment": comment,
             "program_text": program_text,
+            "mdate": DummyFocasClient.SEED_DATE,
+            "cdate": DummyFocasClient.SEED_DATE,
         }
 
     @classmethod
@@ -183,21 +778,8 @@ M30
             },
         }
 
-    @staticmethod
-    def _normalize_program_text(program_text: str) -> str:
-        normalized = (program_text or "").replace("\r\n", "\n").replace("\r", "\n").strip()
-        if not normalized.startswith("%"):
-            normalized = f"%\n{normalized.lstrip()}"
-        if not normalized.rstrip().endswith("%"):
-            normalized = f"{normalized.rstrip()}\n%"
-        return normalized
-
-    @staticmethod
-    def _extract_program_number(program_text: str) -> Optional[int]:
-        match = re.search(r"(?:^|\n)O(\d+)(?:\b|\s)", program_text, flags=re.IGNORECASE)
-        if not match:
-            return None
-        return int(match.group(1))
+    _normalize_program_text = staticmethod(normalize_program_text)
+    _extract_program_number = staticmethod(extract_program_number)
 
     @staticmethod
     def _extract_comment(program_text: str, fallback: str) -> str:
@@ -210,37 +792,55 @@ M30
         
     def connect(self, ip: str, port: int = 8193, timeout: int = 10) -> bool:
         logger.info(f"[DUMMY] Connecting to {ip}:{port}")
-        self.connected = True
+        with self._lock:
+            self._open_sessions += 1
+            self.connected = True
+        self._session_opened(ip, port, 0.0)
         return True
         
     def disconnect(self):
         logger.info("[DUMMY] Disconnected")
-        self.connected = False
+        with self._lock:
+            if not self._open_sessions:
+                return
+            self._open_sessions -= 1
+            self.connected = self._open_sessions > 0
+        self._session_closed()
         
     def set_path(self, path_no: int):
         logger.info(f"[DUMMY] Path set to {path_no}")
         
-    def download_program(self, program_text: str, path_no: int = 0):
+    def download_program(self, program_text: str, path_no: int = 0, monitor: Optional[TransferMonitor] = None):
         target_path = path_no or 1
         logger.info(f"[DUMMY] Downloading {len(program_text)} bytes to Path {target_path}")
         normalized = self._normalize_program_text(program_text)
         program_number = self._extract_program_number(normalized)
         if program_number is None:
             raise FocasError(EW_DATA, "Demo upload requires an O-number in the program header")
+        if monitor:
+            monitor.check()
 
         with self._lock:
             path_programs = self._programs_by_path.setdefault(target_path, {})
             existing = path_programs.get(program_number)
             fallback_comment = existing["comment"] if existing else f"DEMO PATH {target_path}"
+            # Seconds resolution so back-to-back demo edits never share a date
+            now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
             path_programs[program_number] = {
                 "number": program_number,
                 "comment": self._extract_comment(normalized, fallback_comment),
                 "program_text": normalized,
+                "mdate": now,
+                "cdate": existing["cdate"] if existing else now,
             }
+        self._invalidate_directory(target_path)
+        self._invalidate_programs([program_number])
+        if monitor:
+            monitor.add_bytes(len(normalized))
 
-        time.sleep(0.1)
+        time.sleep(self.TRANSFER_DELAY)
         
-    def upload_program(self, prog_num: int, path_no: int = 0) -> str:
+    def upload_program(self, prog_num: int, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> str:
         target_path = path_no or 1
         logger.info(f"[DUMMY] Uploading O{prog_num} from Path {target_path}")
         with self._lock:
@@ -248,9 +848,17 @@ M30
             if not program:
                 raise FocasError(EW_DATA, f"Program O{prog_num} not found on demo path {target_path}")
             program_text = program["program_text"]
-        time.sleep(0.1)
+        time.sleep(self.TRANSFER_DELAY)
+        if monitor:
+            monitor.check()
+            monitor.add_bytes(len(program_text))
         return program_text
 
+    def iter_upload_program(self, prog_num: int, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> Iterator[str]:
+        program_text = self.upload_program(prog_num, path_no, monitor=monitor)
+        for offset in range(0, len(program_text), self.UPLOAD_CHUNK_SIZE):
+            yield program_text[offset:offset + self.UPLOAD_CHUNK_SIZE]
+
     def list_programs(self, path_no: int = 0) -> list:
         target_path = path_no or 1
         logger.info(f"[DUMMY] Listing programs for Path {target_path}")
@@ -261,24 +869,95 @@ M30
                     "number": program["number"],
                     "length": len(program["program_text"].encode("ascii", errors="ignore")),
                     "comment": program["comment"],
+                    "mdate": program["mdate"],
+                    "cdate": program["cdate"],
                 }
                 for program in sorted(programs, key=lambda item: item["number"])
             ]
 
+    def get_path_count(self) -> int:
+        with self._lock:
+            return max(self._programs_by_path, default=1)
+
+    def _demo_cycle(self) -> Tuple[float, bool]:
+        elapsed = (time.monotonic() - self._started) % self.DEMO_CYCLE_SECONDS
+        return elapsed, elapsed < self.DEMO_CYCLE_SECONDS * 0.75
+
+    def read_status(self) -> Dict[str, Any]:
+        _, running = self._demo_cycle()
+        return {
+            "mode": "MEM",
+            "run": "START" if running else "STOP",
+            "motion": "MTN" if running else None,
+            "emergency": None,
+            "alarm": "ALM" if self._demo_alarms else None,
+        }
+
+    def read_positions(self) -> list:
+        # The tool runs a circle of radius 50 around the workpiece zero
+        elapsed, running = self._demo_cycle()
+        angle = 2 * math.pi * elapsed / (self.DEMO_CYCLE_SECONDS * 0.75) if running else 0.0
+        absolute = {"X": round(50 * math.cos(angle), 3), "Y": round(50 * math.sin(angle), 3), "Z": -5.0 if running else 10.0}
+        work_offset = {"X": -250.0, "Y": -120.0, "Z": -300.0}
+        return [
+            {
+                "axis": axis,
+                "absolute": value,
+                "machine": round(value + work_offset[axis], 3),
+                "relative": value,
+                "distance": 0.0,
+            }
+            for axis, value in absolute.items()
+        ]
+
+    def read_alarms(self) -> list:
+        return list(self._demo_alarms)
+
+    def read_program_info(self) -> Dict[str, Any]:
+        elapsed, running = self._demo_cycle()
+        with self._lock:
+            numbers = sorted(self._programs_by_path.get(1, {}))
+        program_number = numbers[0] if numbers else 0
+        return {
+            "running": program_number,
+            "main": program_number,
+            "sequence": int(elapsed) * 10 if running else 0,
+        }
+
+    def set_demo_alarm(self, number: int, message: str):
+        """Raise a synthetic alarm in the demo telemetry until reset_demo_state()."""
+        self._demo_alarms.append({"number": number, "type": 0, "axis": 0, "message": message})
+
     def reset_demo_state(self):
         with self._lock:
             self._programs_by_path = deepcopy(self._build_seed_programs())
+            self._demo_alarms = []
+        if self.ip:
+            get_directory_cache().invalidate(self.ip)
+
+_focas_libraries: Dict[str, Optional[ctypes.CDLL]] = {}
+# Outcome of each library load attempt by absolute path: state, load time and error
+_focas_library_status: Dict[str, Dict[str, Any]] = {}
+_focas_library_lock = Lock()
+_connect_cwd_lock = Lock()
+
+FOCAS_DLL_PATH = "focas_dlls/FWLIB64.DLL"
+
+
+def _resolve_dll_path(dll_path: str) -> str:
+    # Resolve absolute path relative to this file's dir
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), dll_path)
+
+
+def _load_focas_library(dll_path: str) -> Optional[ctypes.CDLL]:
+    """Load the FOCAS library once per path; every RealFocasClient shares it."""
+    abs_dll_path = _resolve_dll_path(dll_path)
+    dll_dir = os.path.dirname(abs_dll_path)
+
+    with _focas_library_lock:
+        if abs_dll_path in _focas_libraries:
+            return _focas_libraries[abs_dll_path]
 
-class RealFocasClient(FocasClientBase):
-    def __init__(self, dll_path: str = "focas_dlls/FWLIB64.DLL"):
-        self.lib = None
-        self.handle = ctypes.c_ushort(0)
-        
-        # Resolve absolute path relative to this file's dir
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        dll_dir = os.path.dirname(os.path.join(base_dir, dll_path))
-        abs_dll_path = os.path.join(base_dir, dll_path)
-        
         # In Python 3.8+ on Windows, DLL resolution requires explicitly adding the directory
         if hasattr(os, 'add_dll_directory') and os.name == 'nt':
             try:
@@ -286,57 +965,144 @@ class RealFocasClient(FocasClientBase):
             except Exception as e:
                 logger.warning(f"Could not add DLL directory {dll_dir}: {e}")
 
+        lib = None
+        started = time.perf_counter()
+        status: Dict[str, Any] = {}
         try:
             # Try to load the 64-bit library
-            self.lib = ctypes.cdll.LoadLibrary(abs_dll_path)
-            self._setup_prototypes()
+            lib = ctypes.cdll.LoadLibrary(abs_dll_path)
+            _setup_prototypes(lib)
             logger.info(f"Successfully loaded FOCAS library: {abs_dll_path}")
-        except OSError as e:
+            status["state"] = "loaded"
+        except (OSError, AttributeError) as e:
+            lib = None
             logger.error(f"Could not load FOCAS library {abs_dll_path}. Ensure it is inside backend/focas_dlls: {e}")
+            status.update(state="failed", error=str(e))
+        status["load_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        _focas_libraries[abs_dll_path] = lib
+        _focas_library_status[abs_dll_path] = status
+        return lib
 
-    def _setup_prototypes(self):
-        """Define argument types and return types for safety."""
-        if not self.lib:
-            return
-            
-        # Connect & Disconnect
-        self.lib.cnc_allclibhndl3.argtypes = [ctypes.c_char_p, ctypes.c_ushort, ctypes.c_long, ctypes.POINTER(ctypes.c_ushort)]
-        self.lib.cnc_allclibhndl3.restype = ctypes.c_short
-        
-        self.lib.cnc_freelibhndl.argtypes = [ctypes.c_ushort]
-        self.lib.cnc_freelibhndl.restype = ctypes.c_short
 
-        # Multi-channel Path operations
-        self.lib.cnc_setpath.argtypes = [ctypes.c_ushort, ctypes.c_short]
-        self.lib.cnc_setpath.restype = ctypes.c_short
-        
-        self.lib.cnc_getpath.argtypes = [ctypes.c_ushort, ctypes.POINTER(ctypes.c_short), ctypes.POINTER(ctypes.c_short)]
-        self.lib.cnc_getpath.restype = ctypes.c_short
+def focas_library_status(dll_path: str = FOCAS_DLL_PATH) -> Dict[str, Any]:
+    """State of the FOCAS library without loading it: mock, simulated, not_loaded, loaded or failed."""
+    if USE_MOCK:
+        return {"state": "mock"}
+    if USE_SIMULATED:
+        return {"state": "simulated"}
+    abs_dll_path = _resolve_dll_path(dll_path)
+    with _focas_library_lock:
+        status = _focas_library_status.get(abs_dll_path)
+    return dict(status) if status else {"state": "not_loaded"}
 
-        # Download (PC -> CNC)
-        self.lib.cnc_dwnstart3.argtypes = [ctypes.c_ushort, ctypes.c_short]
-        self.lib.cnc_dwnstart3.restype = ctypes.c_short
-        
-        self.lib.cnc_download3.argtypes = [ctypes.c_ushort, ctypes.POINTER(ctypes.c_long), ctypes.c_char_p]
-        self.lib.cnc_download3.restype = ctypes.c_short
-        
-        self.lib.cnc_dwnend3.argtypes = [ctypes.c_ushort]
-        self.lib.cnc_dwnend3.restype = ctypes.c_short
 
-        # Upload (CNC -> PC)
-        self.lib.cnc_upstart3.argtypes = [ctypes.c_ushort, ctypes.c_short, ctypes.c_long, ctypes.c_long]
-        # Directory / Read Programs
-        self.lib.cnc_rdprogdir3.argtypes = [ctypes.c_ushort, ctypes.c_short, ctypes.POINTER(ctypes.c_long), ctypes.POINTER(ctypes.c_short), ctypes.c_void_p]
-        self.lib.cnc_rdprogdir3.restype = ctypes.c_short
+def _setup_prototypes(lib: ctypes.CDLL):
+    """Define argument types and return types for safety."""
+    # Connect & Disconnect
+    lib.cnc_allclibhndl3.argtypes = [ctypes.c_char_p, ctypes.c_ushort, ctypes.c_long, ctypes.POINTER(ctypes.c_ushort)]
+    lib.cnc_allclibhndl3.restype = ctypes.c_short
+    
+    lib.cnc_freelibhndl.argtypes = [ctypes.c_ushort]
+    lib.cnc_freelibhndl.restype = ctypes.c_short
+
+    # Multi-channel Path operations
+    lib.cnc_setpath.argtypes = [ctypes.c_ushort, ctypes.c_short]
+    lib.cnc_setpath.restype = ctypes.c_short
+    
+    lib.cnc_getpath.argtypes = [ctypes.c_ushort, ctypes.POINTER(ctypes.c_short), ctypes.POINTER(ctypes.c_short)]
+    lib.cnc_getpath.restype = ctypes.c_short
+
+    # Download (PC -> CNC)
+    lib.cnc_dwnstart3.argtypes = [ctypes.c_ushort, ctypes.c_short]
+    lib.cnc_dwnstart3.restype = ctypes.c_short
+    
+    lib.cnc_download3.argtypes = [ctypes.c_ushort, ctypes.POINTER(ctypes.c_long), ctypes.c_char_p]
+    lib.cnc_download3.restype = ctypes.c_short
+    
+    lib.cnc_dwnend3.argtypes = [ctypes.c_ushort]
+    lib.cnc_dwnend3.restype = ctypes.c_short
+
+    # Upload (CNC -> PC)
+    lib.cnc_upstart3.argtypes = [ctypes.c_ushort, ctypes.c_short, ctypes.c_long, ctypes.c_long]
+    # Directory / Read Programs
+    lib.cnc_rdprogdir3.argtypes = [ctypes.c_ushort, ctypes.c_short, ctypes.POINTER(ctypes.c_long), ctypes.POINTER(ctypes.c_short), ctypes.c_void_p]
+    lib.cnc_rdprogdir3.restype = ctypes.c_short
+
+    lib.cnc_upstart3.restype = ctypes.c_short
+    
+    lib.cnc_upload3.argtypes = [ctypes.c_ushort, ctypes.POINTER(ctypes.c_long), ctypes.c_char_p]
+    lib.cnc_upload3.restype = ctypes.c_short
+    
+    lib.cnc_upend3.argtypes = [ctypes.c_ushort]
+    lib.cnc_upend3.restype = ctypes.c_short
+
+    # Machine state / telemetry
+    lib.cnc_statinfo.argtypes = [ctypes.c_ushort, ctypes.POINTER(ODBST)]
+    lib.cnc_statinfo.restype = ctypes.c_short
+
+    lib.cnc_rdposition.argtypes = [ctypes.c_ushort, ctypes.c_short, ctypes.POINTER(ctypes.c_short), ctypes.c_void_p]
+    lib.cnc_rdposition.restype = ctypes.c_short
+
+    lib.cnc_rdalmmsg2.argtypes = [ctypes.c_ushort, ctypes.c_short, ctypes.POINTER(ctypes.c_short), ctypes.c_void_p]
+    lib.cnc_rdalmmsg2.restype = ctypes.c_short
+
+    lib.cnc_rdprgnum.argtypes = [ctypes.c_ushort, ctypes.POINTER(ODBPRO)]
+    lib.cnc_rdprgnum.restype = ctypes.c_short
+
+    lib.cnc_rdseqnum.argtypes = [ctypes.c_ushort, ctypes.POINTER(ODBSEQ)]
+    lib.cnc_rdseqnum.restype = ctypes.c_short
+
+
+def _controller_attributes(client: "RealFocasClient", *args: Any, **kwargs: Any) -> Dict[str, Any]:
+    return {"focas.controller": client.controller}
+
+
+def _connect_attributes(client: "RealFocasClient", ip: str, port: int = 8193, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+    return {"focas.controller": FocasCallStats.controller_label(ip, port)}
+
+
+def _program_attributes(client: "RealFocasClient", prog_num: int, path_no: int = 0, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+    return {"focas.controller": client.controller, "focas.program": prog_num, "focas.path": path_no}
 
-        self.lib.cnc_upstart3.restype = ctypes.c_short
-        
-        self.lib.cnc_upload3.argtypes = [ctypes.c_ushort, ctypes.POINTER(ctypes.c_long), ctypes.c_char_p]
-        self.lib.cnc_upload3.restype = ctypes.c_short
-        
-        self.lib.cnc_upend3.argtypes = [ctypes.c_ushort]
-        self.lib.cnc_upend3.restype = ctypes.c_short
 
+class RealFocasClient(FocasClientBase):
+    dir_batch_size = FOCAS_DIR_BATCH_SIZE
+    # "ip:port" of the connected controller; labels the call statistics
+    controller = "unknown"
+    dll_path = FOCAS_DLL_PATH
+    _lib: Optional[Any] = None
+    _lib_resolved = False
+
+    def __init__(self, dll_path: str = FOCAS_DLL_PATH, dir_batch_size: Optional[int] = None, lib: Optional[Any] = None):
+        self.dll_path = dll_path
+        if dir_batch_size:
+            self.dir_batch_size = dir_batch_size
+        self.handle = ctypes.c_ushort(0)
+        if lib is not None:
+            # A Python stand-in with the same cnc_* calls (see focas_simulator); no ctypes prototypes
+            self.lib = lib
+
+    @property
+    def lib(self) -> Optional[Any]:
+        """The FOCAS library, loaded on first real use so that building a client costs nothing."""
+        if not self._lib_resolved:
+            self._lib = _load_focas_library(self.dll_path)
+            self._lib_resolved = True
+        return self._lib
+
+    @lib.setter
+    def lib(self, value: Optional[Any]):
+        self._lib = value
+        self._lib_resolved = True
+
+    def _call(self, name: str, *args: Any) -> int:
+        """Run one cnc_* call, recording its duration and return code for this controller."""
+        started = time.perf_counter()
+        ret = getattr(self.lib, name)(*args)
+        _call_stats.record_call(self.controller, name, time.perf_counter() - started, ret)
+        return ret
+
+    @traced("focas.connect", _connect_attributes)
     def connect(self, ip: str, port: int = 8193, timeout: int = 10) -> bool:
         if not self.lib:
             raise RuntimeError("FOCAS Library not loaded")
@@ -346,101 +1112,199 @@ class RealFocasClient(FocasClientBase):
         # Free previous handle if it exists before trying to allocate a new one
         if self.handle.value != 0:
             self.disconnect()
+        self.controller = FocasCallStats.controller_label(ip, port)
 
-        # FWLIB64 dynamically loads fwlibe64.dll and other dependencies without absolute paths during cnc_allclibhndl3.
-        # We must temporarily change the process working directory so Windows can find them.
-        old_cwd = os.getcwd()
-        focas_dir = os.path.dirname(os.path.abspath(self.lib._name))
-        
-        try:
-            os.chdir(focas_dir)
-            ret = self.lib.cnc_allclibhndl3(ip_encoded, port, timeout, ctypes.byref(self.handle))
-        finally:
-            os.chdir(old_cwd)
+        started = time.perf_counter()
+        if os.name == 'nt':
+            # FWLIB64 dynamically loads fwlibe64.dll and other dependencies without absolute paths during cnc_allclibhndl3.
+            # We must temporarily change the process working directory so Windows can find them.
+            # The working directory is process-wide, so concurrent connects take turns.
+            focas_dir = os.path.dirname(os.path.abspath(self.lib._name))
+            with _connect_cwd_lock:
+                old_cwd = os.getcwd()
+                started = time.perf_counter()
+                try:
+                    os.chdir(focas_dir)
+                    ret = self._call("cnc_allclibhndl3", ip_encoded, port, timeout, ctypes.byref(self.handle))
+                finally:
+                    os.chdir(old_cwd)
+        else:
+            ret = self._call("cnc_allclibhndl3", ip_encoded, port, timeout, ctypes.byref(self.handle))
+        connect_ms = (time.perf_counter() - started) * 1000
 
         if ret != EW_OK:
             logger.error(f"FOCAS Connection Error to {ip}:{port}. Code: {ret}")
             return False
+        self._session_opened(ip, port, connect_ms)
         return True
 
     def disconnect(self):
-        if self.lib and self.handle.value != 0:
-            self.lib.cnc_freelibhndl(self.handle)
+        if self.handle.value != 0 and self.lib:
+            self._call("cnc_freelibhndl", self.handle)
             self.handle.value = 0
+            self._session_closed()
 
     def set_path(self, path_no: int):
         if path_no == 0:
             return  # Default
             
-        ret = self.lib.cnc_setpath(self.handle, path_no)
+        ret = self._call("cnc_setpath", self.handle, path_no)
         if ret != EW_OK:
             raise FocasError(ret, f"Failed to set FOCAS path to {path_no}")
 
-    def download_program(self, program_text: str, path_no: int = 0):
-        self.set_path(path_no)
-        
+    def download_program(self, program_text: str, path_no: int = 0, monitor: Optional[TransferMonitor] = None):
         if not program_text.startswith("\n"): program_text = "\n" + program_text
         if not program_text.strip().endswith("%"): program_text = program_text.rstrip() + "\n%"
             
-        raw_data = program_text.encode('ascii', errors='ignore')
+        self.download_program_stream([program_text.encode('ascii', errors='ignore')], path_no, monitor=monitor)
+
+    @traced("focas.download", _controller_attributes)
+    def download_program_stream(self, chunks: Iterable[bytes], path_no: int = 0, monitor: Optional[TransferMonitor] = None):
+        """Feed byte chunks to cnc_download3 while they are still being produced.
+
+        Only one chunk is held at a time. As in download_program, a leading newline
+        and a trailing % are added when the stream does not carry them.
+        """
+        self.set_path(path_no)
         
-        ret = self.lib.cnc_dwnstart3(self.handle, 0)
+        ret = self._call("cnc_dwnstart3", self.handle, 0)
         if ret != EW_OK: raise FocasError(ret, "Failed to start download sequence (cnc_dwnstart3)")
 
+        started = False
+        last_char = b""
+        transfer = {"bytes": 0, "started": time.perf_counter()}
+        # Program numbers in the stream; the carried tail catches headers split across chunks
+        written: set = set()
+        tail = ""
         try:
-            while len(raw_data) > 0:
-                chunk_len = ctypes.c_long(len(raw_data))
-                ret = self.lib.cnc_download3(self.handle, ctypes.byref(chunk_len), raw_data)
-                
-                if ret == EW_BUFFER:
-                    time.sleep(0.1)
+            for chunk in chunks:
+                raw_data = chunk.decode('ascii', errors='ignore').encode('ascii')
+                if not raw_data:
                     continue
-                elif ret == EW_OK:
-                    raw_data = raw_data[chunk_len.value:]
-                else:
-                    raise FocasError(ret, f"Error during data transfer loop (cnc_download3)")
+                text = tail + raw_data.decode('ascii')
+                written.update(int(number) for number in _PROGRAM_HEADER.findall(text))
+                tail = text[-16:]
+                if not started:
+                    if not raw_data.startswith(b"\n"): raw_data = b"\n" + raw_data
+                    started = True
+                trimmed = raw_data.strip()
+                if trimmed:
+                    last_char = trimmed[-1:]
+                self._download_chunk(raw_data, monitor, transfer)
+            if last_char != b"%":
+                self._download_chunk(b"\n%", monitor, transfer)
         finally:
-            end_ret = self.lib.cnc_dwnend3(self.handle)
+            end_ret = self._call("cnc_dwnend3", self.handle)
+            _call_stats.record_transfer(self.controller, "download", transfer["bytes"], time.perf_counter() - transfer["started"])
             if end_ret != EW_OK: logger.warning(f"cnc_dwnend3 returned non-zero during cleanup: {end_ret}")
+            # Even an aborted download may have changed the directory and the programs
+            self._invalidate_directory(path_no)
+            self._invalidate_programs(written)
 
-    def upload_program(self, prog_num: int, path_no: int = 0) -> str:
+    def _download_chunk(self, raw_data: bytes, monitor: Optional[TransferMonitor] = None, transfer: Optional[Dict[str, Any]] = None):
+        while len(raw_data) > 0:
+            if monitor:
+                monitor.check()
+            chunk_len = ctypes.c_long(len(raw_data))
+            ret = self._call("cnc_download3", self.handle, ctypes.byref(chunk_len), raw_data)
+            
+            if ret == EW_BUFFER:
+                if monitor:
+                    monitor.add_retry()
+                time.sleep(0.1)
+                continue
+            elif ret == EW_OK:
+                raw_data = raw_data[chunk_len.value:]
+                if monitor:
+                    monitor.add_bytes(chunk_len.value)
+                if transfer is not None:
+                    transfer["bytes"] += chunk_len.value
+            else:
+                raise FocasError(ret, f"Error during data transfer loop (cnc_download3)")
+
+    @traced("focas.upload", _program_attributes)
+    def upload_program(self, prog_num: int, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> str:
+        return "".join(self.iter_upload_program(prog_num, path_no, monitor=monitor))
+
+    def iter_upload_program(self, prog_num: int, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> Iterator[str]:
+        """Yield program text chunks as cnc_upload3 delivers them.
+
+        cnc_upend3 runs when the transfer completes, fails, or the generator is
+        closed early, so a consumer that stops reading releases the CNC at once.
+        """
+        return self._iter_upload(prog_num, prog_num, path_no, monitor)
+
+    @traced("focas.upload_range", _controller_attributes)
+    def upload_program_range(self, start: int, end: int, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> Dict[int, str]:
+        """Read programs start..end with a single cnc_upstart3 and split the stream per program."""
+        return split_program_stream("".join(self._iter_upload(start, end, path_no, monitor)))
+
+    def _iter_upload(self, start: int, end: int, path_no: int = 0, monitor: Optional[TransferMonitor] = None) -> Iterator[str]:
         self.set_path(path_no)
         
-        ret = self.lib.cnc_upstart3(self.handle, 0, prog_num, prog_num)
-        if ret != EW_OK: raise FocasError(ret, f"Failed to start upload for program O{prog_num}")
+        ret = self._call("cnc_upstart3", self.handle, 0, start, end)
+        if ret != EW_OK:
+            target = f"program O{start}" if start == end else f"programs O{start}-O{end}"
+            raise FocasError(ret, f"Failed to start upload for {target}")
             
         buf_size = 1280
         buffer = ctypes.create_string_buffer(buf_size + 1)
-        result_text = []
+        percent_count = 0
+        last_char = ""
+        received = 0
+        transfer_started = time.perf_counter()
         
         try:
             while True:
+                if monitor:
+                    monitor.check()
                 length = ctypes.c_long(buf_size)
-                ret = self.lib.cnc_upload3(self.handle, ctypes.byref(length), buffer)
+                ret = self._call("cnc_upload3", self.handle, ctypes.byref(length), buffer)
                 
                 if ret == EW_BUFFER:
+                    if monitor:
+                        monitor.add_retry()
                     time.sleep(0.05)
                     continue
                     
                 if ret == EW_OK:
+                    if monitor:
+                        monitor.add_bytes(length.value)
+                    received += length.value
                     chunk_str = buffer.raw[:length.value].decode('ascii', errors='ignore')
-                    result_text.append(chunk_str)
-                    combined_text = "".join(result_text).rstrip("\r\n ")
-                    if combined_text.count("%") >= 2 and combined_text.endswith("%"):
+                    percent_count += chunk_str.count("%")
+                    trimmed = chunk_str.rstrip("\r\n ")
+                    if trimmed:
+                        last_char = trimmed[-1]
+                    if chunk_str:
+                        yield chunk_str
+                    if percent_count >= 2 and last_char == "%":
                         break
                 elif ret == EW_RESET:
                     break
                 else:
                     raise FocasError(ret, "Error during data receive loop (cnc_upload3)")
         finally:
-            end_ret = self.lib.cnc_upend3(self.handle)
+            end_ret = self._call("cnc_upend3", self.handle)
+            _call_stats.record_transfer(self.controller, "upload", received, time.perf_counter() - transfer_started)
             if end_ret != EW_OK: logger.warning(f"cnc_upend3 returned non-zero during cleanup: {end_ret}")
-        return "".join(result_text)
 
+    @staticmethod
+    def _program_entry(prog: PRGDIR3) -> Dict[str, Any]:
+        comment = prog.comment.decode('ascii', errors='ignore').strip('\x00').strip()
+        return {
+            "number": prog.number,
+            "length": prog.length,
+            "comment": comment,
+            "mdate": _format_focas_date(prog.mdate),
+            "cdate": _format_focas_date(prog.cdate),
+        }
+
+    @traced("focas.list_programs", _controller_attributes)
     def list_programs(self, path_no: int = 0) -> list:
         self.set_path(path_no)
         
-        MAX_PROG = 10
+        MAX_PROG = max(1, min(int(self.dir_batch_size), 0x7FFF))
         prgdir_array = (PRGDIR3 * MAX_PROG)()
         top_prog = ctypes.c_long(0)
         
@@ -449,17 +1313,11 @@ class RealFocasClient(FocasClientBase):
         while True:
             num_prog = ctypes.c_short(MAX_PROG)
             # type 2 = read prog number, length, comment, and date
-            ret = self.lib.cnc_rdprogdir3(self.handle, 2, ctypes.byref(top_prog), ctypes.byref(num_prog), ctypes.byref(prgdir_array))
+            ret = self._call("cnc_rdprogdir3", self.handle, 2, ctypes.byref(top_prog), ctypes.byref(num_prog), ctypes.byref(prgdir_array))
             
             if ret == EW_OK:
                 for i in range(num_prog.value):
-                    prog = prgdir_array[i]
-                    comment = prog.comment.decode('ascii', errors='ignore').strip('\x00').strip()
-                    programs.append({
-                        "number": prog.number,
-                        "length": prog.length,
-                        "comment": comment
-                    })
+                    programs.append(self._program_entry(prgdir_array[i]))
                 
                 if num_prog.value < MAX_PROG:
                     break  # Read all programs
@@ -472,24 +1330,184 @@ class RealFocasClient(FocasClientBase):
                 
         return programs
 
+    @traced("focas.find_program", _program_attributes)
+    def find_program(self, prog_num: int, path_no: int = 0) -> Optional[Dict[str, Any]]:
+        """Read a single directory entry with one cnc_rdprogdir3 round trip."""
+        self.set_path(path_no)
+
+        entry = (PRGDIR3 * 1)()
+        top_prog = ctypes.c_long(prog_num)
+        num_prog = ctypes.c_short(1)
+        ret = self._call("cnc_rdprogdir3", self.handle, 2, ctypes.byref(top_prog), ctypes.byref(num_prog), ctypes.byref(entry))
+        if ret != EW_OK or num_prog.value < 1 or entry[0].number != prog_num:
+            return None
+        return self._program_entry(entry[0])
+
+    @traced("focas.get_path_count", _controller_attributes)
+    def get_path_count(self) -> int:
+        path_no = ctypes.c_short(0)
+        max_path = ctypes.c_short(0)
+        ret = self._call("cnc_getpath", self.handle, ctypes.byref(path_no), ctypes.byref(max_path))
+        if ret != EW_OK:
+            raise FocasError(ret, "Failed to read the number of paths (cnc_getpath)")
+        return max(1, max_path.value)
+
+    def read_status(self) -> Dict[str, Any]:
+        status = ODBST()
+        ret = self._call("cnc_statinfo", self.handle, ctypes.byref(status))
+        if ret != EW_OK:
+            raise FocasError(ret, "Failed to read CNC status (cnc_statinfo)")
+        return _status_entry(status)
+
+    def read_positions(self) -> list:
+        positions = (ODBPOS * FOCAS_MAX_AXES)()
+        num_axes = ctypes.c_short(FOCAS_MAX_AXES)
+        # type -1 = absolute, machine, relative and distance to go in one call
+        ret = self._call("cnc_rdposition", self.handle, -1, ctypes.byref(num_axes), ctypes.byref(positions))
+        if ret != EW_OK:
+            raise FocasError(ret, "Failed to read axis positions (cnc_rdposition)")
+        result = []
+        for i in range(num_axes.value):
+            position = positions[i]
+            axis = position.abs.name.decode('ascii', errors='ignore') + position.abs.suff.decode('ascii', errors='ignore').strip('\x00 ')
+            result.append({
+                "axis": axis,
+                "absolute": _position_value(position.abs),
+                "machine": _position_value(position.mach),
+                "relative": _position_value(position.rel),
+                "distance": _position_value(position.dist),
+            })
+        return result
+
+    def read_alarms(self) -> list:
+        alarms = (ODBALMMSG2 * FOCAS_MAX_ALARMS)()
+        num_alarms = ctypes.c_short(FOCAS_MAX_ALARMS)
+        # type -1 = alarms of every type
+        ret = self._call("cnc_rdalmmsg2", self.handle, -1, ctypes.byref(num_alarms), ctypes.byref(alarms))
+        if ret != EW_OK:
+            raise FocasError(ret, "Failed to read alarm messages (cnc_rdalmmsg2)")
+        return [
+            {
+                "number": alarms[i].alm_no,
+                "type": alarms[i].type,
+                "axis": alarms[i].axis,
+                "message": alarms[i].alm_msg[:max(0, alarms[i].msg_len)].decode('ascii', errors='ignore').strip(),
+            }
+            for i in range(num_alarms.value)
+        ]
+
+    def read_program_info(self) -> Dict[str, Any]:
+        program = ODBPRO()
+        ret = self._call("cnc_rdprgnum", self.handle, ctypes.byref(program))
+        if ret != EW_OK:
+            raise FocasError(ret, "Failed to read the executing program (cnc_rdprgnum)")
+        sequence = ODBSEQ()
+        ret = self._call("cnc_rdseqnum", self.handle, ctypes.byref(sequence))
+        if ret != EW_OK:
+            raise FocasError(ret, "Failed to read the sequence number (cnc_rdseqnum)")
+        return {"running": program.data, "main": program.mdata, "sequence": sequence.data}
+
 # Dependency Injection setup
 USE_MOCK = os.environ.get("USE_MOCK_FOCAS", "0") == "1"
+# USE_SIMULATED_FOCAS=1 runs RealFocasClient against the cnc_* simulator in focas_simulator
+USE_SIMULATED = os.environ.get("USE_SIMULATED_FOCAS", "0") == "1"
+
+
+def _new_real_client() -> RealFocasClient:
+    if USE_SIMULATED:
+        try:
+            from backend.focas_simulator import get_simulated_library
+        except ImportError:
+            from focas_simulator import get_simulated_library
+        return RealFocasClient(lib=get_simulated_library())
+    return RealFocasClient()
 
 # Initialize a global instance based on environment variable
 # You can set USE_MOCK_FOCAS=1 in your environment/docker-compose to use the mock DLLs.
-_focas_instance = DummyFocasClient() if USE_MOCK else RealFocasClient()
+_focas_instance = DummyFocasClient() if USE_MOCK else _new_real_client()
 
 def get_focas_client() -> FocasClientBase:
-    """FastAPI Dependency for FOCAS operations"""
+    """The process-wide client; it holds one session handle, so concurrent requests use create_focas_client()."""
     return _focas_instance
 
 
 _demo_focas_instance = DummyFocasClient()
 
+# Demo visitors with their own program store, and seconds an idle store is kept
+FOCAS_DEMO_SESSIONS = int(os.environ.get("FOCAS_DEMO_SESSIONS", "500"))
+FOCAS_DEMO_SESSION_TTL = float(os.environ.get("FOCAS_DEMO_SESSION_TTL", "3600"))
+
+_DEMO_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class DemoSessionStore:
+    """One DummyFocasClient per demo session, so visitors never see each other's edits.
+
+    The least recently used session is dropped beyond `max_sessions`, and
+    sessions idle for longer than `ttl` seconds start over from the seed programs.
+    """
+    def __init__(self, max_sessions: int, ttl: float):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._lock = Lock()
+        self._clients: "OrderedDict[str, Tuple[float, DummyFocasClient]]" = OrderedDict()
+
+    def get(self, session_id: str) -> DummyFocasClient:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.pop(session_id, None)
+            client = entry[1] if entry and now - entry[0] <= self.ttl else DummyFocasClient()
+            self._clients[session_id] = (now, client)
+            while len(self._clients) > self.max_sessions:
+                self._clients.popitem(last=False)
+            return client
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+_demo_sessions = DemoSessionStore(FOCAS_DEMO_SESSIONS, FOCAS_DEMO_SESSION_TTL)
+
 
 def is_demo_ip(ip_address: str) -> bool:
-    return ip_address.strip().upper() == "DEMO"
+    return ip_address.strip().upper().split("#", 1)[0] == "DEMO"
+
+
+def _demo_session_key(session_id: Optional[str]) -> Optional[str]:
+    """A valid session id in lower case, or None.
+
+    The caches key on the upper-cased address, so ids that differ only in case
+    must be the same session; otherwise they would share cached listings.
+    """
+    if session_id and _DEMO_SESSION_ID.match(session_id):
+        return session_id.lower()
+    return None
+
+
+def demo_address(session_id: Optional[str] = None) -> str:
+    """Address of a demo session's controller: "DEMO#<session>", or "DEMO" for the shared one.
+
+    Caches, telemetry and jobs key on the address, so sessions stay apart there too.
+    """
+    session_key = _demo_session_key(session_id)
+    return f"DEMO#{session_key}" if session_key else "DEMO"
+
+
+def get_demo_focas_client(session_id: Optional[str] = None) -> DummyFocasClient:
+    session_key = _demo_session_key(session_id)
+    return _demo_sessions.get(session_key) if session_key else _demo_focas_instance
+
 
+def create_focas_client(ip_address: str) -> FocasClientBase:
+    """Return a client with its own session for one request or job.
 
-def get_demo_focas_client() -> DummyFocasClient:
-    return _demo_focas_instance
+    A RealFocasClient holds a single session handle, and connect() frees the
+    previous one, so concurrent requests must never share a client. Real
+    controllers get a fresh RealFocasClient (sharing the loaded library);
+    demo and mock mode keep using their shared program store.
+    """
+    if is_demo_ip(ip_address):
+        return get_demo_focas_client(ip_address.strip().partition("#")[2] or None)
+    if USE_MOCK:
+        return _focas_instance
+    return _new_real_client()
@@ -0,0 +1,352 @@
+import ctypes
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from backend.focas_service import (
+        EW_BUFFER, EW_DATA, EW_HANDLE, EW_OK, EW_PROT, EW_SOCKET,
+        FOCAS_DATE, DummyFocasClient, normalize_program_text, split_program_stream,
+    )
+except ImportError:
+    from focas_service import (
+        EW_BUFFER, EW_DATA, EW_HANDLE, EW_OK, EW_PROT, EW_SOCKET,
+        FOCAS_DATE, DummyFocasClient, normalize_program_text, split_program_stream,
+    )
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatorConfig:
+    """Timing and limits of every simulated controller. Defaults come from FOCAS_SIM_* variables."""
+    def __init__(self, bandwidth: Optional[float] = None, buffer_depth: Optional[int] = None,
+                 handshake_latency: Optional[float] = None, call_latency: Optional[float] = None,
+                 max_handles: Optional[int] = None, fault_rate: Optional[float] = None,
+                 fault_code: Optional[int] = None, seed: Optional[int] = None):
+        env = os.environ.get
+        # Bytes per second the CNC accepts (download) or produces (upload)
+        self.bandwidth = bandwidth if bandwidth is not None else float(env("FOCAS_SIM_BANDWIDTH", "65536"))
+        # Bytes the CNC buffers before cnc_download3 answers EW_BUFFER
+        self.buffer_depth = buffer_depth if buffer_depth is not None else int(env("FOCAS_SIM_BUFFER_DEPTH", "4096"))
+        self.handshake_latency = handshake_latency if handshake_latency is not None else float(env("FOCAS_SIM_HANDSHAKE_MS", "50")) / 1000
+        self.call_latency = call_latency if call_latency is not None else float(env("FOCAS_SIM_CALL_MS", "0")) / 1000
+        # Open handles a controller accepts; the FOCAS default on most controls is 5
+        self.max_handles = max_handles if max_handles is not None else int(env("FOCAS_SIM_MAX_HANDLES", "5"))
+        # Probability that a data call (cnc_download3 / cnc_upload3) fails with fault_code
+        self.fault_rate = fault_rate if fault_rate is not None else float(env("FOCAS_SIM_FAULT_RATE", "0"))
+        self.fault_code = fault_code if fault_code is not None else int(env("FOCAS_SIM_FAULT_CODE", str(EW_SOCKET)))
+        self.seed = seed
+
+
+class SimulatedController:
+    """Program memory and open handles of one simulated CNC."""
+    def __init__(self, ip: str, port: int):
+        self.ip = ip
+        self.port = port
+        self.handles = 0
+        self.programs_by_path: Dict[int, Dict[int, Dict[str, Any]]] = {
+            path_no: {
+                number: {"text": program["program_text"], "mdate": datetime(2024, 1, 1, 8, 0), "cdate": datetime(2024, 1, 1, 8, 0)}
+                for number, program in programs.items()
+            }
+            for path_no, programs in DummyFocasClient._build_seed_programs().items()
+        }
+        # call name -> [error code, remaining count] scheduled by inject_fault
+        self.faults: Dict[str, List[int]] = {}
+
+
+class _Handle:
+    def __init__(self, controller: SimulatedController):
+        self.controller = controller
+        self.path_no = 1
+        self.transfer: Optional[str] = None
+        self.data = b""
+        self.sent = 0
+        self.buffered = 0.0
+        self.started = 0.0
+        self.last_drain = 0.0
+
+
+def _set(pointer: Any, value: Any):
+    # Arguments arrive as ctypes.byref() objects, exactly as the real DLL sees them
+    pointer._obj.value = value
+
+
+def _fill_date(date: FOCAS_DATE, value: datetime):
+    date.year, date.month, date.day = value.year, value.month, value.day
+    date.hour, date.minute = value.hour, value.minute
+
+
+class SimulatedFocasLibrary:
+    """Stand-in for FWLIB64 with the cnc_* calls that RealFocasClient makes.
+
+    Every IP address reaches its own simulated controller, seeded with the demo
+    programs. Transfers move at `bandwidth` through a CNC buffer of `buffer_depth`
+    bytes, so cnc_download3 and cnc_upload3 answer EW_BUFFER like a busy control
+    and the client's retry loops run for real. Handshakes take `handshake_latency`,
+    each controller accepts `max_handles` sessions, and faults can be injected at
+    random (`fault_rate`) or per call with inject_fault().
+    """
+    def __init__(self, config: Optional[SimulatorConfig] = None):
+        self.config = config or SimulatorConfig()
+        self._lock = Lock()
+        self._random = random.Random(self.config.seed)
+        self._controllers: Dict[Tuple[str, int], SimulatedController] = {}
+        self._handles: Dict[int, _Handle] = {}
+        self._next_handle = 1
+        self.calls: Dict[str, int] = {}
+
+    def controller(self, ip: str, port: int = 8193) -> SimulatedController:
+        with self._lock:
+            key = (ip, int(port))
+            if key not in self._controllers:
+                self._controllers[key] = SimulatedController(ip, int(port))
+            return self._controllers[key]
+
+    def inject_fault(self, ip: str, call: str, code: int, count: int = 1, port: int = 8193):
+        """Make the next `count` calls of `call` (e.g. "cnc_upload3") on this controller return `code`."""
+        controller = self.controller(ip, port)
+        with self._lock:
+            controller.faults[call] = [code, count]
+
+    def _enter(self, call: str, handle: Any = None) -> Tuple[int, Optional[_Handle]]:
+        """Count the call, apply call latency and faults, and resolve the handle."""
+        if self.config.call_latency:
+            time.sleep(self.config.call_latency)
+        with self._lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+            state = None
+            if handle is not None:
+                handle_value = handle.value if hasattr(handle, "value") else int(handle)
+                state = self._handles.get(handle_value)
+                if state is None:
+                    return EW_HANDLE, None
+                fault = state.controller.faults.get(call)
+                if fault:
+                    fault[1] -= 1
+                    if fault[1] <= 0:
+                        del state.controller.faults[call]
+                    return fault[0], state
+                if call in ("cnc_download3", "cnc_upload3") and self.config.fault_rate and self._random.random() < self.config.fault_rate:
+                    return self.config.fault_code, state
+            return EW_OK, state
+
+    # --- Connect & Disconnect ---
+
+    def cnc_allclibhndl3(self, ip: bytes, port: int, timeout: int, handle_ptr: Any) -> int:
+        self._enter("cnc_allclibhndl3")
+        controller = self.controller(ip.decode("ascii"), port)
+        time.sleep(self.config.handshake_latency)
+        with self._lock:
+            if controller.handles >= self.config.max_handles:
+                logger.info(f"[SIM] {controller.ip}:{controller.port} refused a handle ({controller.handles} open)")
+                return EW_SOCKET
+            controller.handles += 1
+            handle_value = self._next_handle
+            self._next_handle = self._next_handle % 0xFFFF + 1
+            self._handles[handle_value] = _Handle(controller)
+        _set(handle_ptr, handle_value)
+        return EW_OK
+
+    def cnc_freelibhndl(self, handle: Any) -> int:
+        ret, state = self._enter("cnc_freelibhndl", handle)
+        if state is None:
+            return ret
+        with self._lock:
+            self._handles.pop(handle.value if hasattr(handle, "value") else int(handle), None)
+            state.controller.handles -= 1
+        return EW_OK
+
+    # --- Paths ---
+
+    def cnc_setpath(self, handle: Any, path_no: int) -> int:
+        ret, state = self._enter("cnc_setpath", handle)
+        if ret != EW_OK:
+            return ret
+        if path_no not in state.controller.programs_by_path:
+            return EW_DATA
+        state.path_no = path_no
+        return EW_OK
+
+    def cnc_getpath(self, handle: Any, path_ptr: Any, max_path_ptr: Any) -> int:
+        ret, state = self._enter("cnc_getpath", handle)
+        if ret != EW_OK:
+            return ret
+        _set(path_ptr, state.path_no)
+        _set(max_path_ptr, max(state.controller.programs_by_path))
+        return EW_OK
+
+    # --- Download (PC -> CNC) ---
+
+    def cnc_dwnstart3(self, handle: Any, data_type: int) -> int:
+        ret, state = self._enter("cnc_dwnstart3", handle)
+        if ret != EW_OK:
+            return ret
+        if state.transfer:
+            return EW_PROT
+        state.transfer, state.data, state.buffered = "download", b"", 0.0
+        state.last_drain = time.monotonic()
+        return EW_OK
+
+    def cnc_download3(self, handle: Any, length_ptr: Any, data: bytes) -> int:
+        ret, state = self._enter("cnc_download3", handle)
+        if ret != EW_OK:
+            return ret
+        if state.transfer != "download":
+            return EW_PROT
+        now = time.monotonic()
+        # The CNC stores what it buffered at `bandwidth`; only free buffer space takes new data
+        state.buffered = max(0.0, state.buffered - (now - state.last_drain) * self.config.bandwidth)
+        state.last_drain = now
+        free = int(self.config.buffer_depth - state.buffered)
+        if free <= 0:
+            return EW_BUFFER
+        accepted = min(length_ptr._obj.value, free)
+        state.data += bytes(data[:accepted])
+        state.buffered += accepted
+        _set(length_ptr, accepted)
+        return EW_OK
+
+    def cnc_dwnend3(self, handle: Any) -> int:
+        ret, state = self._enter("cnc_dwnend3", handle)
+        if state is None:
+            return ret
+        data, state.transfer, state.data = state.data, None, b""
+        if ret != EW_OK:
+            return ret
+        programs = split_program_stream(data.decode("ascii", errors="ignore"))
+        if not programs:
+            return EW_DATA
+        now = datetime.now().replace(second=0, microsecond=0)
+        with self._lock:
+            path_programs = state.controller.programs_by_path.setdefault(state.path_no, {})
+            for number, program_text in programs.items():
+                existing = path_programs.get(number)
+                path_programs[number] = {"text": program_text, "mdate": now, "cdate": existing["cdate"] if existing else now}
+        return EW_OK
+
+    # --- Upload (CNC -> PC) ---
+
+    def cnc_upstart3(self, handle: Any, data_type: int, start: int, end: int) -> int:
+        ret, state = self._enter("cnc_upstart3", handle)
+        if ret != EW_OK:
+            return ret
+        if state.transfer:
+            return EW_PROT
+        with self._lock:
+            path_programs = state.controller.programs_by_path.get(state.path_no, {})
+            texts = [path_programs[number]["text"] for number in sorted(path_programs) if start <= number <= end]
+        if not texts:
+            return EW_DATA
+        bodies = [normalize_program_text(text).strip("%").strip() for text in texts]
+        state.transfer = "upload"
+        state.data = ("%\n" + "\n".join(bodies) + "\n%").encode("ascii", errors="ignore")
+        state.sent = 0
+        state.started = time.monotonic()
+        return EW_OK
+
+    def cnc_upload3(self, handle: Any, length_ptr: Any, buffer: Any) -> int:
+        ret, state = self._enter("cnc_upload3", handle)
+        if ret != EW_OK:
+            return ret
+        if state.transfer != "upload":
+            return EW_PROT
+        # Data becomes available at `bandwidth`, at most one CNC buffer ahead of the reader
+        produced = min(len(state.data), int((time.monotonic() - state.started) * self.config.bandwidth) + self.config.buffer_depth)
+        available = min(produced - state.sent, length_ptr._obj.value)
+        if available <= 0:
+            return EW_BUFFER
+        chunk = state.data[state.sent:state.sent + available]
+        ctypes.memmove(buffer, chunk, len(chunk))
+        state.sent += len(chunk)
+        _set(length_ptr, len(chunk))
+        return EW_OK
+
+    def cnc_upend3(self, handle: Any) -> int:
+        ret, state = self._enter("cnc_upend3", handle)
+        if state is None:
+            return ret
+        state.transfer, state.data = None, b""
+        return ret
+
+    # --- Directory ---
+
+    def cnc_rdprogdir3(self, handle: Any, data_type: int, top_prog_ptr: Any, num_prog_ptr: Any, entries_ptr: Any) -> int:
+        ret, state = self._enter("cnc_rdprogdir3", handle)
+        if ret != EW_OK:
+            return ret
+        entries = entries_ptr._obj
+        with self._lock:
+            path_programs = state.controller.programs_by_path.get(state.path_no, {})
+            numbers = [number for number in sorted(path_programs) if number >= top_prog_ptr._obj.value]
+            numbers = numbers[:num_prog_ptr._obj.value]
+            for i, number in enumerate(numbers):
+                program = path_programs[number]
+                entries[i].number = number
+                entries[i].length = len(program["text"])
+                entries[i].comment = DummyFocasClient._extract_comment(program["text"], "").encode("ascii", errors="ignore")[:51]
+                _fill_date(entries[i].mdate, program["mdate"])
+                _fill_date(entries[i].cdate, program["cdate"])
+        _set(num_prog_ptr, len(numbers))
+        return EW_OK
+
+    # --- Machine state ---
+
+    def cnc_statinfo(self, handle: Any, status_ptr: Any) -> int:
+        ret, state = self._enter("cnc_statinfo", handle)
+        if ret != EW_OK:
+            return ret
+        status = status_ptr._obj
+        status.aut, status.run = 1, 0
+        return EW_OK
+
+    def cnc_rdposition(self, handle: Any, position_type: int, num_axes_ptr: Any, positions_ptr: Any) -> int:
+        ret, state = self._enter("cnc_rdposition", handle)
+        if ret != EW_OK:
+            return ret
+        positions = positions_ptr._obj
+        axes = [b"X", b"Y", b"Z"][:num_axes_ptr._obj.value]
+        for i, name in enumerate(axes):
+            for element in (positions[i].abs, positions[i].mach, positions[i].rel, positions[i].dist):
+                element.data, element.dec, element.name = 0, 3, name
+        _set(num_axes_ptr, len(axes))
+        return EW_OK
+
+    def cnc_rdalmmsg2(self, handle: Any, alarm_type: int, num_ptr: Any, alarms_ptr: Any) -> int:
+        ret, state = self._enter("cnc_rdalmmsg2", handle)
+        if ret != EW_OK:
+            return ret
+        _set(num_ptr, 0)
+        return EW_OK
+
+    def cnc_rdprgnum(self, handle: Any, program_ptr: Any) -> int:
+        ret, state = self._enter("cnc_rdprgnum", handle)
+        if ret != EW_OK:
+            return ret
+        numbers = sorted(state.controller.programs_by_path.get(state.path_no, {}))
+        program_ptr._obj.data = program_ptr._obj.mdata = numbers[0] if numbers else 0
+        return EW_OK
+
+    def cnc_rdseqnum(self, handle: Any, sequence_ptr: Any) -> int:
+        ret, state = self._enter("cnc_rdseqnum", handle)
+        if ret != EW_OK:
+            return ret
+        sequence_ptr._obj.data = 0
+        return EW_OK
+
+
+_simulated_library: Optional[SimulatedFocasLibrary] = None
+_simulated_library_lock = Lock()
+
+
+def get_simulated_library() -> SimulatedFocasLibrary:
+    """The simulator shared by all clients, so handle limits apply across sessions."""
+    global _simulated_library
+    with _simulated_library_lock:
+        if _simulated_library is None:
+            _simulated_library = SimulatedFocasLibrary()
+        return _simulated_library
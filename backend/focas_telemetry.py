@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from backend.focas_service import FocasClientBase, FocasError, EW_SOCKET, create_focas_client
+except ImportError:
+    from focas_service import FocasClientBase, FocasError, EW_SOCKET, create_focas_client
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two telemetry reads of the same controller
+FOCAS_TELEMETRY_INTERVAL = float(os.environ.get("FOCAS_TELEMETRY_INTERVAL", "0.5"))
+# Snapshots queued per subscriber before older ones are dropped
+FOCAS_TELEMETRY_SUBSCRIBER_QUEUE = 4
+
+
+class TelemetryChannel:
+    """Subscribers and the polling task of one controller."""
+    def __init__(self, ip_address: str, port: int):
+        self.ip_address = ip_address
+        self.port = port
+        # Each subscriber queue maps to the path it wants
+        self.subscribers: Dict["asyncio.Queue[Dict[str, Any]]", int] = {}
+        self.latest: Dict[int, Dict[str, Any]] = {}
+        self.task: Optional["asyncio.Task[None]"] = None
+        # Set when the last subscriber leaves, so the poller stops without waiting out its interval
+        self.stopped = asyncio.Event()
+
+    def publish(self, path_no: int, snapshot: Dict[str, Any]):
+        self.latest[path_no] = snapshot
+        for queue, wanted_path in list(self.subscribers.items()):
+            if wanted_path != path_no:
+                continue
+            if queue.full():
+                # A slow client only ever needs the newest state
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+
+class TelemetryHub:
+    """Live machine telemetry shared by every client that watches a controller.
+
+    Each controller gets one polling task with one FOCAS session, however many
+    browsers subscribe, so viewers never eat into the controller's handle limit.
+    Every pass reads status, positions, alarms and the executing program of each
+    subscribed path. When the last subscriber leaves, the channel is dropped and
+    its poller closes the session after the read in progress.
+    """
+    def __init__(self, interval: float = FOCAS_TELEMETRY_INTERVAL,
+                 client_factory: Callable[[str], FocasClientBase] = create_focas_client):
+        self.interval = interval
+        self.client_factory = client_factory
+        self._channels: Dict[Tuple[str, int], TelemetryChannel] = {}
+
+    def subscribe(self, ip_address: str, port: int = 8193, path_no: int = 0) -> "asyncio.Queue[Dict[str, Any]]":
+        key = (ip_address.strip(), int(port))
+        channel = self._channels.get(key)
+        if channel is None:
+            channel = self._channels[key] = TelemetryChannel(*key)
+        queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=FOCAS_TELEMETRY_SUBSCRIBER_QUEUE)
+        channel.subscribers[queue] = path_no
+        if channel.task is None or channel.task.done():
+            channel.task = asyncio.ensure_future(self._poll_loop(channel))
+        return queue
+
+    def unsubscribe(self, ip_address: str, port: int, queue: "asyncio.Queue[Dict[str, Any]]"):
+        key = (ip_address.strip(), int(port))
+        channel = self._channels.get(key)
+        if channel is None:
+            return
+        channel.subscribers.pop(queue, None)
+        if not channel.subscribers:
+            del self._channels[key]
+            channel.stopped.set()
+
+    def latest(self, ip_address: str, port: int = 8193, path_no: int = 0) -> Optional[Dict[str, Any]]:
+        """Newest snapshot of a controller that is being polled anyway, else None."""
+        channel = self._channels.get((ip_address.strip(), int(port)))
+        if channel is None or not channel.subscribers:
+            return None
+        return channel.latest.get(path_no)
+
+    def subscriber_count(self, ip_address: str, port: int = 8193) -> int:
+        channel = self._channels.get((ip_address.strip(), int(port)))
+        return len(channel.subscribers) if channel else 0
+
+    def _snapshot(self, channel: TelemetryChannel, telemetry: Dict[str, Any]) -> Dict[str, Any]:
+        return {"ip_address": channel.ip_address, "port": channel.port, "connected": True, **telemetry}
+
+    def _error_snapshot(self, channel: TelemetryChannel, path_no: int, error: Exception) -> Dict[str, Any]:
+        snapshot = {
+            "ip_address": channel.ip_address, "port": channel.port, "path": path_no,
+            "timestamp": time.time(), "connected": False, "error": str(error),
+        }
+        if isinstance(error, FocasError):
+            snapshot["error_code"] = error.code
+        return snapshot
+
+    async def _poll_loop(self, channel: TelemetryChannel):
+        loop = asyncio.get_running_loop()
+        client: Optional[FocasClientBase] = None
+        try:
+            while channel.subscribers:
+                started = time.monotonic()
+                for path_no in sorted(set(channel.subscribers.values())):
+                    try:
+                        if client is None:
+                            client = self.client_factory(channel.ip_address)
+                            if not await loop.run_in_executor(None, client.connect, channel.ip_address, channel.port):
+                                client = None
+                                raise FocasError(EW_SOCKET, f"Could not connect to CNC at {channel.ip_address}:{channel.port}")
+                        telemetry = await loop.run_in_executor(None, client.read_telemetry, path_no)
+                        snapshot = self._snapshot(channel, telemetry)
+                    except (FocasError, RuntimeError, OSError) as e:
+                        logger.warning("Telemetry read from %s:%s failed: %s", channel.ip_address, channel.port, e)
+                        if client is not None:
+                            # Start over with a fresh session on the next pass
+                            await loop.run_in_executor(None, client.disconnect)
+                            client = None
+                        snapshot = self._error_snapshot(channel, path_no, e)
+                    channel.publish(path_no, snapshot)
+                try:
+                    await asyncio.wait_for(channel.stopped.wait(), max(0.0, self.interval - (time.monotonic() - started)))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Let the next subscriber start a fresh task while this one closes its session
+            if channel.task is asyncio.current_task():
+                channel.task = None
+            channel.latest.clear()
+            key = (channel.ip_address, channel.port)
+            if self._channels.get(key) is channel and not channel.subscribers:
+                del self._channels[key]
+            if client is not None:
+                await loop.run_in_executor(None, client.disconnect)
+
+
+_telemetry_hub = TelemetryHub()
+
+
+def get_telemetry_hub() -> TelemetryHub:
+    return _telemetry_hub
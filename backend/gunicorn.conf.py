@@ -0,0 +1,105 @@
+"""Gunicorn settings for production: uvicorn workers forked from a preloaded app.
+
+    gunicorn -c backend/gunicorn.conf.py backend.main_import:app
+
+The master imports the app and warms up ncplot7py and the machine configs
+before forking, so workers start ready and share that memory copy-on-write.
+
+One worker is the default, not one per core. Demo sessions, FOCAS jobs and
+their archives, the fleet watch list, telemetry pollers and the metrics live
+in process memory, so several workers would each answer with their own copy;
+scale with more containers instead.
+
+For the same reason a replaced worker takes all of that state with it, and
+a client polling a job gets 404 afterwards. Workers are therefore not
+recycled after a number of requests unless GUNICORN_MAX_REQUESTS asks for
+it. A worker whose resident memory exceeds GUNICORN_MAX_RSS_MB is replaced
+once no FOCAS job is queued or running, which contains slow growth in the
+engine without cutting off transfers.
+"""
+import gc
+import os
+import signal
+import threading
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# State is per process (see above), so one worker unless WEB_CONCURRENCY, which most platforms set, asks for more
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+preload_app = True
+
+# Recycle workers after this many requests (0 disables); the jitter keeps them from restarting together.
+# Off by default: recycling drops the in-memory state, running jobs included
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+# Resident memory in MiB above which a worker finishes its FOCAS jobs and requests and is replaced (0 disables)
+max_rss_mb = int(os.environ.get("GUNICORN_MAX_RSS_MB", "1024"))
+rss_check_interval = float(os.environ.get("GUNICORN_RSS_CHECK_INTERVAL", "10"))
+
+# Long plots must finish: a worker is only killed after `timeout` seconds without a heartbeat,
+# and a recycled worker gets `graceful_timeout` seconds for the requests it is still serving
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "90"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+accesslog = "-"
+errorlog = "-"
+
+
+def when_ready(server):
+    """Runs in the master after the app is preloaded and before any worker is forked."""
+    try:
+        from backend import main_import
+    except ImportError:
+        import main_import
+    if workers > 1:
+        server.log.warning("Running %s workers: demo sessions, FOCAS jobs, the fleet watch list and metrics are per worker", workers)
+    timings = main_import.warm_up()
+    server.log.info("Warm-up done: %s", ", ".join(f"{step} {seconds * 1000:.0f} ms" for step, seconds in timings.items()))
+    # Move everything loaded so far out of the collector's reach, so collections in the
+    # workers do not write to (and thereby copy) the shared pages
+    gc.freeze()
+
+
+def _rss_mb() -> float:
+    """Current resident set size of this process in MiB, or 0 where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def _jobs_running() -> int:
+    try:
+        from backend.focas_jobs import get_job_registry
+    except ImportError:
+        from focas_jobs import get_job_registry
+    return get_job_registry().active_count()
+
+
+def _watch_rss(worker):
+    waiting = False
+    while True:
+        time.sleep(rss_check_interval)
+        rss = _rss_mb()
+        if rss <= max_rss_mb:
+            continue
+        # graceful_timeout is too short for a backup, so let queued and running jobs finish first
+        running = _jobs_running()
+        if running:
+            if not waiting:
+                worker.log.warning("Worker %s uses %.0f MiB (limit %s MiB); recycling it once %s FOCAS jobs finish",
+                                   worker.pid, rss, max_rss_mb, running)
+                waiting = True
+            continue
+        worker.log.warning("Worker %s uses %.0f MiB (limit %s MiB); recycling it", worker.pid, rss, max_rss_mb)
+        # The uvicorn worker treats SIGTERM as a graceful shutdown; the master then forks a replacement
+        os.kill(worker.pid, signal.SIGTERM)
+        return
+
+
+def post_worker_init(worker):
+    if max_rss_mb > 0:
+        threading.Thread(target=_watch_rss, args=(worker,), name="rss-watchdog", daemon=True).start()
@@ -1,11 +1,23 @@
-from fastapi import FastAPI, Request, HTTPException, Header, Depends
-from fastapi.responses import FileResponse, RedirectResponse
+import time
+# Start of the import, for the start-up breakdown on /api/startup
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, Request, HTTPException, Header, Depends, Query
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool as _run_in_threadpool
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+import asyncio
+import hmac
+import io
 import json
 import logging
 import math
+import queue
+import threading
+import zipfile
 from typing import List, Dict, Any, Optional
 import re
 import traceback
@@ -13,29 +25,124 @@ import sys
 from pathlib import Path
 import os
 import importlib.util
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field, field_validator
+
+# Seconds spent per start-up phase; the lazily loaded parts add theirs when they load
+STARTUP_PHASES: Dict[str, float] = {}
+_phase_started = _IMPORT_STARTED
+
+
+def _startup_phase(name: str):
+    """Record the time since the previous phase ended as phase `name`."""
+    global _phase_started
+    now = time.perf_counter()
+    STARTUP_PHASES[name] = now - _phase_started
+    _phase_started = now
+
+
+_startup_phase("framework_imports")
+
+# Before anything logs, so the root logger gets the structured handler and not basicConfig's
+try:
+    from backend.structured_logging import Preview, bind_request, configure_logging, detail_enabled, redact_headers, request_id_var, unbind_request
+except ImportError:
+    from structured_logging import Preview, bind_request, configure_logging, detail_enabled, redact_headers, request_id_var, unbind_request
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Focas Service
 try:
-    from backend.focas_service import get_focas_client, get_demo_focas_client, is_demo_ip, FocasClientBase, FocasError
+    from backend.focas_service import focas_library_status, get_call_stats, get_demo_focas_client, create_focas_client, demo_address, get_directory_cache, get_program_cache, is_demo_ip, FocasClientBase, FocasError
+    from backend.focas_probe import FOCAS_PROBE_MAX_TARGETS, get_probe_cache, probe_port_allowed
+    from backend.focas_fleet import get_fleet_monitor
+    from backend.focas_telemetry import get_telemetry_hub
+    from backend.focas_jobs import get_job_registry, run_backup, run_deploy, run_download, run_upload, backup_archive_path
     FOCAS_IMPORT_OK = True
 except ImportError:
     try:
-        from focas_service import get_focas_client, get_demo_focas_client, is_demo_ip, FocasClientBase, FocasError
+        from focas_service import focas_library_status, get_call_stats, get_demo_focas_client, create_focas_client, demo_address, get_directory_cache, get_program_cache, is_demo_ip, FocasClientBase, FocasError
+        from focas_probe import FOCAS_PROBE_MAX_TARGETS, get_probe_cache, probe_port_allowed
+        from focas_fleet import get_fleet_monitor
+        from focas_telemetry import get_telemetry_hub
+        from focas_jobs import get_job_registry, run_backup, run_deploy, run_download, run_upload, backup_archive_path
         FOCAS_IMPORT_OK = True
     except ImportError as e:
         import logging
         logging.exception(f"Failed to import focas_service: {e}")
         FOCAS_IMPORT_OK = False
         class FocasClientBase: pass
-        def get_focas_client(): return None
-        def get_demo_focas_client(): return None
+        def get_demo_focas_client(session_id: Optional[str] = None): return None
+        def create_focas_client(ip_address: str): return None
+        def demo_address(session_id: Optional[str] = None): return "DEMO"
+        def get_directory_cache(): return None
+        def get_call_stats(): return None
+        def focas_library_status(): return {"state": "unavailable"}
+        def get_program_cache(): return None
+        def get_job_registry(): return None
+        def get_probe_cache(): return None
+        def probe_port_allowed(port: int): return False
+        FOCAS_PROBE_MAX_TARGETS = 0
+        def get_fleet_monitor(): return None
+        def get_telemetry_hub(): return None
+        def run_backup(*args, **kwargs): return None
+        def run_deploy(*args, **kwargs): return None
+        def run_download(*args, **kwargs): return None
+        def run_upload(*args, **kwargs): return None
+        def backup_archive_path(job_id: str): return ""
         def is_demo_ip(ip_address: str): return False
         class FocasError(Exception): pass
 
+try:
+    from backend.metrics import (
+        HTTP_REQUEST_SECONDS, PLOT_ENGINE_ERRORS, PLOT_MOCK_FALLBACKS, PLOT_POINTS, PLOT_REQUESTS, PLOT_STAGE_SECONDS,
+        StageTimer, TimedJSONResponse, current_stage_timer, get_registry, server_timing_header,
+    )
+except ImportError:
+    from metrics import (
+        HTTP_REQUEST_SECONDS, PLOT_ENGINE_ERRORS, PLOT_MOCK_FALLBACKS, PLOT_POINTS, PLOT_REQUESTS, PLOT_STAGE_SECONDS,
+        StageTimer, TimedJSONResponse, current_stage_timer, get_registry, server_timing_header,
+    )
+
+try:
+    from backend.profiling import create_profiler, current_profiler, get_profile_store, profiled, profiled_thread
+except ImportError:
+    from profiling import create_profiler, current_profiler, get_profile_store, profiled, profiled_thread
+
+try:
+    from backend.tracing import SPAN_KIND_SERVER, end_span, set_span_attribute, start_span, traced, tracing_enabled
+except ImportError:
+    from tracing import SPAN_KIND_SERVER, end_span, set_span_attribute, start_span, traced, tracing_enabled
+
+try:
+    from backend.execution_budget import (
+        BudgetExceeded, BudgetMeter, EngineBusy, ExecutionBudget, apply_output_budget, run_with_time_budget,
+    )
+except ImportError:
+    from execution_budget import (
+        BudgetExceeded, BudgetMeter, EngineBusy, ExecutionBudget, apply_output_budget, run_with_time_budget,
+    )
+_startup_phase("backend_modules")
+
 # Simple security: API Key to prevent basic bot requests
 API_KEY = os.environ.get("API_KEY", "nc-edit7-secret-key")
 ENABLE_FOCAS = os.environ.get("ENABLE_FOCAS", "True").lower() in ("true", "1", "t", "yes")
+# Request body chunks buffered between the HTTP stream and a streaming FOCAS download.
+FOCAS_STREAM_QUEUE_CHUNKS = int(os.environ.get("FOCAS_STREAM_QUEUE_CHUNKS", "16"))
+# Seconds without fleet or telemetry news after which an event stream sends a keep-alive comment.
+FOCAS_FLEET_KEEPALIVE = float(os.environ.get("FOCAS_FLEET_KEEPALIVE", "15"))
+# Seconds between progress events on the FOCAS job event stream.
+FOCAS_JOB_EVENT_INTERVAL = float(os.environ.get("FOCAS_JOB_EVENT_INTERVAL", "0.5"))
+# Serve Prometheus metrics on /metrics.
+ENABLE_METRICS = os.environ.get("ENABLE_METRICS", "True").lower() in ("true", "1", "t", "yes")
+# Admin token that enables on-demand profiling via the X-Profile header; unset disables it entirely.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+# Load ncplot7py in a background thread at start-up instead of on the first plot request.
+WARM_UP_IN_BACKGROUND = os.environ.get("WARM_UP_IN_BACKGROUND", "True").lower() in ("true", "1", "t", "yes")
+
+async def run_in_threadpool(func, *args, **kwargs):
+    """Starlette's run_in_threadpool; the worker's time counts towards a profiled request."""
+    return await _run_in_threadpool(profiled(func), *args, **kwargs)
 
 async def verify_api_key(x_api_key: Optional[str] = Header(None)): return True
 
@@ -70,8 +177,25 @@ def resolve_machines_config_path() -> Optional[Path]:
 
     return None
 
-# Import ncplot7py internals
-try:
+# ncplot7py internals; load_engine() imports them on first use, until then they are None
+NCExecutionEngine = None  # type: ignore
+UniversalConfigDrivenControl = None  # type: ignore
+cli_bootstrap = None  # type: ignore
+get_available_machines = None # type: ignore
+get_machine_regex_patterns = None # type: ignore
+get_machine_config = None  # type: ignore
+CNCState = None  # type: ignore
+
+
+class ExceptionNode(Exception):  # type: ignore[no-redef]
+    """Stand-in for ncplot7py's NC error until load_engine() replaces it, so handlers can always catch it."""
+
+
+_engine_lock = threading.Lock()
+_engine_loaded = False
+
+
+def _import_engine() -> Dict[str, Any]:
     from ncplot7py.application.nc_execution import NCExecutionEngine
     from ncplot7py.infrastructure.machines.base_stateful_control import UniversalConfigDrivenControl
     from ncplot7py.cli.main import bootstrap as cli_bootstrap
@@ -82,19 +206,50 @@ try:
     )
     from ncplot7py.domain.cnc_state import CNCState
     from ncplot7py.domain.exceptions import ExceptionNode
-except Exception as e:
-    logging.error(f"Failed to import ncplot7py: {e}")
-    logging.error(traceback.format_exc())
-    # If package isn't importable in some environments, we will raise at runtime
-    NCExecutionEngine = None  # type: ignore
-    UniversalConfigDrivenControl = None  # type: ignore
-    cli_bootstrap = None  # type: ignore
-    get_available_machines = None # type: ignore
-    get_machine_regex_patterns = None # type: ignore
-    CNCState = None  # type: ignore
-    ExceptionNode = None  # type: ignore
-
-app = FastAPI(title="ncplot7py-adapter-import")
+    return {
+        "NCExecutionEngine": NCExecutionEngine,
+        "UniversalConfigDrivenControl": UniversalConfigDrivenControl,
+        "cli_bootstrap": cli_bootstrap,
+        "get_available_machines": get_available_machines,
+        "get_machine_regex_patterns": get_machine_regex_patterns,
+        "get_machine_config": get_machine_config,
+        "CNCState": CNCState,
+        "ExceptionNode": ExceptionNode,
+    }
+
+
+def load_engine() -> bool:
+    """Import ncplot7py on first use and return whether it is available.
+
+    The engine is the slowest part of start-up, so the app answers health
+    checks before it is loaded. Only the first call pays; a failed import is
+    reported once and not retried.
+    """
+    global _engine_loaded
+    if _engine_loaded:
+        return NCExecutionEngine is not None
+    with _engine_lock:
+        if not _engine_loaded:
+            started = time.perf_counter()
+            try:
+                globals().update(_import_engine())
+            except Exception as e:
+                # If package isn't importable in some environments, we will raise at runtime
+                logger.error(f"Failed to import ncplot7py: {e}")
+                logger.error(traceback.format_exc())
+            STARTUP_PHASES["ncplot7py_import"] = time.perf_counter() - started
+            _engine_loaded = True
+    return NCExecutionEngine is not None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARM_UP_IN_BACKGROUND and not _engine_loaded:
+        # Serve right away and load the engine meanwhile; under gunicorn the master did it before forking
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    yield
+
+app = FastAPI(title="ncplot7py-adapter-import", lifespan=lifespan)
 
 # Security: Trusted Host Middleware
 # Prevents Host Header attacks. In Azure, this should be set to your domain (e.g., "nc-edit7.azurewebsites.net").
@@ -158,7 +313,100 @@ async def add_security_headers(request: Request, call_next):
     response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
     return response
 
-logging.basicConfig(level=logging.INFO)
+# Metrics: request latency per route and a Server-Timing header with the stages of the request
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=response.status_code)
+    stages = getattr(request.state, "server_timing", [])
+    response.headers["Server-Timing"] = server_timing_header(stages, elapsed)
+    return response
+
+# Profiling: plot and FOCAS requests sent with X-Profile: <PROFILE_TOKEN> run under a profiler.
+# Without a token the middleware is not installed at all, so unflagged requests pay nothing.
+PROFILED_ROUTES = re.compile(r"^/(cgiserver_import|ncplot7py/scripts/cgiserver\.cgi|api/focas/)")
+
+async def profile_request(request: Request, call_next):
+    token = request.headers.get("x-profile")
+    if token is None or not PROFILED_ROUTES.match(request.url.path):
+        return await call_next(request)
+    if not hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()):
+        return JSONResponse({"detail": "Invalid profiling token."}, status_code=403)
+    store = get_profile_store()
+    if not store.try_acquire():
+        response = await call_next(request)
+        response.headers["X-Profile-Skipped"] = "busy"
+        return response
+    mode = "cprofile" if request.headers.get("x-profile-mode", "").lower() == "cprofile" else "sample"
+    profiler = create_profiler(mode)
+    # call_next runs the route in a task that copies this context, so its threads find the profiler
+    profiler_token = current_profiler.set(profiler)
+    try:
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            # Streaming responses are profiled up to their headers
+            response = await call_next(request)
+        finally:
+            profiler.stop()
+            current_profiler.reset(profiler_token)
+        elapsed = time.perf_counter() - started
+        report = {
+            "method": request.method, "path": request.url.path, "mode": mode,
+            "status": response.status_code, "duration_ms": round(elapsed * 1000, 3),
+            **profiler.report(),
+        }
+        profile_id = await run_in_threadpool(store.save, report, profiler)
+    finally:
+        store.release()
+    response.headers["X-Profile-Id"] = profile_id
+    response.headers["X-Profile-Report"] = f"/api/profiles/{profile_id}"
+    return response
+
+if PROFILE_TOKEN:
+    app.middleware("http")(profile_request)
+
+# Tracing: one server span per request (continuing an incoming traceparent), parent of the plot
+# stage spans and the FOCAS client spans. Spans are exported per TRACE_EXPORT; off by default.
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    if not tracing_enabled():
+        return await call_next(request)
+    span, token = start_span(
+        f"{request.method} {request.url.path}", kind=SPAN_KIND_SERVER, traceparent=request.headers.get("traceparent"),
+        **{"http.request.method": request.method, "url.path": request.url.path, "request.id": request_id_var.get()},
+    )
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        span.record_error(e)
+        end_span(span, token)
+        raise
+    route = getattr(request.scope.get("route"), "path", None)
+    if route:
+        span.name = f"{request.method} {route}"
+        span.set_attribute("http.route", route)
+    span.set_attribute("http.response.status_code", response.status_code)
+    if span.trace_id:
+        response.headers["X-Trace-Id"] = span.trace_id
+    end_span(span, token)
+    return response
+
+# Correlation id: taken from X-Request-ID or generated, attached to every log record and echoed back.
+# Declared last so it is the outermost middleware and covers the others.
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    request_id, tokens = bind_request(request.headers.get("x-request-id"))
+    try:
+        response = await call_next(request)
+    finally:
+        unbind_request(tokens)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 
 
 def apply_turn_axis_defaults(states: List[Optional[Any]], machine_name: str = "") -> None:
@@ -264,7 +512,7 @@ async def get_syntax(control_type: str):
 
 
 def list_machines() -> Dict[str, Any]:
-    if get_available_machines is None:
+    if not load_engine():
         return {"machines": [], "success": False, "message": "ncplot7py not available"}
 
     machines = get_available_machines()
@@ -282,11 +530,56 @@ def list_machines() -> Dict[str, Any]:
     }
 
 
+# Small program with rapid, linear and arc moves that touches the common engine paths
+WARM_UP_PROGRAM = "G0 X0 Y0 Z5\nG1 X10 Y10 F500\nG2 X20 Y0 R10\nM30"
+
+
+def warm_up() -> Dict[str, float]:
+    """Initialise ncplot7py, the machine configs and the engine before the first request.
+
+    The gunicorn master calls this before forking (see gunicorn.conf.py), so the
+    workers share the loaded modules and configs copy-on-write; otherwise the
+    lifespan runs it in the background when WARM_UP_IN_BACKGROUND is set.
+    Returns the seconds spent per step.
+    """
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    load_engine()
+    timings["import"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if cli_bootstrap:
+        try:
+            cli_bootstrap()
+        except Exception:
+            logger.exception("Bootstrap failed during warm-up")
+    timings["bootstrap"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    try:
+        list_machines()
+    except Exception:
+        logger.warning("Loading machine configs during warm-up failed", exc_info=True)
+    timings["machine_configs"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if NCExecutionEngine is not None and UniversalConfigDrivenControl is not None:
+        try:
+            control = UniversalConfigDrivenControl(count_of_canals=1, canal_names=["1"], init_nc_states=None)
+            NCExecutionEngine(control).get_Syncro_plot([sanitize_program(WARM_UP_PROGRAM)], False)
+        except Exception:
+            logger.warning("Warm-up plot failed", exc_info=True)
+    timings["engine"] = time.perf_counter() - started
+    STARTUP_PHASES.update({f"warm_up_{step}": seconds for step, seconds in timings.items()})
+    return timings
+
+
 @app.get("/api/machines")
 async def api_machines():
     return list_machines()
 
 
+@traced("plot.build_segments")
 def build_segments_from_engine_output(canal_output: Dict[str, Any]) -> Dict[str, Any]:
     """Convert NCExecutionEngine canal output to the legacy response shape."""
     segments = []
@@ -414,6 +707,7 @@ def sanitize_program(program: str) -> str:
     return "\n".join(sanitized_lines)
 
 
+@traced("plot.mock_parse", lambda program, machine_name: {"plot.machine": machine_name})
 def mock_parse_nc_program(program: str, machine_name: str) -> Dict[str, Any]:
     """
     Parse NC program and generate mock plot data (legacy behavior).
@@ -503,6 +797,14 @@ def mock_parse_nc_program(program: str, machine_name: str) -> Dict[str, Any]:
     }
 
 
+def count_plot_points(canal_results: Dict[str, Any]) -> int:
+    return sum(
+        len(segment.get("points", []))
+        for canal in canal_results.values() if isinstance(canal, dict)
+        for segment in canal.get("segments", []) if isinstance(segment, dict)
+    )
+
+
 def run_mock_parser(machinedata: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Run the mock parser for all programs in machinedata."""
     canal_results = {}
@@ -528,19 +830,28 @@ def run_mock_parser(machinedata: List[Dict[str, Any]]) -> Dict[str, Any]:
     }
 
 
-@app.post("/cgiserver_import", dependencies=[Depends(verify_api_key)])
+@app.post("/cgiserver_import", dependencies=[Depends(verify_api_key)], response_class=TimedJSONResponse)
 async def cgiserver_import(request: Request):
-    if NCExecutionEngine is None or UniversalConfigDrivenControl is None:
-        logging.warning("ncplot7py package not importable in this environment; some actions will be limited")
+    # Every stage below ends with timer.lap(); the laps feed /metrics and Server-Timing
+    timer = StageTimer(PLOT_STAGE_SECONDS)
+    current_stage_timer.set(timer)
+    request_state = getattr(request, "state", None)
+    if request_state is not None:
+        request_state.server_timing = timer.stages
+
+    # The first request after start-up may still have to import the engine; keep that off the event loop
+    engine_available = load_engine() if _engine_loaded else await run_in_threadpool(load_engine)
+    if not engine_available:
+        # Already reported once when the import failed
+        logger.debug("ncplot7py package not importable in this environment; some actions will be limited")
 
-    # Log incoming request path and headers for debugging proxy issues
     try:
         raw_body = await request.body()
-        logging.info("Incoming request: %s %s", request.method, request.url.path)
-        # Log a trimmed version of headers and body to avoid huge logs
-        headers_preview = {k: v for k, v in list(request.headers.items())[:10]}
-        logging.info("Headers (preview): %s", headers_preview)
-        logging.info("Body (raw preview): %s", raw_body[:1000])
+        if detail_enabled(logger):
+            # Headers and body help with proxy issues; capped and only for sampled requests
+            logger.debug("Plot request payload", extra={"fields": {
+                "headers": Preview(redact_headers(request.headers)), "body": Preview(raw_body),
+            }})
         # Parse JSON from raw body
         try:
             req = json.loads(raw_body.decode("utf-8") if raw_body else "{}")
@@ -548,6 +859,7 @@ async def cgiserver_import(request: Request):
             raise HTTPException(status_code=400, detail="Invalid JSON request body")
     except Exception:
         raise HTTPException(status_code=400, detail="Unable to read request body")
+    timer.lap("parse")
 
     # Ensure parser registration
     try:
@@ -555,17 +867,20 @@ async def cgiserver_import(request: Request):
             cli_bootstrap()
     except Exception:
         logging.exception("Bootstrap failed")
+    timer.lap("bootstrap")
 
     # Handle actions
     if isinstance(req, dict) and "action" in req:
         action = req.get("action")
         if action in ["list_machines", "get_machines"]:
+            PLOT_REQUESTS.inc(outcome="action")
             return list_machines()
         else:
             raise HTTPException(status_code=400, detail=f"Unknown action: {action}")
 
     # Handle machinedata
     machinedata = None
+    budget = ExecutionBudget.from_request(req.get("budget") if isinstance(req, dict) else None)
     if isinstance(req, dict) and "machinedata" in req:
         machinedata = req.get("machinedata")
     elif isinstance(req, list):
@@ -591,12 +906,20 @@ async def cgiserver_import(request: Request):
         # Extract toolValues (Q quadrant 1-9 and R radius for tool compensation)
         tool_values = entry.get("toolValues", [])
         tool_values_list.append(tool_values)
-        logging.info(f"Tool values for canal {entry.get('canalNr', '1')}: {tool_values}")
         
         # Extract customVariables (user-defined variables)
         custom_vars = entry.get("customVariables", [])
         custom_variables_list.append(custom_vars)
-        logging.info(f"Custom variables for canal {entry.get('canalNr', '1')}: {custom_vars}")
+        if detail_enabled(logger):
+            logger.debug("Plot canal input", extra={"fields": {
+                "canal": canal_names[-1], "machine": machine_names[-1], "program_chars": len(prog),
+                "tool_values": Preview(tool_values), "custom_variables": Preview(custom_vars),
+            }})
+    timer.lap("sanitize")
+    set_span_attribute("plot.canals", len(programs))
+    logger.info("Plot request", extra={"fields": {
+        "canals": len(programs), "program_chars": sum(len(program) for program in programs), "machine": machine_names[0] if machine_names else "",
+    }})
 
     # Create initial CNC states with custom variables and tool data
     init_states = []
@@ -619,7 +942,7 @@ async def cgiserver_import(request: Request):
                     try:
                         state.set_parameter(var_name, float(var_value))
                     except (ValueError, TypeError):
-                        logging.warning(f"Invalid custom variable value: {var_name}={var_value}")
+                        logger.warning("Invalid custom variable value: %s=%s", var_name, Preview(var_value, 100))
             
             # Store tool Q/R values in state extra for later use by tool compensation handlers
             tool_vals = tool_values_list[idx] if idx < len(tool_values_list) else []
@@ -653,22 +976,48 @@ async def cgiserver_import(request: Request):
 
     if not is_siemens_mill and not is_fanuc_mill:
         apply_turn_axis_defaults(init_states, first_machine)
+    timer.lap("state_setup")
 
     # Create a control that can handle multiple canals and run the engine.
     engine_output = None
     errors: List[Dict[str, Any]] = []
+    budget_error: Optional[BudgetExceeded] = None
+    meter = BudgetMeter(budget)
+
+    def run_engine():
+        # The engine runs in its own watched thread, which a profiled request must trace too
+        with profiled_thread():
+            # Choose control type based on machine
+            control = UniversalConfigDrivenControl(
+                count_of_canals=len(programs),
+                canal_names=canal_names,
+                init_nc_states=init_states if any(s is not None for s in init_states) else None
+            )
+            # Warns once when this ncplot7py version lacks the internals the meter uses
+            meter.attach(control)
+            engine = NCExecutionEngine(control)
+            return engine, engine.get_Syncro_plot(programs, False)
+
     try:
-        # Choose control type based on machine
-        control = UniversalConfigDrivenControl(
-            count_of_canals=len(programs), 
-            canal_names=canal_names,
-            init_nc_states=init_states if any(s is not None for s in init_states) else None
-        )
-        engine = NCExecutionEngine(control)
-        engine_output = engine.get_Syncro_plot(programs, False)
-        
+        # A watchdog stops the engine when a program (e.g. a WHILE that never ends) runs past its budget
+        engine, engine_output = await run_in_threadpool(run_with_time_budget, run_engine, budget.max_seconds, meter)
+
         # Collect any errors from the engine
-        errors = getattr(engine, 'errors', [])
+        errors = list(getattr(engine, 'errors', []))
+        if errors:
+            PLOT_ENGINE_ERRORS.inc(len(errors), kind="reported")
+        # The meter ended the run early; the output holds the plot up to there
+        budget_error = meter.exceeded
+        if budget_error is not None:
+            PLOT_ENGINE_ERRORS.inc(kind="budget")
+    except BudgetExceeded as e:
+        budget_error = e
+        PLOT_ENGINE_ERRORS.inc(kind="budget")
+    except EngineBusy as e:
+        PLOT_REQUESTS.inc(outcome="engine_busy")
+        logger.error("Refusing plot request: %s", e)
+        raise HTTPException(status_code=503, detail="Plot engine is busy with stopped programs; try again later.",
+                            headers={"Retry-After": "30"})
     except ExceptionNode as e:
         # Handle structured NC errors
         error_info = {
@@ -679,15 +1028,29 @@ async def cgiserver_import(request: Request):
             "value": str(e.value) if e.value else "",
         }
         errors.append(error_info)
+        PLOT_ENGINE_ERRORS.inc(kind="nc_error")
         logging.warning("NC execution error: %s", error_info)
     except Exception as e:
+        PLOT_ENGINE_ERRORS.inc(kind="exception")
         logging.warning("Real engine failed: %s. Falling back to mock parser.", e)
         # Fallback will handle this
+    if engine_output is not None:
+        # Blocks and points beyond the budget are dropped before the costly conversion
+        engine_output, output_error = apply_output_budget(engine_output, budget)
+        budget_error = budget_error or output_error
+    if budget_error is not None:
+        errors.append(budget_error.to_error())
+        logger.warning("Plot stopped by its execution budget", extra={"fields": {
+            "limit": budget_error.limit, "allowed": budget_error.allowed, "used": budget_error.used,
+        }})
+    timer.lap("engine")
 
     # Check if engine output is valid/non-empty. If empty or failed, use mock.
     use_mock = False
+    fallback_reason = None
     if engine_output is None:
         use_mock = True
+        fallback_reason = "budget_exceeded" if budget_error is not None else "engine_failed"
     else:
         # Check if we got any plot points. If all canals are empty, assume failure/mismatch
         # and fallback to mock (legacy behavior) to ensure the user sees something.
@@ -699,14 +1062,24 @@ async def cgiserver_import(request: Request):
                 total_points += len(canal)
         
         if total_points == 0 and any(len(p.strip()) > 0 for p in programs):
-            logging.info("Real engine returned 0 points for non-empty program. Falling back to mock.")
+            logger.info("Real engine returned 0 points for non-empty program. Falling back to mock.")
             use_mock = True
+            fallback_reason = "empty_output"
 
     if use_mock:
         result = run_mock_parser(machinedata)
+        timer.lap("mock_fallback")
+        PLOT_MOCK_FALLBACKS.inc(reason=fallback_reason)
+        PLOT_REQUESTS.inc(outcome="mock")
+        points = count_plot_points(result["canal"])
+        PLOT_POINTS.inc(points, source="mock")
+        set_span_attribute("plot.points", points)
+        set_span_attribute("plot.outcome", "mock")
         # Include any errors that occurred before falling back to mock
         if errors:
             result["errors"] = errors
+        if budget_error is not None:
+            result["budgetExceeded"] = budget_error.limit
         return result
 
     # engine_output is a list per canal
@@ -719,7 +1092,7 @@ async def cgiserver_import(request: Request):
             # situations it may return a raw list (plot points) — normalize
             # that to the expected dict shape to avoid attribute errors.
             if isinstance(canal, list):
-                logging.info("Normalizing canal output: list -> dict (plot)")
+                logger.debug("Normalizing canal output: list -> dict (plot)")
                 canal = {"plot": canal, "programExec": []}
 
             converted = build_segments_from_engine_output(canal)
@@ -727,6 +1100,8 @@ async def cgiserver_import(request: Request):
             messages.append(f"Successfully processed canal {canal_nr}")
         except Exception as e:
             logging.exception("Failed converting canal output for canal %s", canal_nr)
+            timer.lap("convert")
+            PLOT_REQUESTS.inc(outcome="conversion_error")
             # Return a structured response instead of letting FastAPI raise 500
             return {
                 "canal": canal_results,
@@ -735,17 +1110,28 @@ async def cgiserver_import(request: Request):
                 "errors": errors,
             }
 
+    timer.lap("convert")
+    outcome = "budget_exceeded" if budget_error is not None else "partial" if errors else "success"
+    points = count_plot_points(canal_results)
+    PLOT_REQUESTS.inc(outcome=outcome)
+    PLOT_POINTS.inc(points, source="engine")
+    set_span_attribute("plot.points", points)
+    set_span_attribute("plot.outcome", outcome)
+
     response = {"canal": canal_results, "message": messages, "success": True}
     # Include errors array in the response even if execution succeeded partially
     if errors:
         response["errors"] = errors
         # Keep success=True for partial results, add hasErrors flag for clarity
         response["hasErrors"] = True
+    if budget_error is not None:
+        # The canals hold what was plotted before the budget ran out
+        response["budgetExceeded"] = budget_error.limit
     return response
 
 
 # Backwards-compatible legacy CGI path used by the frontend
-@app.api_route("/ncplot7py/scripts/cgiserver.cgi", methods=["POST", "OPTIONS", "GET"])
+@app.api_route("/ncplot7py/scripts/cgiserver.cgi", methods=["POST", "OPTIONS", "GET"], response_class=TimedJSONResponse)
 async def legacy_cgiserver(request: Request):
     """Legacy endpoint to keep compatibility with frontends that post to
     `/ncplot7py/scripts/cgiserver.cgi`. POST requests are forwarded to the
@@ -783,6 +1169,40 @@ async def legacy_cgiserver(request: Request):
         logging.exception("Unhandled error in legacy_cgiserver")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request latency and plot pipeline metrics."""
+    if not ENABLE_METRICS:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return Response(get_registry().render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def verify_profile_token(x_profile: Optional[str] = Header(None)):
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled.")
+    if x_profile is None or not hmac.compare_digest(x_profile.encode(), PROFILE_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid profiling token.")
+
+@app.get("/api/profiles", dependencies=[Depends(verify_profile_token)])
+async def list_profiles():
+    """Stored profile reports, newest first."""
+    return {"profiles": await run_in_threadpool(get_profile_store().list)}
+
+@app.get("/api/profiles/{profile_id}", dependencies=[Depends(verify_profile_token)])
+async def get_profile(profile_id: str):
+    """One profile report with the top functions overall, in ncplot7py and in this adapter."""
+    report = await run_in_threadpool(get_profile_store().load, profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return report
+
+@app.get("/api/profiles/{profile_id}/pstats", dependencies=[Depends(verify_profile_token)])
+async def get_profile_stats(profile_id: str):
+    """Raw cProfile data of a `cprofile` mode report, for pstats or snakeviz."""
+    path = get_profile_store().stats_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="No cProfile data for this profile.")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
 # --- Features Endpoint ---
 
 @app.get("/api/features")
@@ -790,9 +1210,22 @@ async def get_features():
     """Endpoint for frontend to query which backend modules are available."""
     return {
         "focas_enabled": ENABLE_FOCAS and FOCAS_IMPORT_OK,
+        # Reported, never loaded here: the library loads on the first real controller call
+        "focas_library": focas_library_status()["state"] if ENABLE_FOCAS and FOCAS_IMPORT_OK else "disabled",
+        "engine_loaded": _engine_loaded and NCExecutionEngine is not None,
         "cgi_path": ""  # Only relevant for main.py subprocess
     }
 
+@app.get("/api/startup")
+async def get_startup():
+    """Seconds per start-up phase, including the lazily loaded engine and warm-up once they ran."""
+    return {
+        "phases": {name: round(seconds, 6) for name, seconds in STARTUP_PHASES.items()},
+        "import_s": round(IMPORT_SECONDS, 6),
+        "engine_loaded": _engine_loaded and NCExecutionEngine is not None,
+        "focas_library": focas_library_status() if ENABLE_FOCAS and FOCAS_IMPORT_OK else {"state": "disabled"},
+    }
+
 # --- FOCAS API Routes ---
 
 class FocasConnection(BaseModel):
@@ -802,96 +1235,674 @@ class FocasConnection(BaseModel):
 
 class FocasDownloadData(BaseModel):
     program_text: str
+    # Skip the transfer when the CNC already holds the same normalized program
+    only_if_changed: bool = False
+
+class FocasBackupTarget(BaseModel):
+    ip_address: str
+    port: int = 8193
+    paths: List[int] = [0]
+
+# Upper bounds of client-chosen parallelism: worker threads of one backup or deploy, and FOCAS
+# handles per controller (most controls accept five in total)
+FOCAS_BACKUP_MAX_PARALLEL = 32
+FOCAS_BACKUP_MAX_SESSIONS = 4
+# Targets of one deploy request
+FOCAS_DEPLOY_MAX_TARGETS = 256
+
+class FocasBackupRequest(BaseModel):
+    controllers: List[FocasBackupTarget]
+    max_parallel_controllers: int = Field(4, ge=1, le=FOCAS_BACKUP_MAX_PARALLEL)
+    sessions_per_controller: int = Field(1, ge=1, le=FOCAS_BACKUP_MAX_SESSIONS)
+
+class FocasDeployTarget(BaseModel):
+    ip_address: str
+    port: int = 8193
+    path_no: int = 0
+
+class FocasDeployRequest(BaseModel):
+    programs: List[str]
+    targets: List[FocasDeployTarget] = Field(max_length=FOCAS_DEPLOY_MAX_TARGETS)
+    max_workers: int = Field(8, ge=1, le=FOCAS_BACKUP_MAX_PARALLEL)
+    only_if_changed: bool = False
+
+class FocasPingTarget(BaseModel):
+    ip_address: str
+    port: int = 8193
+
+    @field_validator("port")
+    @classmethod
+    def check_port(cls, port: int) -> int:
+        if not probe_port_allowed(port):
+            raise ValueError("port is not an allowed FOCAS port (see FOCAS_PROBE_PORTS)")
+        return port
+
+class FocasPingBatchRequest(BaseModel):
+    targets: List[FocasPingTarget] = Field(max_length=FOCAS_PROBE_MAX_TARGETS)
+    refresh: bool = False
+
+class FocasFleetRequest(BaseModel):
+    controllers: List[FocasPingTarget] = Field(max_length=FOCAS_PROBE_MAX_TARGETS)
+
+class FocasUploadJobRequest(BaseModel):
+    ip_address: str
+    port: int = 8193
+    path_no: int = 0
+    prog_num: int
+
+class FocasDownloadJobRequest(BaseModel):
+    ip_address: str
+    port: int = 8193
+    path_no: int = 0
+    program_text: str
+    only_if_changed: bool = False
+
+def sse_message(data: Any, event: Optional[str] = None) -> str:
+    """Format one server-sent event carrying a JSON payload."""
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+def get_demo_session(request: Request) -> Optional[str]:
+    """Demo session of the caller, from the X-Demo-Session header or the demo_session cookie."""
+    return request.headers.get("x-demo-session") or request.cookies.get("demo_session")
+
+def session_ip(ip_address: str, demo_session: Optional[str]) -> str:
+    """Send plain "DEMO" to the caller's own demo controller when a demo session is given."""
+    if ip_address.strip().upper() == "DEMO":
+        return demo_address(demo_session)
+    return ip_address
 
 @app.get("/api/focas/ping")
-async def focas_ping(ip_address: str):
-    if not ENABLE_FOCAS:
+async def focas_ping(ip_address: str, port: int = 8193, refresh: bool = False):
+    """Check that the controller's FOCAS port accepts TCP connections (results cached briefly)."""
+    if not is_demo_ip(ip_address) and (not ENABLE_FOCAS or not FOCAS_IMPORT_OK):
         raise HTTPException(status_code=501, detail="FOCAS support is disabled on this server.")
-    
-    import platform
-    import asyncio
-    
-    is_windows = platform.system().lower() == "windows"
-    param_count = "-n" if is_windows else "-c"
-    param_wait = "-w" if is_windows else "-W"
-    wait_val = "1000" if is_windows else "1"
-    
-    try:
-        process = await asyncio.create_subprocess_exec(
-            "ping", param_count, "1", param_wait, wait_val, ip_address,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        await process.communicate()
-        return {"status": "success", "available": process.returncode == 0}
-    except Exception as e:
-        return {"status": "success", "available": False, "error": str(e)}
+    if not probe_port_allowed(port):
+        raise HTTPException(status_code=400, detail="Port is not an allowed FOCAS port.")
+
+    result = await get_probe_cache().probe(ip_address, port, refresh)
+    return {"status": "success", **result}
+
+@app.post("/api/focas/ping/batch")
+async def focas_ping_batch(data: FocasPingBatchRequest):
+    """Probe many controllers concurrently and return availability and latency per host."""
+    if not all(is_demo_ip(target.ip_address) for target in data.targets) and (not ENABLE_FOCAS or not FOCAS_IMPORT_OK):
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled on this server.")
+
+    results = await get_probe_cache().probe_many(((target.ip_address, target.port) for target in data.targets), data.refresh)
+    return {"status": "success", "results": results}
 
 @app.post("/api/focas/connect")
-async def focas_connect(conn: FocasConnection, client: FocasClientBase = Depends(get_focas_client)):
-    if is_demo_ip(conn.ip_address):
-        client = get_demo_focas_client()
+async def focas_connect(conn: FocasConnection, demo_session: Optional[str] = Depends(get_demo_session)):
+    ip_address = conn.ip_address
+    if is_demo_ip(ip_address):
+        ip_address = session_ip(ip_address, demo_session)
     elif not ENABLE_FOCAS or not FOCAS_IMPORT_OK:
         raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    client = create_focas_client(ip_address)
     try:
-        success = client.connect(conn.ip_address, conn.port, conn.timeout)
+        success = await run_in_threadpool(client.connect, ip_address, conn.port, conn.timeout)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to connect to CNC")
         
-        client.disconnect()
+        await run_in_threadpool(client.disconnect)
         return {"status": "success", "message": f"Connected to {conn.ip_address}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/focas/programs")
+async def focas_list_all_programs(ip_address: str, port: int = 8193, paths: Optional[List[int]] = Query(None), refresh: bool = False, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Program listings of every path (or the `paths` given) keyed by path number.
+
+    Paths missing from the directory cache are read over a single FOCAS session.
+    """
+    if is_demo_ip(ip_address):
+        ip_address = session_ip(ip_address, demo_session)
+    elif not ENABLE_FOCAS or not FOCAS_IMPORT_OK:
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    client = create_focas_client(ip_address)
+
+    directory_cache = get_directory_cache()
+    programs_by_path: Dict[int, list] = {}
+    if paths and not refresh:
+        for path_no in paths:
+            programs = directory_cache.get(ip_address, port, path_no)
+            if programs is not None:
+                programs_by_path[path_no] = programs
+    cached_paths = sorted(programs_by_path)
+    if paths and len(programs_by_path) == len(set(paths)):
+        return {"status": "success", "programs": programs_by_path, "cached_paths": cached_paths}
+
+    def list_paths():
+        nonlocal cached_paths
+        try:
+            if not client.connect(ip_address, port):
+                raise HTTPException(status_code=500, detail="Failed to connect to CNC")
+
+            wanted = paths if paths else range(1, client.get_path_count() + 1)
+            if not refresh:
+                for path_no in wanted:
+                    if path_no not in programs_by_path:
+                        programs = directory_cache.get(ip_address, port, path_no)
+                        if programs is not None:
+                            programs_by_path[path_no] = programs
+                cached_paths = sorted(programs_by_path)
+            missing = [path_no for path_no in wanted if path_no not in programs_by_path]
+            for path_no, programs in client.list_programs_by_path(missing).items():
+                directory_cache.put(ip_address, port, path_no, programs)
+                programs_by_path[path_no] = programs
+            return {"status": "success", "programs": dict(sorted(programs_by_path.items())), "cached_paths": cached_paths}
+        except FocasError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            client.disconnect()
+
+    return await run_in_threadpool(list_paths)
+
 @app.get("/api/focas/programs/{path_no}")
-async def focas_list_programs(path_no: int, ip_address: str, port: int = 8193, client: FocasClientBase = Depends(get_focas_client)):
+async def focas_list_programs(path_no: int, ip_address: str, port: int = 8193, refresh: bool = False, demo_session: Optional[str] = Depends(get_demo_session)):
     if is_demo_ip(ip_address):
-        client = get_demo_focas_client()
+        ip_address = session_ip(ip_address, demo_session)
     elif not ENABLE_FOCAS or not FOCAS_IMPORT_OK:
         raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
-    try:
-        if not client.connect(ip_address, port):
-            raise HTTPException(status_code=500, detail="Failed to connect to CNC")
+    client = create_focas_client(ip_address)
+
+    directory_cache = get_directory_cache()
+    if not refresh:
+        programs = directory_cache.get(ip_address, port, path_no)
+        if programs is not None:
+            return {"status": "success", "programs": programs, "cached": True}
+
+    def list_path():
+        try:
+            if not client.connect(ip_address, port):
+                raise HTTPException(status_code=500, detail="Failed to connect to CNC")
             
-        programs = client.list_programs(path_no)
-        return {"status": "success", "programs": programs}
-    except FocasError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        client.disconnect()
+            programs = client.list_programs(path_no)
+            directory_cache.put(ip_address, port, path_no, programs)
+            return {"status": "success", "programs": programs, "cached": False}
+        except FocasError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            client.disconnect()
+
+    return await run_in_threadpool(list_path)
+
+@app.get("/api/focas/upload/{path_no}")
+async def focas_upload_many(path_no: int, ip_address: str, port: int = 8193, start: Optional[int] = None, end: Optional[int] = None,
+                            programs: Optional[List[int]] = Query(None), archive: bool = False, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Upload a range (`start`/`end`) or a list (`programs`) of programs in one session.
+
+    Ranges are read with a single cnc_upstart3 and split per program on the server.
+    Returns a map of program number to text, or a zip archive with `archive=true`.
+    """
+    if is_demo_ip(ip_address):
+        ip_address = session_ip(ip_address, demo_session)
+    elif not ENABLE_FOCAS or not FOCAS_IMPORT_OK:
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    client = create_focas_client(ip_address)
+    if programs is None and (start is None or end is None):
+        raise HTTPException(status_code=400, detail="Pass either start and end or a list of programs")
+    if programs is None and start > end:
+        raise HTTPException(status_code=400, detail="start must not be greater than end")
+
+    def upload() -> Dict[int, str]:
+        try:
+            if not client.connect(ip_address, port):
+                raise HTTPException(status_code=500, detail="Failed to connect to CNC before upload")
+            if programs is not None:
+                return client.upload_programs(programs, path_no)
+            return client.upload_program_range(start, end, path_no)
+        except FocasError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            client.disconnect()
+
+    uploaded = dict(sorted((await run_in_threadpool(upload)).items()))
+    missing = sorted(set(programs) - set(uploaded)) if programs is not None else []
+    if archive:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            for number, program_text in uploaded.items():
+                zip_file.writestr(f"O{number:04d}.nc", program_text)
+        filename = f"path{path_no}_programs.zip"
+        return Response(buffer.getvalue(), media_type="application/zip", headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+    return {"status": "success", "programs": uploaded, "missing": missing}
 
 @app.get("/api/focas/upload/{path_no}/{prog_num}")
-async def focas_upload(path_no: int, prog_num: int, ip_address: str, port: int = 8193, client: FocasClientBase = Depends(get_focas_client)):
+async def focas_upload(path_no: int, prog_num: int, ip_address: str, port: int = 8193, refresh: bool = False, demo_session: Optional[str] = Depends(get_demo_session)):
     if is_demo_ip(ip_address):
-        client = get_demo_focas_client()
+        ip_address = session_ip(ip_address, demo_session)
     elif not ENABLE_FOCAS or not FOCAS_IMPORT_OK:
         raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
-    try:
-        if not client.connect(ip_address, port):
-            raise HTTPException(status_code=500, detail="Failed to connect to CNC before upload")
+    client = create_focas_client(ip_address)
+    def upload():
+        try:
+            if not client.connect(ip_address, port):
+                raise HTTPException(status_code=500, detail="Failed to connect to CNC before upload")
+
+            # An unchanged modification date and length means the cached text is current.
+            program_cache = get_program_cache()
+            entry = client.find_program(prog_num, path_no)
+            if entry is not None and not refresh:
+                program_text = program_cache.get(ip_address, port, path_no, entry)
+                if program_text is not None:
+                    return {"status": "success", "program_text": program_text, "cached": True}
             
-        program_text = client.upload_program(prog_num, path_no)
-        return {"status": "success", "program_text": program_text}
+            program_text = client.upload_program(prog_num, path_no)
+            if entry is not None:
+                program_cache.put(ip_address, port, path_no, entry, program_text)
+            return {"status": "success", "program_text": program_text, "cached": False}
+        except FocasError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            client.disconnect()
+
+    return await run_in_threadpool(upload)
+
+@app.get("/api/focas/upload/{path_no}/{prog_num}/stream")
+async def focas_upload_stream(request: Request, path_no: int, prog_num: int, ip_address: str, port: int = 8193, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Stream a program from the CNC as chunked text/plain while cnc_upload3 delivers it.
+
+    `X-Program-Length` carries the directory length (when known) so the browser can
+    show progress. If the client disconnects, the upload session is closed right away;
+    a background task closes it in any case once the response is done, also when the
+    body was never started.
+    """
+    if is_demo_ip(ip_address):
+        ip_address = session_ip(ip_address, demo_session)
+    elif not ENABLE_FOCAS or not FOCAS_IMPORT_OK:
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    # The session stays open while the body streams, so it must belong to this request alone
+    client = create_focas_client(ip_address)
+    if not await run_in_threadpool(client.connect, ip_address, port):
+        await run_in_threadpool(client.disconnect)
+        raise HTTPException(status_code=500, detail="Failed to connect to CNC before upload")
+
+    chunks = client.iter_upload_program(prog_num, path_no)
+    close_lock = threading.Lock()
+    closed = False
+
+    def close_upload():
+        # cnc_upend3 and cnc_freelibhndl talk to the controller, so this runs in a worker thread
+        nonlocal closed
+        with close_lock:
+            if closed:
+                return
+            closed = True
+            try:
+                chunks.close()
+            finally:
+                client.disconnect()
+
+    try:
+        # Look up the length before the upload session starts, then pull the first chunk
+        # so errors from cnc_upstart3 still map to an HTTP status.
+        entry = await run_in_threadpool(client.find_program, prog_num, path_no)
+        first_chunk = await run_in_threadpool(next, chunks, None)
     except FocasError as e:
+        await run_in_threadpool(close_upload)
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        client.disconnect()
+    except BaseException:
+        await run_in_threadpool(close_upload)
+        raise
+
+    headers = {"Cache-Control": "no-store"}
+    if entry and entry.get("length"):
+        headers["X-Program-Length"] = str(entry["length"])
+
+    async def stream_program():
+        sent = 0
+        chunk = first_chunk
+        try:
+            while chunk is not None:
+                sent += len(chunk)
+                yield chunk
+                logging.debug("FOCAS upload O%s: %d bytes sent", prog_num, sent)
+                if await request.is_disconnected():
+                    logging.info("FOCAS upload O%s cancelled by client after %d bytes", prog_num, sent)
+                    return
+                chunk = await run_in_threadpool(next, chunks, None)
+            logging.info("FOCAS upload O%s streamed %d bytes", prog_num, sent)
+        except FocasError as e:
+            # Headers are already sent; the truncated body is the only signal left.
+            logging.error("FOCAS upload O%s aborted after %d bytes: %s", prog_num, sent, e)
+        finally:
+            await run_in_threadpool(close_upload)
+
+    return StreamingResponse(stream_program(), media_type="text/plain", headers=headers,
+                             background=BackgroundTask(run_in_threadpool, close_upload))
 
 @app.post("/api/focas/download/{path_no}")
-async def focas_download(path_no: int, ip_address: str, data: FocasDownloadData, port: int = 8193, client: FocasClientBase = Depends(get_focas_client)):
+async def focas_download(path_no: int, ip_address: str, data: FocasDownloadData, port: int = 8193, demo_session: Optional[str] = Depends(get_demo_session)):
     if is_demo_ip(ip_address):
-        client = get_demo_focas_client()
+        ip_address = session_ip(ip_address, demo_session)
     elif not ENABLE_FOCAS or not FOCAS_IMPORT_OK:
         raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
-    try:
-        if not client.connect(ip_address, port):
-            raise HTTPException(status_code=500, detail="Failed to connect to CNC before download")
+    client = create_focas_client(ip_address)
+    def download():
+        try:
+            if not client.connect(ip_address, port):
+                raise HTTPException(status_code=500, detail="Failed to connect to CNC before download")
             
-        client.download_program(data.program_text, path_no)
-        return {"status": "success", "message": "Program successfully downloaded to CNC"}
+            if data.only_if_changed:
+                written = client.download_program_if_changed(data.program_text, path_no)
+            else:
+                client.download_program(data.program_text, path_no)
+                written = True
+            if not written:
+                return {"status": "success", "message": "Program on CNC is already identical; download skipped", "written": False}
+            return {"status": "success", "message": "Program successfully downloaded to CNC", "written": True}
+        except FocasError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            client.disconnect()
+
+    return await run_in_threadpool(download)
+
+@app.post("/api/focas/download/{path_no}/stream")
+async def focas_download_stream(request: Request, path_no: int, ip_address: str, port: int = 8193, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Download the raw request body to the CNC while it is still arriving.
+
+    The body is plain program text (no JSON). At most FOCAS_STREAM_QUEUE_CHUNKS
+    body chunks are buffered; when the CNC is slower, reading the body pauses.
+    """
+    if is_demo_ip(ip_address):
+        ip_address = session_ip(ip_address, demo_session)
+    elif not ENABLE_FOCAS or not FOCAS_IMPORT_OK:
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    # The transfer thread keeps the session while the body arrives, so it must belong to this request alone
+    client = create_focas_client(ip_address)
+    if not await run_in_threadpool(client.connect, ip_address, port):
+        await run_in_threadpool(client.disconnect)
+        raise HTTPException(status_code=500, detail="Failed to connect to CNC before download")
+
+    pending: "queue.Queue[Any]" = queue.Queue(maxsize=FOCAS_STREAM_QUEUE_CHUNKS)
+    end_of_body = object()
+    aborted = threading.Event()
+
+    def receive_chunks():
+        while True:
+            if aborted.is_set():
+                raise ConnectionAbortedError("Client disconnected during download")
+            try:
+                chunk = pending.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if chunk is end_of_body:
+                return
+            yield chunk
+
+    def run_transfer():
+        try:
+            client.download_program_stream(receive_chunks(), path_no)
+        finally:
+            client.disconnect()
+
+    transfer = asyncio.ensure_future(run_in_threadpool(run_transfer))
+    transfer.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def hand_over(item) -> bool:
+        while not transfer.done():
+            try:
+                pending.put_nowait(item)
+                return True
+            except queue.Full:
+                await asyncio.wait({transfer}, timeout=0.01)
+        return False
+
+    received = 0
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            received += len(chunk)
+            if not await hand_over(chunk):
+                break
+        await hand_over(end_of_body)
+        await transfer
+        return {"status": "success", "message": "Program successfully downloaded to CNC", "bytes_received": received}
     except FocasError as e:
         raise HTTPException(status_code=400, detail=str(e))
     finally:
-        client.disconnect()
+        if not transfer.done():
+            # The request body broke off; the worker ends the session with cnc_dwnend3.
+            aborted.set()
+
+@app.post("/api/focas/backup")
+async def focas_backup(data: FocasBackupRequest, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Start a background job that uploads every program of the listed controllers and paths."""
+    if not data.controllers:
+        raise HTTPException(status_code=400, detail="No controllers given")
+    if not all(is_demo_ip(target.ip_address) for target in data.controllers) and (not ENABLE_FOCAS or not FOCAS_IMPORT_OK):
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+
+    controllers = [{**target.model_dump(), "ip_address": session_ip(target.ip_address, demo_session)} for target in data.controllers]
+    job = get_job_registry().submit(
+        "backup", {"controllers": controllers}, run_backup,
+        controllers, data.max_parallel_controllers, data.sessions_per_controller,
+    )
+    return {"status": "success", "job": job.to_dict()}
+
+@app.get("/api/focas/backup/{job_id}")
+async def focas_backup_status(job_id: str):
+    job = get_job_registry().get(job_id) if FOCAS_IMPORT_OK else None
+    if job is None or job.kind != "backup":
+        raise HTTPException(status_code=404, detail="Backup job not found")
+    return {"status": "success", "job": job.to_dict()}
+
+@app.get("/api/focas/backup/{job_id}/archive")
+async def focas_backup_archive(job_id: str):
+    job = get_job_registry().get(job_id) if FOCAS_IMPORT_OK else None
+    if job is None or job.kind != "backup":
+        raise HTTPException(status_code=404, detail="Backup job not found")
+    if job.state != "completed":
+        raise HTTPException(status_code=409, detail=f"Backup job is {job.state}")
+    archive_path = backup_archive_path(job_id)
+    if not os.path.exists(archive_path):
+        raise HTTPException(status_code=404, detail="Backup archive no longer exists")
+    return FileResponse(archive_path, media_type="application/zip", filename=os.path.basename(archive_path))
+
+@app.post("/api/focas/deploy")
+async def focas_deploy(data: FocasDeployRequest, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Download one program set to many controllers at once and report per-target timing."""
+    if not data.programs or not data.targets:
+        raise HTTPException(status_code=400, detail="Programs and targets are required")
+    if not all(is_demo_ip(target.ip_address) for target in data.targets) and (not ENABLE_FOCAS or not FOCAS_IMPORT_OK):
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+
+    summary = await run_in_threadpool(
+        run_deploy, data.programs, [{**target.model_dump(), "ip_address": session_ip(target.ip_address, demo_session)} for target in data.targets],
+        data.max_workers, data.only_if_changed,
+    )
+    return {"status": "success", **summary}
+
+@app.post("/api/focas/jobs/upload")
+async def focas_upload_job(data: FocasUploadJobRequest, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Start a background upload and return its job id right away."""
+    if not is_demo_ip(data.ip_address) and (not ENABLE_FOCAS or not FOCAS_IMPORT_OK):
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    ip_address = session_ip(data.ip_address, demo_session)
+    job = get_job_registry().submit(
+        "upload", {"ip_address": ip_address, "port": data.port, "path_no": data.path_no, "prog_num": data.prog_num},
+        run_upload, ip_address, data.port, data.path_no, data.prog_num,
+    )
+    return {"status": "success", "job": job.to_dict()}
+
+@app.post("/api/focas/jobs/download")
+async def focas_download_job(data: FocasDownloadJobRequest, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Start a background download and return its job id right away."""
+    if not is_demo_ip(data.ip_address) and (not ENABLE_FOCAS or not FOCAS_IMPORT_OK):
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    ip_address = session_ip(data.ip_address, demo_session)
+    job = get_job_registry().submit(
+        "download", {"ip_address": ip_address, "port": data.port, "path_no": data.path_no},
+        run_download, ip_address, data.port, data.path_no, data.program_text, data.only_if_changed,
+    )
+    return {"status": "success", "job": job.to_dict()}
+
+def get_job_or_404(job_id: str):
+    job = get_job_registry().get(job_id) if FOCAS_IMPORT_OK else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/focas/jobs/{job_id}")
+async def focas_job_status(job_id: str):
+    return {"status": "success", "job": get_job_or_404(job_id).to_dict()}
+
+@app.get("/api/focas/jobs/{job_id}/events")
+async def focas_job_events(request: Request, job_id: str):
+    """Server-sent events with the job state whenever it changes; the last one is named `done`."""
+    job = get_job_or_404(job_id)
+
+    async def job_events():
+        last_snapshot = None
+        while True:
+            finished = job.finished
+            snapshot = job.to_dict()
+            if snapshot != last_snapshot or finished:
+                yield sse_message(snapshot, "done" if finished else "progress")
+                last_snapshot = snapshot
+            if finished or await request.is_disconnected():
+                return
+            await asyncio.sleep(FOCAS_JOB_EVENT_INTERVAL)
+
+    return StreamingResponse(job_events(), media_type="text/event-stream", headers={"Cache-Control": "no-store"})
+
+@app.delete("/api/focas/jobs/{job_id}")
+async def focas_job_cancel(job_id: str):
+    """Cancel a queued or running job. The transfer ends with cnc_dwnend3 / cnc_upend3."""
+    job = get_job_or_404(job_id)
+    if not job.finished:
+        job.cancel()
+    return {"status": "success", "job": job.to_dict()}
+
+@app.get("/api/focas/diagnostics")
+async def focas_diagnostics(ip_address: Optional[str] = None, port: int = 8193):
+    """Per-controller FOCAS call latency percentiles, return codes, EW_BUFFER retries and transfer rates."""
+    if not FOCAS_IMPORT_OK:
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    stats = get_call_stats()
+    controller = stats.controller_label(ip_address, port) if ip_address else None
+    return {"status": "success", "controllers": stats.snapshot(controller)}
+
+@app.get("/api/focas/fleet")
+async def focas_fleet_status():
+    """Availability, probe latency, last FOCAS connect time and open handles per watched controller."""
+    if not FOCAS_IMPORT_OK:
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    return {"status": "success", "controllers": await get_fleet_monitor().current()}
 
+@app.post("/api/focas/fleet")
+async def focas_fleet_watch(data: FocasFleetRequest):
+    """Add controllers to the fleet that the background poller watches."""
+    if not all(is_demo_ip(target.ip_address) for target in data.controllers) and (not ENABLE_FOCAS or not FOCAS_IMPORT_OK):
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    monitor = get_fleet_monitor()
+    try:
+        for target in data.controllers:
+            monitor.watch(target.ip_address, target.port)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "success", "controllers": await monitor.current()}
+
+@app.delete("/api/focas/fleet")
+async def focas_fleet_unwatch(ip_address: str, port: int = 8193):
+    if not FOCAS_IMPORT_OK:
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    get_fleet_monitor().unwatch(ip_address, port)
+    return {"status": "success", "controllers": get_fleet_monitor().snapshot()}
 
+@app.get("/api/focas/fleet/events")
+async def focas_fleet_events(request: Request):
+    """Server-sent `fleet` events with the whole fleet snapshot after every poll.
+
+    All subscribers share one poller, so controllers see the same probe traffic
+    no matter how many clients listen.
+    """
+    if not FOCAS_IMPORT_OK:
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    monitor = get_fleet_monitor()
+    updates = monitor.subscribe()
+
+    async def fleet_events():
+        try:
+            yield sse_message(monitor.snapshot(), "fleet")
+            while not await request.is_disconnected():
+                try:
+                    snapshot = await asyncio.wait_for(updates.get(), timeout=FOCAS_FLEET_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_message(snapshot, "fleet")
+        finally:
+            monitor.unsubscribe(updates)
+
+    return StreamingResponse(fleet_events(), media_type="text/event-stream", headers={"Cache-Control": "no-store"})
+
+@app.get("/api/focas/telemetry")
+async def focas_telemetry(ip_address: str, port: int = 8193, path_no: int = 0, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Status, positions, alarms and executing program of one path.
+
+    Served from the shared poller when somebody already streams this controller,
+    otherwise read once over a short session.
+    """
+    if is_demo_ip(ip_address):
+        ip_address = session_ip(ip_address, demo_session)
+    elif not ENABLE_FOCAS or not FOCAS_IMPORT_OK:
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    client = create_focas_client(ip_address)
+
+    snapshot = get_telemetry_hub().latest(ip_address, port, path_no)
+    if snapshot is not None:
+        return {"status": "success", "telemetry": snapshot, "cached": True}
+
+    def read_telemetry():
+        try:
+            if not client.connect(ip_address, port):
+                raise HTTPException(status_code=500, detail="Failed to connect to CNC")
+            telemetry = client.read_telemetry(path_no)
+            return {"status": "success", "telemetry": {"ip_address": ip_address, "port": port, "connected": True, **telemetry}, "cached": False}
+        except FocasError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            client.disconnect()
+
+    return await run_in_threadpool(read_telemetry)
+
+@app.get("/api/focas/telemetry/events")
+async def focas_telemetry_events(request: Request, ip_address: str, port: int = 8193, path_no: int = 0, demo_session: Optional[str] = Depends(get_demo_session)):
+    """Server-sent `telemetry` events from the controller's shared poller.
+
+    Every viewer of a controller shares one FOCAS session, so opening more
+    editor windows does not use up the controller's connection limit.
+    """
+    if not is_demo_ip(ip_address) and (not ENABLE_FOCAS or not FOCAS_IMPORT_OK):
+        raise HTTPException(status_code=501, detail="FOCAS support is disabled.")
+    ip_address = session_ip(ip_address, demo_session)
+    hub = get_telemetry_hub()
+    updates = hub.subscribe(ip_address, port, path_no)
+
+    async def telemetry_events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    snapshot = await asyncio.wait_for(updates.get(), timeout=FOCAS_FLEET_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_message(snapshot, "telemetry")
+        finally:
+            hub.unsubscribe(ip_address, port, updates)
+
+    return StreamingResponse(telemetry_events(), media_type="text/event-stream", headers={"Cache-Control": "no-store"})
+
+
+_startup_phase("app_setup")
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+logger.info("Application imported", extra={"fields": {
+    "import_ms": round(IMPORT_SECONDS * 1000, 1),
+    "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in STARTUP_PHASES.items()},
+}})
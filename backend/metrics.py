@@ -0,0 +1,227 @@
+import bisect
+import contextvars
+import math
+import time
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi.responses import JSONResponse
+
+try:
+    from backend.tracing import record_span
+except ImportError:
+    from tracing import record_span
+
+# Upper bounds in seconds; plot stages span sub-millisecond parsing to multi-second engine runs
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list, 0.0 when it is empty."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _matches(labelnames: Sequence[str], key: Tuple[str, ...], labels: Dict[str, Any]) -> bool:
+    return all(key[labelnames.index(name)] == str(value) for name, value in labels.items())
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def remove(self, **labels: Any):
+        """Drop every series whose labels include the given ones."""
+        with self._lock:
+            for key in [key for key in self._values if _matches(self.labelnames, key, labels)]:
+                del self._values[key]
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense, with optional labels."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = Lock()
+        # label values -> (per-bucket counts incl. +Inf, sum, count)
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return series[2] if series else 0
+
+    def remove(self, **labels: Any):
+        """Drop every series whose labels include the given ones."""
+        with self._lock:
+            for key in [key for key in self._series if _matches(self.labelnames, key, labels)]:
+                del self._series[key]
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series_items = sorted((key, ([*series[0]], series[1], series[2])) for key, series in self._series.items())
+        for key, (bucket_counts, total, count) in series_items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_number(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._metrics.get(name) or self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.get(name) or self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    return _registry
+
+
+HTTP_REQUEST_SECONDS = _registry.histogram(
+    "http_request_duration_seconds", "Time from request to response headers, per route template.", ["method", "route", "status"])
+PLOT_STAGE_SECONDS = _registry.histogram(
+    "ncplot_stage_duration_seconds", "Time spent in each stage of the plot pipeline (cgiserver_import).", ["stage"])
+PLOT_REQUESTS = _registry.counter(
+    "ncplot_requests_total", "Plot requests that reached the pipeline, by outcome.", ["outcome"])
+PLOT_POINTS = _registry.counter(
+    "ncplot_points_total", "Plot points returned to clients, by producer (engine or mock).", ["source"])
+PLOT_MOCK_FALLBACKS = _registry.counter(
+    "ncplot_mock_fallbacks_total", "Plots answered by the mock parser instead of ncplot7py, by reason.", ["reason"])
+PLOT_ENGINE_ERRORS = _registry.counter(
+    "ncplot_engine_errors_total", "Errors raised or reported by the ncplot7py engine, by kind.", ["kind"])
+FOCAS_CALL_SECONDS = _registry.histogram(
+    "focas_call_duration_seconds", "Duration of FOCAS library calls, per controller and call.", ["controller", "call"])
+FOCAS_CALL_RETURN_CODES = _registry.counter(
+    "focas_call_return_codes_total", "FOCAS library calls that returned something other than EW_OK, by code.", ["controller", "call", "code"])
+FOCAS_BUFFER_RETRIES = _registry.counter(
+    "focas_buffer_retries_total", "cnc_download3/cnc_upload3 calls answered with EW_BUFFER and retried.", ["controller", "call"])
+FOCAS_TRANSFER_BYTES = _registry.counter(
+    "focas_transfer_bytes_total", "Program bytes moved to (download) or from (upload) a controller.", ["controller", "direction"])
+FOCAS_TRANSFER_SECONDS = _registry.counter(
+    "focas_transfer_seconds_total", "Wall time of program transfers including retries; bytes / seconds is the effective rate.", ["controller", "direction"])
+
+
+class StageTimer:
+    """Lap timer for the stages of one request.
+
+    Each lap is observed in `histogram` and kept in `stages`, which the HTTP
+    middleware turns into the Server-Timing header. When the request is traced,
+    each lap is also recorded as a child span named `plot.<stage>`.
+    """
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.stages: List[Tuple[str, float]] = []
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str) -> float:
+        now = time.perf_counter()
+        duration = now - self._last
+        self._last = now
+        self.stages.append((stage, duration))
+        self.histogram.observe(duration, stage=stage)
+        record_span(f"plot.{stage}", duration, stage=stage)
+        return duration
+
+
+# Stage timer of the running request; FastAPI builds the response in the same task as the endpoint
+current_stage_timer: "contextvars.ContextVar[Optional[StageTimer]]" = contextvars.ContextVar("current_stage_timer", default=None)
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that records encoding and rendering as the `serialize` stage of the request."""
+    def render(self, content: Any) -> bytes:
+        body = super().render(content)
+        timer = current_stage_timer.get()
+        if timer is not None:
+            timer.lap("serialize")
+        return body
+
+
+def server_timing_header(stages: Iterable[Tuple[str, float]], total: Optional[float] = None) -> str:
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
@@ -0,0 +1,301 @@
+import cProfile
+import contextvars
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Requests profiled at the same time; further flagged requests run unprofiled
+PROFILE_MAX_CONCURRENT = int(os.environ.get("PROFILE_MAX_CONCURRENT", "1"))
+# Reports kept on disk before the oldest are deleted
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "nc-edit7-profiles"))
+# Seconds between two stack samples of the sampling profiler
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.002"))
+PROFILE_TOP = 30
+
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+FunctionKey = Tuple[str, int, str]
+
+
+def _describe(key: FunctionKey) -> str:
+    filename, lineno, name = key
+    parts = filename.replace("\\", "/").split("/")
+    if "ncplot7py" in parts:
+        filename = "/".join(parts[parts.index("ncplot7py"):])
+    else:
+        filename = "/".join(parts[-2:])
+    return f"{filename}:{lineno}({name})"
+
+
+def _area(filename: str) -> Optional[str]:
+    """Which part of our code a file belongs to: the ncplot7py engine or this adapter."""
+    normalized = filename.replace("\\", "/")
+    if "/ncplot7py/" in normalized:
+        return "ncplot7py"
+    if os.path.abspath(filename).startswith(_BACKEND_DIR):
+        return "adapter"
+    return None
+
+
+class SamplingProfiler:
+    """Samples the stacks of the profiled request's threads every `interval` seconds while running.
+
+    Those are the thread that started it (the event loop) and threads inside
+    thread() while they work for the request, so other requests' pool work is
+    left out. Coroutines of other requests that run on the event loop at the
+    same time are sampled too; the loop thread cannot be split by request. Its
+    cost does not depend on how many calls the profiled code makes. Only
+    stacks that pass through the engine or this adapter are counted, which
+    leaves out the event loop waiting for I/O.
+    """
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.self_counts: Counter = Counter()
+        self.total_counts: Counter = Counter()
+        self._threads: set = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._threads.add(threading.get_ident())
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    @contextmanager
+    def thread(self) -> Iterator[None]:
+        """Sample the calling thread until the block ends."""
+        thread_id = threading.get_ident()
+        added = thread_id not in self._threads
+        self._threads.add(thread_id)
+        try:
+            yield
+        finally:
+            if added:
+                self._threads.discard(thread_id)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            threads = set(self._threads)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in threads:
+                    self._sample(frame)
+
+    def _sample(self, frame):
+        stack: List[FunctionKey] = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        if not any(_area(key[0]) for key in stack):
+            return
+        self.samples += 1
+        self.self_counts[stack[0]] += 1
+        for key in set(stack):
+            self.total_counts[key] += 1
+
+    def report(self) -> Dict[str, Any]:
+        samples = max(self.samples, 1)
+
+        def rows(counts: Counter, area: Optional[str] = None) -> List[Dict[str, Any]]:
+            selected = [(key, count) for key, count in counts.most_common() if area is None or _area(key[0]) == area]
+            return [
+                {"function": _describe(key), "samples": count, "percent": round(100 * count / samples, 1)}
+                for key, count in selected[:PROFILE_TOP]
+            ]
+
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "top_self": rows(self.self_counts),
+            "top_cumulative": rows(self.total_counts),
+            "ncplot7py": rows(self.total_counts, "ncplot7py"),
+            "adapter": rows(self.total_counts, "adapter"),
+        }
+
+
+class DeterministicProfiler:
+    """cProfile for each thread() block, with the event loop part sampled.
+
+    cProfile on the event loop thread would trace every coroutine that runs
+    while the request waits, so only the work the request hands to other
+    threads (the plot engine, FOCAS transfers) is traced and merged into the
+    report. The event loop thread is covered by a SamplingProfiler, reported
+    under "event_loop", which has the same limits as the sampling mode.
+    Blocks still running at report time are left out.
+    """
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.loop_sampler = SamplingProfiler(interval)
+        self._thread_profiles: List[cProfile.Profile] = []
+        self._threads: set = set()
+        self._lock = Lock()
+
+    def start(self):
+        self.loop_sampler.start()
+
+    def stop(self):
+        self.loop_sampler.stop()
+
+    @contextmanager
+    def thread(self) -> Iterator[None]:
+        """Profile the calling thread until the block ends."""
+        thread_id = threading.get_ident()
+        if thread_id in self._threads:
+            # Already traced by an outer block; a second profiler would take over its hook
+            yield
+            return
+        self._threads.add(thread_id)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._threads.discard(thread_id)
+            with self._lock:
+                self._thread_profiles.append(profile)
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats()
+        with self._lock:
+            for profile in self._thread_profiles:
+                stats.add(profile)
+        return stats
+
+    def report(self) -> Dict[str, Any]:
+        stats = self.stats().stats
+
+        def rows(sort_index: int, area: Optional[str] = None) -> List[Dict[str, Any]]:
+            entries = [(key, value) for key, value in stats.items() if area is None or _area(key[0]) == area]
+            entries.sort(key=lambda item: item[1][sort_index], reverse=True)
+            return [
+                {
+                    "function": _describe(key),
+                    "calls": value[1],
+                    "self_ms": round(value[2] * 1000, 3),
+                    "cumulative_ms": round(value[3] * 1000, 3),
+                }
+                for key, value in entries[:PROFILE_TOP]
+            ]
+
+        return {
+            "top_self": rows(2),
+            "top_cumulative": rows(3),
+            "ncplot7py": rows(3, "ncplot7py"),
+            "adapter": rows(3, "adapter"),
+            "event_loop": self.loop_sampler.report(),
+        }
+
+
+class ProfileStore:
+    """Profile reports as JSON files (plus .prof for cProfile), newest PROFILE_KEEP kept."""
+    def __init__(self, directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP, max_concurrent: int = PROFILE_MAX_CONCURRENT):
+        self.directory = directory
+        self.keep = keep
+        self._slots = BoundedSemaphore(max(1, max_concurrent))
+        self._lock = Lock()
+
+    def try_acquire(self) -> bool:
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+    def _path(self, profile_id: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def save(self, report: Dict[str, Any], profiler: Any) -> str:
+        profile_id = uuid.uuid4().hex
+        report = {"id": profile_id, "created_at": time.time(), **report}
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if isinstance(profiler, DeterministicProfiler):
+                profiler.stats().dump_stats(self._path(profile_id, "prof"))
+            with open(self._path(profile_id, "json"), "w", encoding="utf-8") as handle:
+                json.dump(report, handle)
+            self._prune()
+        return profile_id
+
+    def _prune(self):
+        reports = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in reports[:max(0, len(reports) - self.keep)]:
+            for extension in ("json", "prof"):
+                try:
+                    os.remove(self._path(entry.name[:-5], extension))
+                except FileNotFoundError:
+                    pass
+
+    def load(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        if not profile_id.isalnum():
+            return None
+        try:
+            with open(self._path(profile_id, "json"), encoding="utf-8") as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+
+    def stats_path(self, profile_id: str) -> Optional[str]:
+        path = self._path(profile_id, "prof")
+        return path if profile_id.isalnum() and os.path.exists(path) else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.directory):
+            return []
+        summaries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                report = self.load(entry.name[:-5])
+                if report:
+                    summaries.append({key: report.get(key) for key in ("id", "created_at", "method", "path", "mode", "status", "duration_ms")})
+        return sorted(summaries, key=lambda item: item["created_at"] or 0, reverse=True)
+
+
+def create_profiler(mode: str):
+    return DeterministicProfiler() if mode == "cprofile" else SamplingProfiler()
+
+
+# The profiler of the request being served, set by the profiling middleware
+current_profiler: "contextvars.ContextVar[Any]" = contextvars.ContextVar("current_profiler", default=None)
+
+
+@contextmanager
+def profiled_thread() -> Iterator[None]:
+    """Count the calling thread's work in the block towards the current request's profiler, if any."""
+    profiler = current_profiler.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.thread():
+        yield
+
+
+def profiled(func: Callable[..., Any]) -> Callable[..., Any]:
+    """`func` run inside profiled_thread(); for work handed to another thread with the request's context."""
+    def call(*args, **kwargs):
+        with profiled_thread():
+            return func(*args, **kwargs)
+    return call
+
+
+_profile_store = ProfileStore()
+
+
+def get_profile_store() -> ProfileStore:
+    return _profile_store
@@ -0,0 +1,145 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from typing import Any, Optional, Tuple
+
+# json: one JSON object per line; text: the classic single-line layout with key=value fields
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Share of requests whose INFO and DEBUG records are written; warnings and errors always are
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+# Characters kept of a logged payload (request body, tool values, ...) before it is cut
+LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", "500"))
+
+# Correlation id and sampling decision of the running request; worker threads inherit both
+request_id_var: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("request_id", default=None)
+request_sampled_var: "contextvars.ContextVar[bool]" = contextvars.ContextVar("request_sampled", default=True)
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+# Header values that never go into a log record
+SENSITIVE_HEADERS = frozenset({"authorization", "cookie", "x-api-key", "x-profile", "proxy-authorization"})
+
+
+class Preview:
+    """A log field that is only turned into (capped) text when a handler formats the record."""
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: Optional[int] = None):
+        self.value = value
+        self.limit = LOG_MAX_FIELD_CHARS if limit is None else limit
+
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, (bytes, bytearray)):
+            text = bytes(value[:self.limit + 1]).decode("utf-8", errors="replace")
+            total = len(value)
+        else:
+            text = value if isinstance(value, str) else json.dumps(value, default=str)
+            total = len(text)
+        if total > self.limit:
+            return f"{text[:self.limit]}...(+{total - self.limit} chars)"
+        return text
+
+    __repr__ = __str__
+
+
+def redact_headers(headers: Any) -> dict:
+    return {name: "[redacted]" if name.lower() in SENSITIVE_HEADERS else value for name, value in headers.items()}
+
+
+def bind_request(request_id: Optional[str] = None) -> Tuple[str, Tuple[contextvars.Token, contextvars.Token]]:
+    """Set the correlation id (a valid incoming one or a new one) and decide whether this request is sampled."""
+    if not request_id or not _REQUEST_ID.match(request_id):
+        request_id = uuid.uuid4().hex
+    sampled = LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
+    return request_id, (request_id_var.set(request_id), request_sampled_var.set(sampled))
+
+
+def unbind_request(tokens: Tuple[contextvars.Token, contextvars.Token]):
+    request_id_var.reset(tokens[0])
+    request_sampled_var.reset(tokens[1])
+
+
+def detail_enabled(logger: logging.Logger) -> bool:
+    """Whether payload details are worth building: DEBUG is on and this request is sampled."""
+    return request_sampled_var.get() and logger.isEnabledFor(logging.DEBUG)
+
+
+class SamplingFilter(logging.Filter):
+    """Drops INFO and DEBUG records of requests that were not sampled."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or getattr(record, "sampled", True)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update({key: str(value) if isinstance(value, Preview) else value for key, value in fields.items()})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        extras = []
+        if getattr(record, "request_id", None):
+            extras.append(f"request_id={record.request_id}")
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            extras.append(f"{key}={value}")
+        if not extras:
+            return text
+        first_line, _, rest = text.partition("\n")
+        return " ".join([first_line, *extras]) + (f"\n{rest}" if rest else "")
+
+
+_configured = False
+
+
+def configure_logging():
+    """Install the structured handler on the root logger (once).
+
+    Every record gets the current request id and sampling decision. Like
+    logging.basicConfig, nothing is replaced when the root logger already has
+    handlers, e.g. under a test runner.
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    factory = logging.getLogRecordFactory()
+
+    def record_factory(*args: Any, **kwargs: Any) -> logging.LogRecord:
+        record = factory(*args, **kwargs)
+        record.request_id = request_id_var.get()
+        record.sampled = request_sampled_var.get()
+        return record
+
+    logging.setLogRecordFactory(record_factory)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    handler.addFilter(SamplingFilter())
+    root.addHandler(handler)
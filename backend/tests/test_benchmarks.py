@@ -0,0 +1,55 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from backend import main_import
+from backend.benchmarks import bench_pipeline, loadtest
+from backend.benchmarks.corpus import generate_machinedata, generate_program
+
+
+def test_corpus_is_reproducible_and_has_the_requested_features():
+    program = generate_program("fanuc", blocks=100, arc_density=0.5, macro_loops=2, c_axis_sections=1, seed=3)
+
+    assert program == generate_program("fanuc", blocks=100, arc_density=0.5, macro_loops=2, c_axis_sections=1, seed=3)
+    assert program.count("WHILE[") == 2
+    assert "G112" in program and "G113" in program
+    assert sum(line.startswith(("G2 ", "G3 ")) for line in program.splitlines()) > 20
+
+    siemens = generate_machinedata("siemens", canals=3, blocks=10, macro_loops=1)
+    assert [entry["canalNr"] for entry in siemens] == ["1", "2", "3"]
+    assert "ENDWHILE" in siemens[0]["program"]
+    assert siemens[0]["program"] != siemens[1]["program"]
+
+
+def test_compare_flags_slower_benchmarks_as_regressions():
+    baseline = {"results": {"small/fanuc/sanitize": {"median_s": 0.010}, "small/fanuc/engine": {"median_s": 0.1}}}
+    current = {"results": {"small/fanuc/sanitize": {"median_s": 0.013}, "small/fanuc/engine": {"skipped": "missing"}}}
+
+    rows = bench_pipeline.compare(current, baseline, tolerance=0.1)
+
+    assert [(row["name"], row["regressed"]) for row in rows] == [("small/fanuc/sanitize", True)]
+    assert abs(rows[0]["change"] - 0.3) < 1e-9
+
+
+def test_mock_parse_and_build_segments_benchmarks_report_throughput_and_memory():
+    results = bench_pipeline.bench_case("small", "siemens", TestClient(main_import.app, raise_server_exceptions=False), repeat=1)
+
+    for stage in ("sanitize", "mock_parse", "build_segments"):
+        result = results[f"small/siemens/{stage}"]
+        assert result["median_s"] > 0
+        assert result["blocks_per_s"] > 0
+        assert result["peak_memory_bytes"] > 0
+    assert "median_s" in results["small/siemens/end_to_end"] or "error" in results["small/siemens/end_to_end"]
+
+
+def test_load_test_reports_latency_and_saturation_for_each_level():
+    report = asyncio.run(loadtest.run([1, 2], duration=0.2, mix={"machines": 1, "focas": 1}))
+
+    assert [level["concurrency"] for level in report["levels"]] == [1, 2]
+    first = report["levels"][0]
+    assert first["requests"] > 0 and first["error_rate"] == 0.0
+    assert first["p50_ms"] <= first["p99_ms"] <= first["max_ms"]
+    assert "GET /api/focas/upload/{path_no}/{prog_num}" in first["endpoints"]
+
+    levels = [{"concurrency": 1, "throughput_rps": 100}, {"concurrency": 2, "throughput_rps": 180}, {"concurrency": 4, "throughput_rps": 182}]
+    assert loadtest.saturation_point(levels) == 2
@@ -0,0 +1,197 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import execution_budget, main_import
+from backend.execution_budget import ExecutionBudget, apply_output_budget
+
+
+client = TestClient(main_import.app)
+PROGRAM = {"program": "G1 X10 Y10\nG1 X20", "canalNr": "1"}
+
+
+@pytest.fixture
+def fake_engine(monkeypatch):
+    """Install an engine whose get_Syncro_plot is the given function."""
+    # Load first, so a later load_engine() cannot replace the fakes
+    main_import.load_engine()
+    monkeypatch.setattr(main_import, "UniversalConfigDrivenControl", lambda **kwargs: None)
+
+    def install(plot):
+        monkeypatch.setattr(main_import, "NCExecutionEngine", lambda control: type("Engine", (), {"get_Syncro_plot": lambda self, programs, sync: plot()})())
+    return install
+
+
+def test_request_budget_only_lowers_server_limits():
+    budget = ExecutionBudget.from_request({"maxSeconds": 5, "maxBlocks": "10", "maxPoints": 10 ** 12})
+
+    assert budget.max_seconds == 5
+    assert budget.max_blocks == 10
+    assert budget.max_points == ExecutionBudget().max_points
+    assert ExecutionBudget.from_request({"maxSeconds": -1}).max_seconds == ExecutionBudget().max_seconds
+
+
+def test_output_budget_cuts_points_across_canals():
+    canal = {"plot": [{"x": [0, 1, 2], "y": [0, 1, 2], "z": [0, 0, 0], "t": 1}] * 3, "programExec": [1, 2, 3]}
+
+    limited, exceeded = apply_output_budget([canal, canal], ExecutionBudget(max_seconds=0, max_blocks=0, max_points=7))
+
+    assert exceeded.limit == "points" and exceeded.used == 18
+    assert [len(entry["x"]) for entry in limited[0]["plot"]] == [3, 3, 1]
+    assert limited[1]["plot"] == []
+    assert apply_output_budget([canal], ExecutionBudget(max_seconds=0, max_blocks=0, max_points=9)) == ([canal], None)
+
+
+def test_runaway_engine_is_stopped_and_answered_with_budget_error(fake_engine):
+    stopped = threading.Event()
+
+    def endless():
+        try:
+            while True:
+                pass
+        finally:
+            stopped.set()
+    fake_engine(endless)
+
+    response = client.post("/cgiserver_import", json={"machinedata": [PROGRAM], "budget": {"maxSeconds": 0.2}})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["budgetExceeded"] == "time"
+    assert body["errors"][-1]["type"] == "BUDGET_EXCEEDED"
+    assert body["errors"][-1]["budget"]["allowed"] == 0.2
+    # The mock preview still shows the program
+    assert body["canal"]["1"]["segments"]
+    assert stopped.wait(2)
+
+
+def test_engine_output_beyond_point_budget_returns_partial_plot(fake_engine):
+    fake_engine(lambda: [{"plot": [{"x": list(range(100)), "y": [0] * 100, "z": [0] * 100, "t": 1, "lineNumber": 1}] * 50,
+                          "programExec": [1] * 50}])
+
+    response = client.post("/cgiserver_import", json={"machinedata": [PROGRAM], "budget": {"maxPoints": 250}})
+
+    body = response.json()
+    assert body["success"] is True
+    assert body["budgetExceeded"] == "points"
+    assert sum(len(segment["points"]) for segment in body["canal"]["1"]["segments"]) == 250
+    assert body["errors"][-1]["code"] == "points"
+
+
+class LoopingCanal:
+    """The parts of an ncplot7py canal the budget meter relies on, running a program that loops forever."""
+    def __init__(self):
+        self._chain = type("Chain", (), {"handle": lambda chain, node, state: (time.sleep(0.001) or [(node.x, 0, 0)], 0.1)})()
+        self._tool_path = []
+
+    def run(self):
+        self._tool_path = []
+        first = SimpleNamespace(x=0.0)
+        second = SimpleNamespace(x=1.0, _next_ncCode=first)
+        first._next_ncCode = second
+        node = first
+        while node is not None:
+            points, _ = self._chain.handle(node, None)
+            if points is not None:
+                self._tool_path.append((points, 0.1))
+            node = node._next_ncCode
+
+
+@pytest.fixture
+def looping_engine(monkeypatch):
+    main_import.load_engine()
+    canal = LoopingCanal()
+    control = SimpleNamespace(_canals={1: canal})
+
+    def plot(engine, programs, sync):
+        canal.run()
+        return [{"plot": [{"x": [point[0] for point in points], "y": [0.0] * len(points), "z": [0.0] * len(points),
+                           "t": 1, "lineNumber": 1} for points, _ in canal._tool_path],
+                 "programExec": [1] * len(canal._tool_path)}]
+    monkeypatch.setattr(main_import, "UniversalConfigDrivenControl", lambda **kwargs: control)
+    monkeypatch.setattr(main_import, "NCExecutionEngine", lambda control: type("Engine", (), {"get_Syncro_plot": plot})())
+
+
+def test_metered_engine_stopped_by_time_returns_its_partial_plot(looping_engine):
+    response = client.post("/cgiserver_import", json={"machinedata": [PROGRAM], "budget": {"maxSeconds": 0.2}})
+
+    body = response.json()
+    assert body["success"] is True
+    assert body["budgetExceeded"] == "time"
+    assert body["errors"][-1]["budget"]["allowed"] == 0.2
+    # The engine's own plot, not the mock preview of the two program lines
+    assert len(body["canal"]["1"]["segments"]) > 10
+
+
+def test_metered_engine_stops_at_the_block_budget(looping_engine):
+    response = client.post("/cgiserver_import", json={"machinedata": [PROGRAM], "budget": {"maxSeconds": 5, "maxBlocks": 50}})
+
+    body = response.json()
+    assert body["budgetExceeded"] == "blocks"
+    assert body["errors"][-1]["budget"]["used"] == 51
+    assert sum(len(segment["points"]) for segment in body["canal"]["1"]["segments"]) == 50
+
+
+def test_meter_warns_once_about_an_engine_without_the_expected_internals(monkeypatch, caplog):
+    monkeypatch.setattr(execution_budget, "_unmetered_warned", False)
+    meter = execution_budget.BudgetMeter(ExecutionBudget())
+
+    with caplog.at_level("WARNING", logger=execution_budget.logger.name):
+        assert meter.attach(SimpleNamespace(_canals={1: SimpleNamespace(_chain=object())})) is False
+        assert meter.attach(SimpleNamespace()) is False
+
+    warnings = [record.getMessage() for record in caplog.records if record.name == execution_budget.logger.name]
+    assert len(warnings) == 1
+    assert "SimpleNamespace._tool_path" in warnings[0]
+
+
+ENDLESS_PROGRAM = {"program": "#1=0\nWHILE[#1LT1]DO1\nG1 X10 Y10 F1000\nG1 X0 Y0\nEND1\nM30", "canalNr": "1"}
+
+
+@pytest.mark.parametrize("budget, limit", [
+    ({"maxSeconds": 0.3}, "time"),
+    ({"maxSeconds": 10, "maxBlocks": 200}, "blocks"),
+    ({"maxSeconds": 10, "maxPoints": 300}, "points"),
+])
+def test_real_engine_is_metered_and_returns_its_partial_plot(monkeypatch, budget, limit):
+    # The meter relies on ncplot7py internals, so check it against the real engine where it is installed
+    pytest.importorskip("ncplot7py")
+    if not main_import.load_engine():
+        pytest.skip("ncplot7py engine could not be loaded")
+    unmetered = []
+    monkeypatch.setattr(execution_budget, "_warn_unmetered", unmetered.append)
+
+    body = client.post("/cgiserver_import", json={"machinedata": [ENDLESS_PROGRAM], "budget": budget}).json()
+
+    assert unmetered == []
+    assert body["success"] is True
+    assert body["budgetExceeded"] == limit
+    segments = body["canal"]["1"]["segments"]
+    assert segments
+    if limit == "points":
+        assert sum(len(segment["points"]) for segment in segments) == 300
+
+
+def test_plots_are_refused_while_too_many_stopped_engines_still_run(fake_engine, monkeypatch):
+    monkeypatch.setattr(execution_budget, "PLOT_MAX_ABANDONED_THREADS", 1)
+    monkeypatch.setattr(execution_budget, "PLOT_STOP_GRACE", 0.05)
+    release = threading.Event()
+    # Blocked in C code, where the stop exception is not delivered
+    fake_engine(release.wait)
+    try:
+        stuck = client.post("/cgiserver_import", json={"machinedata": [PROGRAM], "budget": {"maxSeconds": 0.1}})
+        assert stuck.json()["budgetExceeded"] == "time"
+        assert execution_budget.abandoned_engine_threads() == 1
+
+        refused = client.post("/cgiserver_import", json={"machinedata": [PROGRAM], "budget": {"maxSeconds": 0.1}})
+        assert refused.status_code == 503
+        assert refused.headers["retry-after"]
+    finally:
+        release.set()
+    deadline = time.monotonic() + 2
+    while execution_budget.abandoned_engine_threads() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert execution_budget.abandoned_engine_threads() == 0
@@ -0,0 +1,910 @@
+import asyncio
+import ctypes
+import io
+import os
+import socket
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from backend import focas_fleet, focas_jobs, focas_probe, focas_service, focas_simulator, main_import
+from backend.focas_fleet import FleetMonitor
+from backend.focas_probe import ProbeCache
+from backend.focas_simulator import SimulatedFocasLibrary, SimulatorConfig
+from backend.focas_telemetry import TelemetryHub
+from backend.main_import import app
+import pytest
+
+from backend.focas_service import (
+    EW_BUFFER,
+    EW_OK,
+    EW_RESET,
+    EW_SOCKET,
+    FocasCallStats,
+    FocasError,
+    FocasTransferCancelled,
+    RealFocasClient,
+    TransferMonitor,
+    get_call_stats,
+    get_demo_focas_client,
+    program_content_hash,
+    split_program_stream,
+)
+
+
+client = TestClient(app)
+
+
+class UploadLibStub:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.upload_calls = 0
+        self.upend_calls = 0
+
+    def cnc_upstart3(self, handle, mode, start_prog, end_prog):
+        return EW_OK
+
+    def cnc_upload3(self, handle, length_ptr, buffer):
+        self.upload_calls += 1
+        chunk = self.chunks.pop(0)
+        ctypes.memmove(buffer, chunk, len(chunk))
+        length_ptr._obj.value = len(chunk)
+        return EW_OK
+
+    def cnc_upend3(self, handle):
+        self.upend_calls += 1
+        return EW_OK
+
+
+class DownloadLibStub:
+    def __init__(self):
+        self.received = b""
+        self.buffer_replies = 1
+        self.dwnend_calls = 0
+
+    def cnc_dwnstart3(self, handle, data_type):
+        return EW_OK
+
+    def cnc_download3(self, handle, length_ptr, data):
+        if self.buffer_replies:
+            self.buffer_replies -= 1
+            return EW_BUFFER
+        accepted = min(length_ptr._obj.value, 4)
+        self.received += data[:accepted]
+        length_ptr._obj.value = accepted
+        return EW_OK
+
+    def cnc_dwnend3(self, handle):
+        self.dwnend_calls += 1
+        return EW_OK
+
+
+def make_real_client(lib):
+    client_instance = RealFocasClient.__new__(RealFocasClient)
+    client_instance.lib = lib
+    client_instance.handle = ctypes.c_ushort(1)
+    client_instance.set_path = lambda path_no: None
+    return client_instance
+
+
+def test_real_focas_iter_upload_closes_session_when_consumer_stops():
+    lib = UploadLibStub([b"%\nO1234\n", b"G1 X1.\n", b"M30\n%"])
+    client_instance = make_real_client(lib)
+
+    chunks = client_instance.iter_upload_program(1234)
+    assert next(chunks) == "%\nO1234\n"
+    chunks.close()
+
+    assert lib.upload_calls == 1
+    assert lib.upend_calls == 1
+
+
+def test_real_focas_range_upload_uses_one_upload_session():
+    lib = UploadLibStub([b"%\nO1000\nG0 X0.\nM30\nO10", b"01\nG1 X1.\nM99\n%"])
+    client_instance = make_real_client(lib)
+
+    programs = client_instance.upload_program_range(1000, 1001)
+
+    assert programs == {1000: "%\nO1000\nG0 X0.\nM30\n%", 1001: "%\nO1001\nG1 X1.\nM99\n%"}
+    assert lib.upend_calls == 1
+
+
+def test_split_program_stream_keeps_comment_lines_with_their_program():
+    programs = split_program_stream("%\r\nO0010 (FIRST)\r\n(O0020 IS NEXT)\r\nM30\r\nO0020\r\nM30\r\n%")
+
+    assert sorted(programs) == [10, 20]
+    assert "(O0020 IS NEXT)" in programs[10]
+
+
+def test_upload_stream_returns_demo_program_as_text():
+    expected = get_demo_focas_client().upload_program(1000, 1)
+
+    resp = client.get("/api/focas/upload/1/1000/stream", params={"ip_address": "DEMO"})
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert resp.headers["x-program-length"] == str(len(expected))
+    assert resp.text == expected
+
+
+def test_upload_stream_unknown_demo_program_is_client_error():
+    resp = client.get("/api/focas/upload/1/9999/stream", params={"ip_address": "DEMO"})
+
+    assert resp.status_code == 400
+
+
+def test_real_focas_download_stream_sends_chunks_and_closes_program():
+    lib = DownloadLibStub()
+    client_instance = make_real_client(lib)
+
+    client_instance.download_program_stream(iter([b"O1234\n", "G1 X1.\xb0\n".encode("utf-8"), b"M30\n"]))
+
+    assert lib.received == b"\nO1234\nG1 X1.\nM30\n\n%"
+    assert lib.dwnend_calls == 1
+
+
+def test_download_stream_accepts_raw_body_for_demo():
+    demo_client = get_demo_focas_client()
+    program = "O4321\n(STREAMED)\nG0 X0. Z5.\nM30\n"
+
+    try:
+        resp = client.post(
+            "/api/focas/download/2/stream",
+            params={"ip_address": "DEMO"},
+            content=program.encode("ascii"),
+            headers={"Content-Type": "text/plain"},
+        )
+
+        assert resp.status_code == 200
+        assert resp.json()["bytes_received"] == len(program)
+        assert "O4321" in demo_client.upload_program(4321, 2)
+    finally:
+        demo_client.reset_demo_state()
+
+
+def test_download_stream_rejects_program_without_number_for_demo():
+    resp = client.post("/api/focas/download/1/stream", params={"ip_address": "DEMO"}, content=b"G0 X0.\nM30\n")
+
+    assert resp.status_code == 400
+
+
+def test_program_listing_is_cached_until_download_to_same_path():
+    demo_client = get_demo_focas_client()
+    params = {"ip_address": "DEMO"}
+
+    try:
+        first = client.get("/api/focas/programs/3", params=params).json()
+        second = client.get("/api/focas/programs/3", params=params).json()
+        assert first["cached"] is False
+        assert second["cached"] is True
+        assert second["programs"] == first["programs"]
+
+        client.post("/api/focas/download/3", params=params, json={"program_text": "O3999\nM30"})
+        refreshed = client.get("/api/focas/programs/3", params=params).json()
+
+        assert refreshed["cached"] is False
+        assert 3999 in [program["number"] for program in refreshed["programs"]]
+    finally:
+        demo_client.reset_demo_state()
+
+
+def test_upload_serves_unchanged_program_from_cache():
+    demo_client = get_demo_focas_client()
+    params = {"ip_address": "DEMO"}
+
+    try:
+        first = client.get("/api/focas/upload/2/2100", params=params).json()
+        second = client.get("/api/focas/upload/2/2100", params=params).json()
+        assert first["cached"] is False
+        assert second["cached"] is True
+        assert second["program_text"] == first["program_text"]
+
+        client.post("/api/focas/download/2", params=params, json={"program_text": "O2100\n(CHANGED)\nM30"})
+        changed = client.get("/api/focas/upload/2/2100", params=params).json()
+
+        assert changed["cached"] is False
+        assert "(CHANGED)" in changed["program_text"]
+    finally:
+        demo_client.reset_demo_state()
+
+
+def test_program_listing_exposes_modification_dates():
+    programs = client.get("/api/focas/programs/1", params={"ip_address": "DEMO", "refresh": "true"}).json()["programs"]
+
+    assert all(program["mdate"] and program["cdate"] for program in programs)
+
+
+def test_program_content_hash_ignores_transfer_framing():
+    assert program_content_hash("O1\r\nM30\r\n") == program_content_hash("\n%\nO1\nM30\n%\n")
+    assert program_content_hash("O1\nM30") != program_content_hash("O1\nM02")
+
+
+def test_download_only_if_changed_skips_identical_program():
+    demo_client = get_demo_focas_client()
+    params = {"ip_address": "DEMO"}
+    current_text = demo_client.upload_program(1201, 1)
+
+    try:
+        unchanged = client.post("/api/focas/download/1", params=params, json={"program_text": current_text.strip("%\n"), "only_if_changed": True})
+        changed = client.post("/api/focas/download/1", params=params, json={"program_text": "O1201\nG0 Z50.\nM30", "only_if_changed": True})
+
+        assert unchanged.json()["written"] is False
+        assert changed.json()["written"] is True
+        assert "G0 Z50." in demo_client.upload_program(1201, 1)
+    finally:
+        demo_client.reset_demo_state()
+
+
+def wait_for_job(url, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(url).json()["job"]
+        if job["state"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job at {url} did not finish")
+
+
+def test_backup_job_archives_every_demo_program(tmp_path, monkeypatch):
+    monkeypatch.setattr(focas_jobs, "FOCAS_BACKUP_DIR", str(tmp_path))
+    expected = sum(len(get_demo_focas_client().list_programs(path_no)) for path_no in (1, 2))
+
+    resp = client.post("/api/focas/backup", json={"controllers": [{"ip_address": "DEMO", "paths": [1, 2]}]})
+    job_id = resp.json()["job"]["id"]
+    job = wait_for_job(f"/api/focas/backup/{job_id}")
+
+    assert job["state"] == "completed"
+    assert job["result"]["succeeded"] == expected
+    assert job["result"]["failed"] == 0
+    assert job["progress"]["programs_done"] == expected
+
+    archive = client.get(f"/api/focas/backup/{job_id}/archive")
+    with zipfile.ZipFile(io.BytesIO(archive.content)) as backup:
+        names = backup.namelist()
+        assert "DEMO_8193/path2/O2100.nc" in names
+        assert "O2100" in backup.read("DEMO_8193/path2/O2100.nc").decode("ascii")
+        assert len(names) == expected + 1
+
+
+def test_backup_rejects_unbounded_parallelism():
+    controllers = [{"ip_address": "DEMO", "paths": [1]}]
+
+    assert client.post("/api/focas/backup", json={"controllers": controllers, "max_parallel_controllers": 10_000}).status_code == 422
+    assert client.post("/api/focas/backup", json={"controllers": controllers, "sessions_per_controller": 50}).status_code == 422
+    assert client.post("/api/focas/backup", json={"controllers": controllers, "sessions_per_controller": 0}).status_code == 422
+
+
+def test_forgotten_backup_job_deletes_its_archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(focas_jobs, "FOCAS_BACKUP_DIR", str(tmp_path))
+    registry = focas_jobs.FocasJobRegistry(max_workers=1, max_history=1)
+    controllers = [{"ip_address": "DEMO", "paths": [1]}]
+
+    first = registry.submit("backup", {}, focas_jobs.run_backup, controllers)
+    while not first.finished:
+        time.sleep(0.01)
+    archive_path = focas_jobs.backup_archive_path(first.id)
+    assert os.path.exists(archive_path)
+
+    second = registry.submit("backup", {}, focas_jobs.run_backup, controllers)
+    while not second.finished:
+        time.sleep(0.01)
+    third = registry.submit("backup", {}, focas_jobs.run_backup, controllers)
+    while not third.finished:
+        time.sleep(0.01)
+
+    assert registry.get(first.id) is None
+    assert not os.path.exists(archive_path)
+    assert os.path.exists(focas_jobs.backup_archive_path(second.id))
+
+
+def test_deploy_reports_per_target_results_and_focas_codes():
+    demo_client = get_demo_focas_client()
+    payload = {
+        "programs": ["O5001\nG0 X0.\nM30", "G0 X1.\nM30"],
+        "targets": [{"ip_address": "DEMO", "path_no": 1}, {"ip_address": "DEMO", "path_no": 2}],
+    }
+
+    try:
+        body = client.post("/api/focas/deploy", json=payload).json()
+
+        assert body["failed"] == 2
+        for target in body["targets"]:
+            assert target["programs"][0]["status"] == "success"
+            assert target["programs"][1]["code"] == 5
+            assert target["code"] == 5
+            assert target["seconds"] >= 0
+        assert "O5001" in demo_client.upload_program(5001, 2)
+    finally:
+        demo_client.reset_demo_state()
+
+
+def test_deploy_bounds_workers_and_targets_and_shares_each_controller():
+    programs = ["O5002\nM30"]
+    assert client.post("/api/focas/deploy", json={"programs": programs, "targets": [{"ip_address": "DEMO"}], "max_workers": 10_000}).status_code == 422
+    assert client.post("/api/focas/deploy", json={"programs": programs, "targets": [{"ip_address": "DEMO"}], "max_workers": 0}).status_code == 422
+    targets = [{"ip_address": "DEMO", "path_no": 1}] * (main_import.FOCAS_DEPLOY_MAX_TARGETS + 1)
+    assert client.post("/api/focas/deploy", json={"programs": programs, "targets": targets}).status_code == 422
+
+    open_sessions = {}
+    most_open = {}
+    lock = threading.Lock()
+
+    class CountingClient(focas_service.DummyFocasClient):
+        def connect(self, ip, port=8193, timeout=10):
+            with lock:
+                open_sessions[ip] = open_sessions.get(ip, 0) + 1
+                most_open[ip] = max(most_open.get(ip, 0), open_sessions[ip])
+            time.sleep(0.02)
+            return super().connect(ip, port, timeout)
+
+        def disconnect(self):
+            with lock:
+                open_sessions[self.ip] -= 1
+            super().disconnect()
+
+    targets = [{"ip_address": ip, "path_no": path_no} for ip in ("10.0.5.1", "10.0.5.2") for path_no in (1, 2, 3)]
+    summary = focas_jobs.run_deploy(programs, targets, max_workers=6, client_factory=lambda ip: CountingClient())
+
+    assert summary["succeeded"] == 6
+    assert most_open == {"10.0.5.1": 1, "10.0.5.2": 1}
+
+
+def test_real_focas_download_cancel_ends_download_session():
+    lib = DownloadLibStub()
+    lib.buffer_replies = 2
+    client_instance = make_real_client(lib)
+    monitor = TransferMonitor()
+    original_download3 = lib.cnc_download3
+
+    def cancel_after_buffer_reply(handle, length_ptr, data):
+        ret = original_download3(handle, length_ptr, data)
+        monitor.cancel()
+        return ret
+
+    lib.cnc_download3 = cancel_after_buffer_reply
+
+    with pytest.raises(FocasTransferCancelled):
+        client_instance.download_program("O1\nM30", monitor=monitor)
+
+    assert monitor.buffer_retries == 1
+    assert lib.received == b""
+    assert lib.dwnend_calls == 1
+
+
+def test_upload_job_reports_progress_and_result():
+    expected = get_demo_focas_client().upload_program(3010, 3)
+
+    resp = client.post("/api/focas/jobs/upload", json={"ip_address": "DEMO", "path_no": 3, "prog_num": 3010})
+    job_id = resp.json()["job"]["id"]
+    job = wait_for_job(f"/api/focas/jobs/{job_id}")
+
+    assert job["state"] == "completed"
+    assert job["result"]["program_text"] == expected
+    assert job["progress"]["bytes_transferred"] == len(expected)
+
+    events = client.get(f"/api/focas/jobs/{job_id}/events").text
+    assert "event: done" in events
+
+
+def test_cancelled_download_job_leaves_demo_store_untouched():
+    demo_client = get_demo_focas_client()
+    registry = focas_jobs.get_job_registry()
+    job = focas_jobs.FocasJob("download", {})
+    job.cancel()
+
+    registry._run(job, focas_jobs.run_download, ("DEMO", 8193, 1, "O7001\nM30"))
+
+    assert job.state == "cancelled"
+    assert all(program["number"] != 7001 for program in demo_client.list_programs(1))
+
+
+def test_ping_probes_focas_port_over_tcp(monkeypatch):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    open_port = listener.getsockname()[1]
+    monkeypatch.setattr(focas_probe, "FOCAS_PROBE_PORTS", frozenset({open_port}))
+    try:
+        resp = client.get("/api/focas/ping", params={"ip_address": "127.0.0.1", "port": open_port, "refresh": "true"})
+        body = resp.json()
+        assert body["available"] is True
+        assert body["latency_ms"] >= 0
+
+        cached = client.get("/api/focas/ping", params={"ip_address": "127.0.0.1", "port": open_port}).json()
+        assert cached["cached"] is True
+    finally:
+        listener.close()
+
+
+def test_batch_ping_reports_each_target(monkeypatch):
+    closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    closed.bind(("127.0.0.1", 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    monkeypatch.setattr(focas_probe, "FOCAS_PROBE_PORTS", frozenset({8193, closed_port}))
+
+    resp = client.post("/api/focas/ping/batch", json={"targets": [
+        {"ip_address": "DEMO"},
+        {"ip_address": "127.0.0.1", "port": closed_port},
+    ], "refresh": True})
+    results = resp.json()["results"]
+
+    assert [result["available"] for result in results] == [True, False]
+    assert results[1]["latency_ms"] is None
+
+
+def test_ping_refuses_other_ports_and_oversized_batches():
+    assert client.get("/api/focas/ping", params={"ip_address": "127.0.0.1", "port": 22}).status_code == 400
+    assert client.post("/api/focas/ping/batch", json={"targets": [{"ip_address": "127.0.0.1", "port": 22}]}).status_code == 422
+
+    targets = [{"ip_address": f"10.1.{i // 256}.{i % 256}"} for i in range(focas_probe.FOCAS_PROBE_MAX_TARGETS + 1)]
+    assert client.post("/api/focas/ping/batch", json={"targets": targets}).status_code == 422
+
+
+def test_fleet_status_includes_open_demo_handles():
+    demo_client = get_demo_focas_client()
+    client.post("/api/focas/fleet", json={"controllers": [{"ip_address": "DEMO"}]})
+
+    demo_client.connect("DEMO")
+    try:
+        controllers = client.get("/api/focas/fleet").json()["controllers"]
+    finally:
+        demo_client.disconnect()
+        client.delete("/api/focas/fleet", params={"ip_address": "DEMO"})
+
+    demo = next(item for item in controllers if item["ip_address"] == "DEMO")
+    assert demo["available"] is True
+    assert demo["open_handles"] == 1
+
+
+def test_fleet_monitor_fans_one_poll_out_to_every_subscriber():
+    async def scenario():
+        monitor = FleetMonitor(interval=60)
+        monitor.watch("DEMO")
+        first, second = monitor.subscribe(), monitor.subscribe()
+        first_snapshot = await asyncio.wait_for(first.get(), timeout=5)
+        second_snapshot = await asyncio.wait_for(second.get(), timeout=5)
+        monitor.unsubscribe(first)
+        monitor.unsubscribe(second)
+        return first_snapshot, second_snapshot
+
+    first_snapshot, second_snapshot = asyncio.run(scenario())
+
+    assert first_snapshot is second_snapshot
+    assert first_snapshot[0]["available"] is True
+
+
+def test_fleet_monitor_bounds_ports_size_and_watch_time(monkeypatch):
+    monitor = FleetMonitor(interval=60, max_controllers=2, watch_ttl=60)
+
+    with pytest.raises(ValueError):
+        monitor.watch("10.0.0.1", 22)
+    monitor.watch("10.0.0.1")
+    monitor.watch("10.0.0.2")
+    monitor.watch("10.0.0.2")
+    with pytest.raises(ValueError):
+        monitor.watch("10.0.0.3")
+
+    later = time.monotonic() + 61
+    monkeypatch.setattr(focas_fleet.time, "monotonic", lambda: later)
+    assert monitor.snapshot() == []
+    monitor.watch("10.0.0.3")
+    assert [item["ip_address"] for item in monitor.snapshot()] == ["10.0.0.3"]
+
+
+def test_fleet_route_rejects_too_many_controllers():
+    controllers = [{"ip_address": f"10.2.{i // 256}.{i % 256}"} for i in range(focas_probe.FOCAS_PROBE_MAX_TARGETS + 1)]
+    assert client.post("/api/focas/fleet", json={"controllers": controllers}).status_code == 422
+
+
+def test_probe_cache_drops_expired_and_excess_results(monkeypatch):
+    cache = ProbeCache(ttl=60, max_size=2)
+
+    async def store(ip_address, stored_at):
+        done = asyncio.get_running_loop().create_future()
+        done.set_result({"ip_address": ip_address})
+        monkeypatch.setattr(focas_probe.time, "monotonic", lambda: stored_at)
+        cache._store((ip_address, 8193), done)
+
+    def store_sync(ip_address, stored_at):
+        asyncio.run(store(ip_address, stored_at))
+
+    store_sync("10.0.0.1", 0)
+    store_sync("10.0.0.2", 1)
+    store_sync("10.0.0.3", 2)
+    assert [key[0] for key in cache._results] == ["10.0.0.2", "10.0.0.3"]
+    store_sync("10.0.0.4", 62)
+    assert [key[0] for key in cache._results] == ["10.0.0.3", "10.0.0.4"]
+
+
+def test_demo_telemetry_reports_status_positions_and_program():
+    response = client.get("/api/focas/telemetry", params={"ip_address": "DEMO", "path_no": 1})
+
+    assert response.status_code == 200
+    telemetry = response.json()["telemetry"]
+    assert telemetry["connected"] is True
+    assert telemetry["status"]["mode"] == "MEM"
+    assert [position["axis"] for position in telemetry["positions"]] == ["X", "Y", "Z"]
+    assert telemetry["program"]["running"] > 0
+    assert telemetry["alarms"] == []
+
+
+def test_telemetry_hub_shares_one_session_between_subscribers():
+    demo_client = get_demo_focas_client()
+    connects = []
+
+    def factory(ip_address):
+        connects.append(ip_address)
+        return demo_client
+
+    async def scenario():
+        hub = TelemetryHub(interval=0.01, client_factory=factory)
+        queues = [hub.subscribe("DEMO", path_no=1) for _ in range(3)]
+        snapshots = [await asyncio.wait_for(queue.get(), timeout=5) for queue in queues]
+        task = hub._channels[("DEMO", 8193)].task
+        for queue in queues:
+            hub.unsubscribe("DEMO", 8193, queue)
+        await asyncio.wait_for(task, timeout=5)
+        return snapshots
+
+    snapshots = asyncio.run(scenario())
+
+    assert connects == ["DEMO"]
+    assert all(snapshot["connected"] and snapshot["path"] == 1 for snapshot in snapshots)
+    assert demo_client._open_sessions == 0
+
+
+def test_telemetry_hub_drops_a_channel_when_its_last_subscriber_leaves():
+    demo_client = get_demo_focas_client()
+
+    async def scenario():
+        hub = TelemetryHub(interval=60, client_factory=lambda ip_address: demo_client)
+        queue = hub.subscribe("DEMO", path_no=1)
+        await asyncio.wait_for(queue.get(), timeout=5)
+        task = hub._channels[("DEMO", 8193)].task
+        hub.unsubscribe("DEMO", 8193, queue)
+        channels = dict(hub._channels)
+        # The poller stops now instead of sleeping out its interval
+        await asyncio.wait_for(task, timeout=5)
+        return channels
+
+    assert asyncio.run(scenario()) == {}
+    assert demo_client._open_sessions == 0
+
+
+def test_programs_of_all_demo_paths_in_one_session(monkeypatch):
+    demo_client = get_demo_focas_client()
+    demo_client.reset_demo_state()
+    connects = []
+    original_connect = demo_client.connect
+    monkeypatch.setattr(demo_client, "connect", lambda *args, **kwargs: connects.append(args) or original_connect(*args, **kwargs))
+
+    response = client.get("/api/focas/programs", params={"ip_address": "DEMO", "refresh": True})
+
+    assert response.status_code == 200
+    assert len(connects) == 1
+    programs = response.json()["programs"]
+    assert sorted(programs) == ["1", "2", "3"]
+    assert programs["1"] == client.get("/api/focas/programs/1", params={"ip_address": "DEMO", "refresh": True}).json()["programs"]
+
+
+def test_programs_of_cached_paths_need_no_session(monkeypatch):
+    demo_client = get_demo_focas_client()
+    demo_client.reset_demo_state()
+    client.get("/api/focas/programs", params={"ip_address": "DEMO", "paths": [2, 3]})
+    monkeypatch.setattr(demo_client, "connect", lambda *args, **kwargs: pytest.fail("unexpected FOCAS session"))
+
+    response = client.get("/api/focas/programs", params={"ip_address": "DEMO", "paths": [2, 3]})
+
+    assert response.json()["cached_paths"] == [2, 3]
+    assert sorted(response.json()["programs"]) == ["2", "3"]
+
+
+def test_upload_program_list_from_demo_as_map_and_archive():
+    demo_client = get_demo_focas_client()
+    demo_client.reset_demo_state()
+    numbers = [program["number"] for program in demo_client.list_programs(1)]
+
+    response = client.get("/api/focas/upload/1", params={"ip_address": "DEMO", "programs": numbers + [9999]})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["programs"] == {str(number): demo_client.upload_program(number, 1) for number in numbers}
+    assert body["missing"] == [9999]
+
+    response = client.get("/api/focas/upload/1", params={"ip_address": "DEMO", "start": 0, "end": 9999, "archive": True})
+
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert sorted(archive.namelist()) == [f"O{number:04d}.nc" for number in sorted(numbers)]
+
+
+def make_simulated_client(**config):
+    settings = {"bandwidth": 50_000, "buffer_depth": 512, "handshake_latency": 0, "max_handles": 2}
+    settings.update(config)
+    lib = SimulatedFocasLibrary(SimulatorConfig(**settings))
+    return lib, RealFocasClient(lib=lib)
+
+
+def test_simulator_download_runs_real_buffer_retry_loop():
+    lib, sim_client = make_simulated_client()
+    program_text = "O4242\n" + "G1 X1. Y2.\n" * 150 + "M30\n"
+    monitor = TransferMonitor()
+
+    assert sim_client.connect("10.0.0.1")
+    try:
+        sim_client.download_program(program_text, 1, monitor=monitor)
+        uploaded = sim_client.upload_program(4242, 1)
+    finally:
+        sim_client.disconnect()
+
+    assert monitor.buffer_retries > 0
+    assert program_content_hash(uploaded) == program_content_hash(program_text)
+    assert lib.calls["cnc_dwnend3"] == 1
+
+
+def test_real_client_records_call_latency_retries_and_transfer_rate_per_controller():
+    lib, sim_client = make_simulated_client()
+    program_text = "O4343\n" + "G1 X1. Y2.\n" * 150 + "M30\n"
+    monitor = TransferMonitor()
+
+    assert sim_client.connect("10.0.4.5")
+    try:
+        sim_client.download_program(program_text, 1, monitor=monitor)
+        sim_client.upload_program(4343, 1)
+    finally:
+        sim_client.disconnect()
+
+    stats = client.get("/api/focas/diagnostics", params={"ip_address": "10.0.4.5"}).json()["controllers"]
+    assert [entry["controller"] for entry in stats] == ["10.0.4.5:8193"]
+    calls = stats[0]["calls"]
+    assert calls["cnc_allclibhndl3"]["count"] == 1
+    assert calls["cnc_download3"]["return_codes"][str(EW_BUFFER)] == monitor.buffer_retries
+    assert stats[0]["buffer_retries"] >= monitor.buffer_retries > 0
+    download = stats[0]["transfers"]["download"]
+    assert download["bytes"] == monitor.bytes_transferred
+    assert download["bytes_per_second"] > 0
+    assert stats[0]["transfers"]["upload"]["bytes"] > 0
+
+    metrics = client.get("/metrics").text
+    assert f'focas_buffer_retries_total{{controller="10.0.4.5:8193",call="cnc_download3"}} {monitor.buffer_retries}' in metrics
+    assert 'focas_call_duration_seconds_count{controller="10.0.4.5:8193",call="cnc_allclibhndl3"} 1' in metrics
+
+
+def test_call_stats_keep_only_recent_controllers_and_their_metric_series():
+    stats = FocasCallStats(max_controllers=2)
+    for ip in ("10.9.0.1", "10.9.0.2", "10.9.0.1", "10.9.0.3"):
+        stats.record_call(f"{ip}:8193", "cnc_statinfo", 0.001, EW_SOCKET)
+    stats.record_transfer("10.9.0.4:8193", "upload", 10, 0.1)
+
+    assert [entry["controller"] for entry in stats.snapshot()] == ["10.9.0.3:8193", "10.9.0.4:8193"]
+    metrics = client.get("/metrics").text
+    assert 'controller="10.9.0.1:8193"' not in metrics and 'controller="10.9.0.2:8193"' not in metrics
+    assert 'focas_call_return_codes_total{controller="10.9.0.3:8193",call="cnc_statinfo",code="-16"} 1' in metrics
+    assert 'focas_transfer_bytes_total{controller="10.9.0.4:8193",direction="upload"} 10' in metrics
+
+
+def test_real_client_loads_library_on_first_use_and_reports_state(monkeypatch):
+    monkeypatch.setattr(focas_service, "_focas_libraries", {})
+    monkeypatch.setattr(focas_service, "_focas_library_status", {})
+    lazy_client = RealFocasClient("focas_dlls/missing.dll")
+
+    assert focas_service.focas_library_status("focas_dlls/missing.dll") == {"state": "not_loaded"}
+    assert client.get("/api/features").json()["focas_library"] == "not_loaded"
+
+    with pytest.raises(RuntimeError):
+        lazy_client.connect("10.0.0.1")
+
+    status = focas_service.focas_library_status("focas_dlls/missing.dll")
+    assert status["state"] == "failed"
+    assert status["load_ms"] >= 0
+    startup = client.get("/api/startup").json()
+    assert list(startup["phases"])[:3] == ["framework_imports", "backend_modules", "app_setup"]
+    assert startup["import_s"] > 0
+
+
+@pytest.fixture
+def simulated_controllers(monkeypatch):
+    """Run the routes as started with USE_SIMULATED_FOCAS=1, where the shared client also talks to the simulator."""
+    lib = SimulatedFocasLibrary(SimulatorConfig(handshake_latency=0.02, call_latency=0.002, bandwidth=1_000_000))
+    monkeypatch.setattr(focas_service, "USE_SIMULATED", True)
+    monkeypatch.setattr(focas_simulator, "_simulated_library", lib)
+    monkeypatch.setattr(focas_service, "_focas_instance", focas_service._new_real_client())
+    return lib
+
+
+def request_concurrently(method, path, addresses, params=None, **kwargs):
+    responses = {}
+
+    def send(ip_address):
+        responses[ip_address] = client.request(method, path, params={"ip_address": ip_address, **(params or {})}, **kwargs)
+
+    threads = [threading.Thread(target=send, args=(ip_address,)) for ip_address in addresses]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def test_concurrent_requests_to_real_controllers_keep_their_own_sessions(simulated_controllers, caplog):
+    addresses = [f"10.0.9.{host}" for host in range(1, 7)]
+
+    responses = request_concurrently("GET", "/api/focas/upload/1/1000", addresses, {"refresh": True})
+
+    assert sorted(responses) == addresses
+    assert all(response.status_code == 200 and "O1000" in response.json()["program_text"] for response in responses.values())
+    assert "during cleanup" not in caplog.text
+
+
+def test_concurrent_upload_streams_use_and_close_their_own_sessions(simulated_controllers):
+    addresses = [f"10.0.8.{host}" for host in range(1, 5)]
+
+    responses = request_concurrently("GET", "/api/focas/upload/1/1000/stream", addresses)
+
+    assert sorted(responses) == addresses
+    assert all(response.status_code == 200 and "O1000" in response.text for response in responses.values())
+    assert simulated_controllers._handles == {}
+
+
+def test_upload_stream_session_is_closed_when_the_body_is_never_sent(simulated_controllers):
+    request = Request({"type": "http", "method": "GET", "path": "/api/focas/upload/1/1000/stream", "headers": []})
+
+    async def abandon_response():
+        response = await main_import.focas_upload_stream(request, 1, 1000, "10.0.8.9", demo_session=None)
+        assert simulated_controllers._handles
+        # What Starlette runs after the response, here without ever iterating the body
+        await response.background()
+
+    asyncio.run(abandon_response())
+
+    assert simulated_controllers._handles == {}
+
+
+def test_concurrent_download_streams_use_and_close_their_own_sessions(simulated_controllers):
+    addresses = [f"10.0.7.{host}" for host in range(1, 5)]
+    program = "O4545\n" + "G1 X1. Y2.\n" * 200 + "M30\n"
+
+    responses = request_concurrently("POST", "/api/focas/download/1/stream", addresses, content=program.encode("ascii"))
+
+    assert sorted(responses) == addresses
+    assert all(response.status_code == 200 for response in responses.values())
+    assert simulated_controllers._handles == {}
+    for ip_address in addresses:
+        uploaded = focas_service._new_real_client()
+        assert uploaded.connect(ip_address)
+        try:
+            assert program_content_hash(uploaded.upload_program(4545, 1)) == program_content_hash(program)
+        finally:
+            uploaded.disconnect()
+
+
+def test_simulator_enforces_handle_limit_per_controller():
+    lib, first = make_simulated_client(max_handles=1)
+    second = RealFocasClient(lib=lib)
+
+    assert first.connect("10.0.0.1")
+    assert not second.connect("10.0.0.1")
+    assert second.connect("10.0.0.2")
+    first.disconnect()
+    second.disconnect()
+
+    assert second.connect("10.0.0.1")
+    second.disconnect()
+
+
+def test_simulator_fault_injection_surfaces_focas_error_and_ends_upload():
+    lib, sim_client = make_simulated_client()
+    lib.inject_fault("10.0.0.1", "cnc_upload3", EW_SOCKET)
+
+    assert sim_client.connect("10.0.0.1")
+    try:
+        with pytest.raises(FocasError) as error:
+            sim_client.upload_program(1000, 1)
+        lib.inject_fault("10.0.0.1", "cnc_upload3", EW_RESET)
+        assert sim_client.upload_program(1000, 1) == ""
+        assert "O1000" in sim_client.upload_program(1000, 1)
+    finally:
+        sim_client.disconnect()
+
+    assert error.value.code == EW_SOCKET
+    assert lib.calls["cnc_upend3"] == 3
+
+
+def test_demo_sessions_have_isolated_program_stores():
+    program_text = "O7070\n(SESSION ONLY)\nM30\n"
+    alice = {"X-Demo-Session": "alice"}
+
+    response = client.post("/api/focas/download/1", params={"ip_address": "DEMO"}, json={"program_text": program_text}, headers=alice)
+    assert response.status_code == 200
+
+    def numbers(headers=None):
+        listing = client.get("/api/focas/programs/1", params={"ip_address": "DEMO", "refresh": True}, headers=headers or {})
+        return [program["number"] for program in listing.json()["programs"]]
+
+    assert 7070 in numbers(alice)
+    assert 7070 not in numbers({"X-Demo-Session": "bob"})
+    assert 7070 not in numbers()
+
+
+def test_demo_session_ids_differing_in_case_are_one_session():
+    # The caches key on the upper-cased address, so case variants must not be separate stores
+    assert focas_service.demo_address("Alice") == focas_service.demo_address("alice") == "DEMO#alice"
+    assert get_demo_focas_client("ALICE") is get_demo_focas_client("alice")
+
+
+def test_demo_transfers_do_not_block_the_event_loop():
+    import httpx
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as async_client:
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(
+                async_client.get("/api/focas/upload/1/1000", params={"ip_address": "DEMO", "refresh": True},
+                                 headers={"X-Demo-Session": f"visitor{i}"})
+                for i in range(8)
+            ))
+            return time.perf_counter() - started, responses
+
+    elapsed, responses = asyncio.run(scenario())
+
+    assert all(response.status_code == 200 for response in responses)
+    # Eight 0.1 s demo transfers run inline would take at least 0.8 s
+    assert elapsed < 0.6
+
+
+def uploaded_text(ip_address, prog_num):
+    return client.get(f"/api/focas/upload/1/{prog_num}", params={"ip_address": ip_address}).json()["program_text"]
+
+
+def start_early_in_a_minute():
+    # The tests rely on their writes sharing one minute
+    if datetime.now().second >= 55:
+        time.sleep(61 - datetime.now().second)
+
+
+def rewrite_on_controller(lib, ip_address, prog_num, old, new):
+    """Change a program the way a panel edit does: same minute, so same mdate, behind the service's back."""
+    program = lib.controller(ip_address).programs_by_path[1][prog_num]
+    program["text"] = program["text"].replace(old, new)
+
+
+def test_program_rewritten_with_same_length_within_a_minute_is_not_served_stale(simulated_controllers, monkeypatch):
+    ip_address = "10.0.6.1"
+    params = {"ip_address": ip_address}
+    mdate_settled = focas_service._mdate_settled
+    start_early_in_a_minute()
+
+    # Writes through the service drop the cached text, even when its date already looks settled
+    monkeypatch.setattr(focas_service, "_mdate_settled", lambda mdate: True)
+    client.post("/api/focas/download/1", params=params, json={"program_text": "O5100\nG1 X1.\nM30"})
+    assert "X1." in uploaded_text(ip_address, 5100)
+    client.post("/api/focas/download/1", params=params, json={"program_text": "O5100\nG1 X2.\nM30"})
+    assert "X2." in uploaded_text(ip_address, 5100)
+
+    # Other writers keep the minute-resolution mdate, so texts of the current minute are not cached at all
+    monkeypatch.setattr(focas_service, "_mdate_settled", mdate_settled)
+    client.post("/api/focas/download/1", params=params, json={"program_text": "O5100\nG1 X4.\nM30"})
+    assert "X4." in uploaded_text(ip_address, 5100)
+    rewrite_on_controller(simulated_controllers, ip_address, 5100, "X4.", "X5.")
+    assert "X5." in uploaded_text(ip_address, 5100)
+
+
+def test_download_if_changed_rechecks_a_program_written_this_minute(simulated_controllers):
+    ip_address = "10.0.6.2"
+    params = {"ip_address": ip_address}
+    program_text = "O5200\nG1 X1.\nM30"
+    start_early_in_a_minute()
+    client.post("/api/focas/download/1", params=params, json={"program_text": program_text})
+    assert "X1." in uploaded_text(ip_address, 5200)
+    rewrite_on_controller(simulated_controllers, ip_address, 5200, "X1.", "X9.")
+
+    response = client.post("/api/focas/download/1", params=params, json={"program_text": program_text, "only_if_changed": True})
+
+    assert response.json()["written"] is True
+    assert "X1." in uploaded_text(ip_address, 5200)
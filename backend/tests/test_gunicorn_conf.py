@@ -0,0 +1,71 @@
+import gc
+import os
+import runpy
+import signal
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from backend.focas_jobs import FocasJobRegistry
+
+
+CONFIG = runpy.run_path(str(Path(__file__).resolve().parents[1] / "gunicorn.conf.py"))
+
+
+def test_config_preloads_uvicorn_workers_and_recycles_them_only_for_memory():
+    assert CONFIG["worker_class"] == "uvicorn.workers.UvicornWorker"
+    assert CONFIG["preload_app"] is True
+    # Recycling drops jobs and sessions, so only the memory watchdog is on by default
+    assert CONFIG["max_requests"] == int(os.environ.get("GUNICORN_MAX_REQUESTS", "0"))
+    assert CONFIG["max_rss_mb"] > 0
+    assert CONFIG["graceful_timeout"] <= CONFIG["timeout"]
+    # Jobs, demo sessions and metrics are per process, so a single worker unless asked otherwise
+    assert CONFIG["workers"] == int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+
+def test_rss_watchdog_waits_for_running_jobs_before_recycling(monkeypatch):
+    watch_rss = CONFIG["_watch_rss"]
+    settings = watch_rss.__globals__
+    running = [2, 1, 0]
+    checks, kills, warnings = [], [], []
+    monkeypatch.setitem(settings, "time", SimpleNamespace(sleep=lambda seconds: checks.append(seconds)))
+    monkeypatch.setitem(settings, "_rss_mb", lambda: 4096.0)
+    monkeypatch.setitem(settings, "_jobs_running", lambda: running.pop(0))
+    monkeypatch.setitem(settings, "os", SimpleNamespace(kill=lambda pid, signum: kills.append((pid, signum))))
+    worker = SimpleNamespace(pid=1234, log=SimpleNamespace(warning=lambda message, *args: warnings.append(message % args)))
+
+    watch_rss(worker)
+
+    assert len(checks) == 3
+    assert kills == [(1234, signal.SIGTERM)]
+    assert len(warnings) == 2 and "once 2 FOCAS jobs finish" in warnings[0]
+
+
+def test_job_registry_counts_jobs_that_have_not_finished():
+    registry = FocasJobRegistry(max_workers=1)
+    release = threading.Event()
+    job = registry.submit("backup", {}, lambda job: release.wait(5))
+    try:
+        assert registry.active_count() == 1
+    finally:
+        release.set()
+    for _ in range(500):
+        if job.finished:
+            break
+        time.sleep(0.01)
+    assert registry.active_count() == 0
+
+
+def test_when_ready_warms_up_the_app_before_forking():
+    messages = []
+    server = SimpleNamespace(log=SimpleNamespace(info=lambda message, *args: messages.append(message % args)))
+
+    try:
+        CONFIG["when_ready"](server)
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+
+    assert messages and all(step in messages[0] for step in ("bootstrap", "machine_configs", "engine"))
+    assert CONFIG["_rss_mb"]() > 0
@@ -0,0 +1,54 @@
+from fastapi.testclient import TestClient
+
+from backend import main_import
+from backend.metrics import PLOT_MOCK_FALLBACKS, PLOT_REQUESTS, Histogram, percentile
+
+
+client = TestClient(main_import.app)
+
+
+def test_percentile_uses_the_nearest_rank():
+    values = [float(number) for number in range(1, 11)]
+
+    assert percentile(values, 0.50) == 5.0
+    assert percentile(values, 0.90) == 9.0
+    assert percentile(values, 0.95) == 10.0
+    assert percentile([float(number) for number in range(1, 101)], 0.99) == 99.0
+    assert percentile([1.0], 0.5) == 1.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("demo_seconds", "Demo.", ["stage"], buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="parse")
+    histogram.observe(0.5, stage="parse")
+    histogram.observe(5.0, stage="parse")
+
+    lines = list(histogram.samples())
+
+    assert 'demo_seconds_bucket{stage="parse",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{stage="parse",le="1"} 2' in lines
+    assert 'demo_seconds_bucket{stage="parse",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{stage="parse"} 3' in lines
+
+
+def test_plot_request_reports_stages_in_server_timing_and_metrics():
+    # Without ncplot7py the engine fails and the mock parser answers
+    fallbacks_before = sum(PLOT_MOCK_FALLBACKS.value(reason=reason) for reason in ("engine_failed", "empty_output"))
+    requests_before = PLOT_REQUESTS.value(outcome="mock") + PLOT_REQUESTS.value(outcome="success")
+
+    response = client.post("/cgiserver_import", json={"machinedata": [{"program": "G1 X10 Y10\nG1 X20", "canalNr": "1"}]})
+
+    assert response.status_code == 200
+    stages = [entry.split(";")[0] for entry in response.headers["server-timing"].split(", ")]
+    assert stages[:5] == ["parse", "bootstrap", "sanitize", "state_setup", "engine"]
+    assert stages[-2:] == ["serialize", "total"]
+    assert PLOT_REQUESTS.value(outcome="mock") + PLOT_REQUESTS.value(outcome="success") == requests_before + 1
+    if main_import.NCExecutionEngine is None:
+        assert sum(PLOT_MOCK_FALLBACKS.value(reason=reason) for reason in ("engine_failed", "empty_output")) == fallbacks_before + 1
+
+    metrics = client.get("/metrics")
+
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert 'ncplot_stage_duration_seconds_count{stage="parse"}' in metrics.text
+    assert 'http_request_duration_seconds_count{method="POST",route="/cgiserver_import",status="200"}' in metrics.text
@@ -0,0 +1,153 @@
+import contextvars
+import pstats
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from backend import main_import, profiling
+from backend.profiling import DeterministicProfiler, ProfileStore, SamplingProfiler
+
+
+PLOT_REQUEST = {"machinedata": [{"program": "G1 X10 Y10\nG1 X20", "canalNr": "1"}]}
+
+
+@pytest.fixture
+def profiled_client(monkeypatch, tmp_path):
+    # The middleware is only installed when PROFILE_TOKEN is set at import, so wrap the app here
+    monkeypatch.setattr(main_import, "PROFILE_TOKEN", "admin-token")
+    store = ProfileStore(str(tmp_path), keep=2, max_concurrent=1)
+    monkeypatch.setattr(profiling, "_profile_store", store)
+    app = BaseHTTPMiddleware(main_import.app, dispatch=main_import.profile_request)
+    return TestClient(app), store
+
+
+def test_profiled_plot_request_stores_report_with_sampled_event_loop(profiled_client):
+    client, store = profiled_client
+
+    response = client.post("/cgiserver_import", json=PLOT_REQUEST,
+                           headers={"X-Profile": "admin-token", "X-Profile-Mode": "cprofile"})
+
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+    report = client.get(response.headers["x-profile-report"], headers={"X-Profile": "admin-token"}).json()
+    assert report["path"] == "/cgiserver_import"
+    assert report["mode"] == "cprofile"
+    assert set(report["event_loop"]) >= {"samples", "adapter", "ncplot7py"}
+    assert store.stats_path(profile_id) is not None
+    assert client.get(f"/api/profiles/{profile_id}/pstats", headers={"X-Profile": "admin-token"}).status_code == 200
+
+
+def test_profiling_needs_the_token_and_is_limited_to_one_request_at_a_time(profiled_client):
+    client, store = profiled_client
+
+    plain = client.post("/cgiserver_import", json=PLOT_REQUEST)
+    assert "x-profile-id" not in plain.headers
+    assert client.post("/cgiserver_import", json=PLOT_REQUEST, headers={"X-Profile": "wrong"}).status_code == 403
+    assert client.get("/api/profiles", headers={"X-Profile": "wrong"}).status_code == 403
+
+    assert store.try_acquire()
+    try:
+        busy = client.post("/cgiserver_import", json=PLOT_REQUEST, headers={"X-Profile": "admin-token"})
+    finally:
+        store.release()
+
+    assert busy.status_code == 200
+    assert busy.headers["x-profile-skipped"] == "busy"
+    assert client.get("/api/profiles", headers={"X-Profile": "admin-token"}).json() == {"profiles": []}
+
+
+def test_profile_store_keeps_only_the_newest_reports(tmp_path):
+    store = ProfileStore(str(tmp_path), keep=2)
+    ids = []
+    for number in range(3):
+        ids.append(store.save({"path": f"/request/{number}"}, SamplingProfiler()))
+        time.sleep(0.01)
+
+    assert store.load(ids[0]) is None
+    assert [entry["id"] for entry in store.list()] == [ids[2], ids[1]]
+
+
+def test_sampling_profiler_counts_only_engine_and_adapter_stacks():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        main_import.sanitize_program("G1 X10 Y10\n" * 50)
+    profiler.stop()
+
+    report = profiler.report()
+
+    assert report["samples"] > 0
+    assert any("(sanitize_program)" in row["function"] for row in report["adapter"])
+    assert report["ncplot7py"] == [] or report["ncplot7py"][0]["function"].startswith("ncplot7py/")
+
+
+def busy_until(stop):
+    while not stop.is_set():
+        main_import.sanitize_program("G1 X10 Y10\n" * 50)
+
+
+def busy_for_request(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        main_import.sanitize_program("G1 X10 Y10\n" * 50)
+
+
+def test_sampling_profiler_leaves_out_threads_of_other_requests():
+    stop = threading.Event()
+    other_request = threading.Thread(target=busy_until, args=(stop,))
+    profiler = SamplingProfiler(interval=0.001)
+    token = profiling.current_profiler.set(profiler)
+    other_request.start()
+    try:
+        profiler.start()
+        # Work handed to the pool with the request's context, as run_in_threadpool does
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(profiling.profiled(busy_for_request), 0.1))
+        worker.start()
+        worker.join()
+    finally:
+        profiling.current_profiler.reset(token)
+        profiler.stop()
+        stop.set()
+        other_request.join()
+
+    functions = [row["function"] for row in profiler.report()["adapter"]]
+    assert any("(busy_for_request)" in function for function in functions)
+    assert not any("(busy_until)" in function for function in functions)
+
+
+def test_cprofile_mode_does_not_trace_the_event_loop_thread():
+    profiler = DeterministicProfiler(interval=0.001)
+    profiler.start()
+    try:
+        # Stands in for another request's coroutine running on the loop meanwhile
+        busy_for_request(0.01)
+        with profiler.thread():
+            main_import.sanitize_program("G1 X10 Y10")
+    finally:
+        profiler.stop()
+
+    names = {name for _, _, name in profiler.stats().stats}
+    assert "sanitize_program" in names
+    assert "busy_for_request" not in names
+
+
+def fake_syncro_plot():
+    return [{"plot": [{"x": [0, 1], "y": [0, 1], "z": [0, 0], "t": 1, "lineNumber": 1}], "programExec": [1]}]
+
+
+def test_cprofile_mode_traces_the_engine_thread(profiled_client, monkeypatch):
+    client, store = profiled_client
+    main_import.load_engine()
+    monkeypatch.setattr(main_import, "UniversalConfigDrivenControl", lambda **kwargs: None)
+    monkeypatch.setattr(main_import, "NCExecutionEngine", lambda control: type("Engine", (), {"get_Syncro_plot": lambda self, programs, sync: fake_syncro_plot()})())
+
+    response = client.post("/cgiserver_import", json=PLOT_REQUEST,
+                           headers={"X-Profile": "admin-token", "X-Profile-Mode": "cprofile"})
+
+    assert response.json()["success"] is True
+    stats = pstats.Stats(store.stats_path(response.headers["x-profile-id"])).stats
+    assert any(name == "fake_syncro_plot" for _, _, name in stats)
@@ -0,0 +1,55 @@
+import json
+import logging
+
+from fastapi.testclient import TestClient
+
+from backend import structured_logging
+from backend.main_import import app
+from backend.structured_logging import JsonFormatter, Preview, SamplingFilter, bind_request, redact_headers, unbind_request
+
+
+client = TestClient(app)
+
+
+def make_record(level=logging.INFO, **fields):
+    record = logging.getLogger("backend.main_import").makeRecord(
+        "backend.main_import", level, __file__, 1, "Plot request", (), None, extra={"fields": fields} if fields else None)
+    return record
+
+
+def test_request_id_is_echoed_or_generated():
+    assert client.get("/api/features", headers={"X-Request-ID": "abc-123"}).headers["x-request-id"] == "abc-123"
+
+    generated = client.get("/api/features", headers={"X-Request-ID": "bad id with spaces"}).headers["x-request-id"]
+    assert generated != "bad id with spaces" and len(generated) == 32
+
+
+def test_json_records_carry_request_id_and_capped_fields():
+    structured_logging.configure_logging()
+    request_id, tokens = bind_request("req-1")
+    try:
+        record = make_record(body=Preview(b"x" * 50, limit=10), canals=2)
+    finally:
+        unbind_request(tokens)
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["request_id"] == "req-1"
+    assert entry["canals"] == 2
+    assert entry["body"] == "xxxxxxxxxx...(+40 chars)"
+    assert redact_headers({"X-API-Key": "secret", "Accept": "*/*"}) == {"X-API-Key": "[redacted]", "Accept": "*/*"}
+
+
+def test_unsampled_requests_only_keep_warnings(monkeypatch):
+    structured_logging.configure_logging()
+    monkeypatch.setattr(structured_logging, "LOG_SAMPLE_RATE", 0.0)
+    _, tokens = bind_request()
+    try:
+        info, warning = make_record(logging.INFO), make_record(logging.WARNING)
+        detail = structured_logging.detail_enabled(logging.getLogger("backend.main_import"))
+    finally:
+        unbind_request(tokens)
+
+    assert not SamplingFilter().filter(info)
+    assert SamplingFilter().filter(warning)
+    assert detail is False
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main_import, tracing
+from backend.focas_simulator import SimulatedFocasLibrary, SimulatorConfig
+from backend.focas_service import RealFocasClient
+
+
+client = TestClient(main_import.app)
+PLOT_REQUEST = {"machinedata": [{"program": "G1 X10 Y10\nG1 X20", "canalNr": "1"}]}
+
+
+@pytest.fixture
+def exported(monkeypatch, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing.get_exporter(), "target", "file")
+    monkeypatch.setattr(tracing.get_exporter(), "path", str(path))
+
+    def spans():
+        if not path.exists():
+            return []
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        return [span for line in lines for span in line["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+    return spans
+
+
+def attributes(span):
+    return {item["key"]: next(iter(item["value"].values())) for item in span["attributes"]}
+
+
+def test_plot_request_exports_server_span_with_stage_children(exported):
+    response = client.post("/cgiserver_import", json=PLOT_REQUEST)
+
+    spans = exported()
+    root = next(span for span in spans if span["name"] == "POST /cgiserver_import")
+    assert response.headers["x-trace-id"] == root["traceId"]
+    assert attributes(root)["plot.canals"] == "1"
+    assert int(attributes(root)["plot.points"]) > 0
+    children = {span["name"] for span in spans if span.get("parentSpanId") == root["spanId"]}
+    assert {"plot.parse", "plot.sanitize", "plot.engine", "plot.serialize", "plot.mock_parse"} <= children
+
+
+def test_incoming_traceparent_is_continued_or_left_unsampled(exported):
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+
+    client.get("/api/focas/diagnostics", headers={"traceparent": f"00-{trace_id}-{parent_id}-01"})
+    client.get("/api/focas/diagnostics", headers={"traceparent": f"00-{'1' * 32}-{parent_id}-00"})
+
+    spans = exported()
+    assert [(span["traceId"], span["parentSpanId"]) for span in spans] == [(trace_id, parent_id)]
+
+
+def test_focas_client_methods_become_spans_with_the_controller(exported):
+    lib = SimulatedFocasLibrary(SimulatorConfig(handshake_latency=0))
+    sim_client = RealFocasClient(lib=lib)
+
+    with tracing.trace_span("job") as job:
+        assert sim_client.connect("10.0.7.1")
+        sim_client.list_programs(1)
+        sim_client.disconnect()
+
+    spans = exported()
+    by_name = {span["name"]: span for span in spans}
+    assert by_name["focas.list_programs"]["parentSpanId"] == job.span_id
+    assert attributes(by_name["focas.connect"])["focas.controller"] == "10.0.7.1:8193"
+
+
+def test_tracing_is_off_by_default():
+    assert not tracing.tracing_enabled()
+    span, token = tracing.start_span("anything")
+    assert span is tracing.UNSAMPLED and token is None
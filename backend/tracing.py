@@ -0,0 +1,225 @@
+import contextvars
+import functools
+import json
+import os
+import random
+import re
+import sys
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+# Where finished spans go: "" (tracing off), "console" (stdout) or "file" (TRACE_FILE)
+TRACE_EXPORT = os.environ.get("TRACE_EXPORT", "").lower()
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+# Share of new traces that are recorded; traces continued from a traceparent header follow its flag
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "nc-edit7-backend")
+# Finished spans buffered before they are written even though their trace is still open
+TRACE_MAX_BUFFER = 512
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_ERROR = 2
+
+
+class Span:
+    """One timed operation of a trace, in the shape of an OpenTelemetry span."""
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "start_ns", "end_ns", "attributes", "status", "local_root")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str], kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None, local_root: bool = False):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status: Optional[Dict[str, Any]] = None
+        # Ending a local root (no parent in this process) flushes the buffered spans
+        self.local_root = local_root
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = {"code": STATUS_ERROR, "message": f"{type(error).__name__}: {error}"}
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            _exporter.finished(self)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        if self.status:
+            span["status"] = self.status
+        return span
+
+
+class _Unsampled:
+    """Stand-in for spans of traces that are not recorded; every operation is a no-op."""
+    trace_id = None
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+
+UNSAMPLED = _Unsampled()
+current_span: "contextvars.ContextVar[Any]" = contextvars.ContextVar("current_span", default=None)
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class SpanExporter:
+    """Buffers finished spans and writes them as OTLP/JSON ExportTraceServiceRequest lines."""
+    def __init__(self, target: str = TRACE_EXPORT, path: str = TRACE_FILE):
+        self.target = target
+        self.path = path
+        self._lock = Lock()
+        self._buffer: List[Span] = []
+
+    def finished(self, span: Span):
+        with self._lock:
+            self._buffer.append(span)
+            if not span.local_root and len(self._buffer) < TRACE_MAX_BUFFER:
+                return
+            spans, self._buffer = self._buffer, []
+        self.write(spans)
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", TRACE_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "nc-edit7"}, "spans": [span.to_otlp() for span in spans]}],
+        }]}
+
+    def write(self, spans: List[Span]):
+        line = json.dumps(self.payload(spans), separators=(",", ":"))
+        if self.target == "file":
+            with self._lock, open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(line + "\n")
+        elif self.target == "console":
+            print(line, file=sys.stdout, flush=True)
+
+
+_exporter = SpanExporter()
+
+
+def tracing_enabled() -> bool:
+    return _exporter.target in ("console", "file")
+
+
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, traceparent: Optional[str] = None, **attributes: Any):
+    """Start a child of the current span, or a new trace when there is none.
+
+    Returns the span (or the no-op UNSAMPLED) and a context token for end_span.
+    """
+    parent = current_span.get()
+    if parent is UNSAMPLED or not tracing_enabled():
+        return UNSAMPLED, None
+    if parent is not None:
+        span = Span(name, parent.trace_id, parent.span_id, kind, attributes)
+    else:
+        match = _TRACEPARENT.match(traceparent or "")
+        if match:
+            if not int(match.group(3), 16) & 1:
+                return UNSAMPLED, current_span.set(UNSAMPLED)
+            span = Span(name, match.group(1), match.group(2), kind, attributes, local_root=True)
+        elif random.random() < TRACE_SAMPLE_RATE:
+            span = Span(name, f"{random.getrandbits(128):032x}", None, kind, attributes, local_root=True)
+        else:
+            return UNSAMPLED, current_span.set(UNSAMPLED)
+    return span, current_span.set(span)
+
+
+def end_span(span: Any, token: Optional[contextvars.Token]):
+    span.end()
+    if token is not None:
+        current_span.reset(token)
+
+
+class trace_span:
+    """`with trace_span("name", key=value) as span:` around a block of code."""
+    def __init__(self, name: str, **attributes: Any):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.span, self.token = start_span(self.name, **self.attributes)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.span.record_error(exc)
+        end_span(self.span, self.token)
+        return False
+
+
+def traced(name: str, attributes: Optional[Callable[..., Dict[str, Any]]] = None):
+    """Decorator that runs the function in a span; `attributes(*args, **kwargs)` may add span attributes."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any):
+            if not tracing_enabled() or current_span.get() is UNSAMPLED:
+                return func(*args, **kwargs)
+            with trace_span(name, **(attributes(*args, **kwargs) if attributes else {})):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def set_span_attribute(key: str, value: Any):
+    span = current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def record_span(name: str, duration: float, **attributes: Any):
+    """Record an already finished child span of the current span that lasted `duration` seconds until now."""
+    parent = current_span.get()
+    if parent is None or parent is UNSAMPLED:
+        return
+    span = Span(name, parent.trace_id, parent.span_id, attributes=attributes)
+    span.end_ns = time.time_ns()
+    span.start_ns = span.end_ns - int(duration * 1e9)
+    _exporter.finished(span)
+
+
+def get_exporter() -> SpanExporter:
+    return _exporter
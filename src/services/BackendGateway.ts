@@ -16,6 +16,9 @@ import { IConfigService } from './config/IConfigService';
 // Simple API Key for basic security
 const API_KEY = 'nc-edit7-secret-key';
 
+// The backend keeps a separate DEMO controller program store per session; one session per browser tab
+const DEMO_SESSION_STORAGE_KEY = 'nc-demo-session';
+
 export interface BackendConfig {
   baseUrl: string;
   timeout: number;
@@ -26,6 +29,7 @@ export class BackendGateway {
   private config: BackendConfig;
   private abortControllers = new Map<string, AbortController>();
   private configService: IConfigService;
+  private demoSessionId: string | null = null;
 
   constructor(config?: Partial<BackendConfig>) {
     this.configService = ServiceRegistry.getInstance().get(CONFIG_SERVICE_TOKEN);
@@ -61,6 +65,33 @@ export class BackendGateway {
     return `http://127.0.0.1:${port}/api/focas/${path}`;
   }
 
+  private getDemoSessionId(): string {
+    if (this.demoSessionId) return this.demoSessionId;
+    let sessionId: string | null = null;
+    try {
+      sessionId = sessionStorage.getItem(DEMO_SESSION_STORAGE_KEY);
+    } catch {
+      // Storage can be blocked; the session then lasts as long as this gateway
+    }
+    if (!sessionId) {
+      sessionId =
+        typeof crypto !== 'undefined' && typeof crypto.randomUUID === 'function'
+          ? crypto.randomUUID()
+          : Math.random().toString(36).slice(2);
+      try {
+        sessionStorage.setItem(DEMO_SESSION_STORAGE_KEY, sessionId);
+      } catch {
+        // See above
+      }
+    }
+    this.demoSessionId = sessionId;
+    return sessionId;
+  }
+
+  private focasHeaders(headers: Record<string, string> = {}): Record<string, string> {
+    return { ...headers, 'X-Demo-Session': this.getDemoSessionId() };
+  }
+
   async focasPing(ip: string): Promise<import('@core/types').FocasPingResponse> {
     const url = await this.getFocasUrl('ping');
     const response = await fetch(`${url}?ip_address=${ip}`);
@@ -72,7 +103,7 @@ export class BackendGateway {
     const url = await this.getFocasUrl('connect');
     const response = await fetch(url, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: this.focasHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.stringify({ ip_address: ip, port, timeout: 10 })
     });
     if (!response.ok) throw new Error(await response.text());
@@ -81,14 +112,14 @@ export class BackendGateway {
 
   async focasListPrograms(ip: string, pathNo: number, port: number = 8193): Promise<FocasListResponse> {
     const url = await this.getFocasUrl(`programs/${pathNo}`);
-    const response = await fetch(`${url}?ip_address=${ip}&port=${port}`);
+    const response = await fetch(`${url}?ip_address=${ip}&port=${port}`, { headers: this.focasHeaders() });
     if (!response.ok) throw new Error(await response.text());
     return response.json();
   }
 
   async focasUpload(ip: string, pathNo: number, progNum: number, port: number = 8193): Promise<FocasUploadResponse> {
     const url = await this.getFocasUrl(`upload/${pathNo}/${progNum}`);
-    const response = await fetch(`${url}?ip_address=${ip}&port=${port}`);
+    const response = await fetch(`${url}?ip_address=${ip}&port=${port}`, { headers: this.focasHeaders() });
     if (!response.ok) throw new Error(await response.text());
     return response.json();
   }
@@ -97,7 +128,7 @@ export class BackendGateway {
     const url = await this.getFocasUrl(`download/${pathNo}`);
     const response = await fetch(`${url}?ip_address=${ip}&port=${port}`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: this.focasHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.stringify({ program_text: programText })
     });
     if (!response.ok) throw new Error(await response.text());